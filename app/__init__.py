@@ -10,6 +10,20 @@ from flask_admin import Admin
 import flask_whooshalchemyplus as whooshalchemy
 from flask_babelex import Babel
 from flask_wtf.csrf import CSRFProtect
+from .storage import BlobStorage
+from .resumable import ResumableUploads
+from .search import SearchIndexer
+from .profiler import QueryProfiler
+from .presence import PresenceTracker
+from .identity import IdentityCache
+from .fragments import FragmentCache
+from .derivatives import DerivativeGenerator
+from .content import ContentIndexer
+from .segmentation import JiebaDictionary
+from .email import MailQueue
+from .tags import TagService
+from .suggest import SuggestionIndex
+from .codes import CodeRegistry
 
 
 bootstrap = Bootstrap()
@@ -19,6 +33,20 @@ admin = Admin(name='后台管理', template_mode='bootstrap3')
 db = SQLAlchemy()
 babel = Babel()
 csrf = CSRFProtect()
+blob_storage = BlobStorage()
+resumable_uploads = ResumableUploads()
+search_indexer = SearchIndexer()
+query_profiler = QueryProfiler()
+presence_tracker = PresenceTracker()
+identity_cache = IdentityCache()
+fragment_cache = FragmentCache()
+derivative_generator = DerivativeGenerator()
+content_indexer = ContentIndexer()
+jieba_dictionary = JiebaDictionary()
+mail_queue = MailQueue()
+tag_service = TagService()
+suggestions = SuggestionIndex()
+code_registry = CodeRegistry()
 
 # 注册用认证
 login_manager = LoginManager()
@@ -29,6 +57,8 @@ login_manager.login_view = 'auth.login'
 def create_app(config_name):
     from .main import main as main_blueprint
     from .auth import auth as auth_blueprint
+    from .upload import upload as upload_blueprint
+    from .oai import oai as oai_blueprint
 
     app = Flask(__name__)
     app.config.from_object(config[config_name])
@@ -36,13 +66,27 @@ def create_app(config_name):
 
     bootstrap.init_app(app)
     mail.init_app(app)
+    mail_queue.init_app(app)
     moment.init_app(app)
     db.init_app(app)
     login_manager.init_app(app)
     admin.init_app(app)
     whooshalchemy.init_app(app)
+    search_indexer.init_app(app)
+    query_profiler.init_app(app)
+    presence_tracker.init_app(app)
+    identity_cache.init_app(app)
+    fragment_cache.init_app(app)
+    tag_service.init_app(app)
+    suggestions.init_app(app)
+    code_registry.init_app(app)
     babel.init_app(app)
     csrf.init_app(app)
+    blob_storage.init_app(app)
+    resumable_uploads.init_app(app)
+    derivative_generator.init_app(app)
+    content_indexer.init_app(app)
+    jieba_dictionary.init_app(app)
 
     from .models import User, Role, File, UserView, \
         RoleView, FileView, TagView, Tag, Dossier, \
@@ -56,5 +100,9 @@ def create_app(config_name):
 
     app.register_blueprint(main_blueprint)
     app.register_blueprint(auth_blueprint, url_prefix='/auth')
+    app.register_blueprint(upload_blueprint, url_prefix='/upload')
+    # 收割程序以POST提交时不带CSRF令牌
+    csrf.exempt(oai_blueprint)
+    app.register_blueprint(oai_blueprint, url_prefix='/oai')
 
     return app
@@ -0,0 +1,95 @@
+# -*- coding:utf-8 -*-
+"""File的变更日志
+
+每次flush时把新增、修改、删除的资源写入 ``file_changes``，与业务
+数据在同一事务中提交。增量消费者记下处理到的seq，之后只需读取
+``changes_since(seq)``。把verified置为True（删除）记为delete，
+同时记下 ``deleted_at``。
+"""
+from datetime import datetime, timedelta
+
+from flask_sqlalchemy import SignallingSession
+from sqlalchemy import event, select
+from sqlalchemy.orm import object_session
+from sqlalchemy.orm.attributes import get_history
+
+from .models import File, FileChange, Dossier
+
+
+def record_changes(session, file_ids, action):
+    """登记不经过flush的变动，如批量插入"""
+    now = datetime.utcnow()
+    rows = [dict(file_id=id, action=action, changed_at=now)
+            for id in file_ids]
+    if rows:
+        session.execute(FileChange.__table__.insert(), rows)
+
+
+def changes_since(seq, limit=500, settle=0):
+    """seq之后的变更，按seq升序
+
+    自增的seq在事务提交前就已分配，并发写入时较小的seq可能较晚才
+    可见。只返回settle秒之前的变更，给未提交的事务留出时间。
+    """
+    query = FileChange.query.filter(FileChange.seq > seq)
+    if settle:
+        query = query.filter(FileChange.changed_at <=
+                             datetime.utcnow() - timedelta(seconds=settle))
+    return query.order_by(FileChange.seq).limit(limit).all()
+
+
+def _collect(session, flush_context, instances):
+    # 上次flush失败时留下的记录随之丢弃
+    pending = session.info['file_changes'] = []
+    now = datetime.utcnow()
+    for obj in session.new:
+        if isinstance(obj, File):
+            pending.append((obj, FileChange.CREATE))
+    for obj in session.deleted:
+        if isinstance(obj, File):
+            pending.append((obj, FileChange.DELETE))
+    for obj in session.dirty:
+        if not isinstance(obj, File) or \
+                not session.is_modified(obj, include_collections=False):
+            continue
+        history = get_history(obj, 'verified')
+        if history.has_changes() and history.added and history.added[0]:
+            obj.deleted_at = now
+            pending.append((obj, FileChange.DELETE))
+        else:
+            if history.has_changes():
+                # 恢复被删除的资源
+                obj.deleted_at = None
+            pending.append((obj, FileChange.UPDATE))
+
+
+def _write(session, flush_context):
+    pending = session.info.pop('file_changes', None)
+    if not pending:
+        return
+    now = datetime.utcnow()
+    session.execute(FileChange.__table__.insert(), [
+        dict(file_id=obj.id, action=action, changed_at=now)
+        for obj, action in pending
+    ])
+
+
+def _dossier_updated(mapper, connection, target):
+    """案卷改名后其下资源的导出内容随之变化，逐一记为update"""
+    session = object_session(target)
+    if not session.is_modified(target, include_collections=False):
+        return
+    files = File.__table__
+    ids = [row[0] for row in connection.execute(
+        select([files.c.id]).where(files.c.dossier_id == target.id))]
+    if ids:
+        now = datetime.utcnow()
+        connection.execute(FileChange.__table__.insert(), [
+            dict(file_id=id, action=FileChange.UPDATE, changed_at=now)
+            for id in ids
+        ])
+
+
+event.listen(SignallingSession, 'before_flush', _collect)
+event.listen(SignallingSession, 'after_flush', _write)
+event.listen(Dossier, 'after_update', _dossier_updated)
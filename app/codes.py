@@ -0,0 +1,109 @@
+# -*- coding:utf-8 -*-
+import threading
+from collections import OrderedDict
+
+from sqlalchemy import event, select
+from sqlalchemy.exc import IntegrityError
+
+# 以代码保存的File字段及其取值所在的配置项，代码即取值在配置中的序号
+CODE_FIELDS = OrderedDict([
+    ('language', 'LANGUAGES'),
+    ('carrier_type', 'FILE_TYPES'),
+    ('classification_level', 'CONFIDENTIALITIES'),
+])
+
+
+class CodeRegistry(object):
+    """代码与名称的对照
+
+    语言、载体类型和密级在File中保存为 ``<字段>_id`` 小整数代码，名称在
+    各自的代码表中。代码表很小且几乎不变，每个进程第一次使用时读入内存，
+    之后表单、模板和后台管理取名称都不访问数据库；配置中新增的取值在
+    读入时追加到代码表。
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self.models = {}
+        self._labels = None
+        self._codes = None
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        app.extensions['codes'] = self
+
+    def watch(self, **models):
+        """models为 {字段: 代码表模型}，代码表被修改时重新读入"""
+        self.models = models
+
+        def changed(mapper, connection, target):
+            self.invalidate()
+
+        for model in models.values():
+            for name in ('after_insert', 'after_update', 'after_delete'):
+                event.listen(model, name, changed)
+
+    def invalidate(self):
+        with self._lock:
+            self._labels = self._codes = None
+
+    def _sync(self, connection, field):
+        """读出一个代码表，并补上配置中新增的取值"""
+        table = self.models[field].__table__
+        labels = OrderedDict(
+            (row.id, row.name) for row in connection.execute(
+                select([table.c.id, table.c.name]).order_by(table.c.id)))
+        missing = [(code, label) for code, label
+                   in enumerate(self.app.config[CODE_FIELDS[field]], 1)
+                   if label not in labels.values()]
+        for code, label in missing:
+            if code in labels:
+                code = max(labels) + 1
+            connection.execute(table.insert().values(id=code, name=label))
+            labels[code] = label
+        return OrderedDict(sorted(labels.items()))
+
+    def _load(self):
+        from . import db
+        for attempt in range(2):
+            try:
+                with db.engine.begin() as connection:
+                    return dict((field, self._sync(connection, field))
+                                for field in CODE_FIELDS)
+            except IntegrityError:
+                # 其他进程同时补充了代码表，重新读一次
+                if attempt:
+                    raise
+
+    def _tables(self):
+        with self._lock:
+            if self._labels is None:
+                self._labels = self._load()
+                self._codes = dict(
+                    (field, dict((label, code)
+                                 for code, label in labels.items()))
+                    for field, labels in self._labels.items())
+            return self._labels, self._codes
+
+    def label(self, field, code):
+        """代码对应的名称，未知代码返回None"""
+        if code is None:
+            return None
+        return self._tables()[0][field].get(code)
+
+    def code(self, field, label):
+        """名称对应的代码，未知名称返回None"""
+        if label is None:
+            return None
+        return self._tables()[1][field].get(label)
+
+    def codes(self, field):
+        """{名称: 代码}"""
+        return dict(self._tables()[1][field])
+
+    def choices(self, field):
+        """表单的 [(代码, 名称)]"""
+        return list(self._tables()[0][field].items())
@@ -0,0 +1,300 @@
+# -*- coding:utf-8 -*-
+import codecs
+import multiprocessing
+import os
+import subprocess
+import shutil
+import threading
+import time
+import zipfile
+from xml.etree import ElementTree
+
+import flask_sqlalchemy
+import whoosh.index
+from sqlalchemy import event
+from sqlalchemy.orm.attributes import get_history
+from whoosh.analysis import RegexTokenizer, LowercaseFilter
+from whoosh.fields import Schema, ID, TEXT
+from whoosh.qparser import QueryParser
+
+from .outbox import Outbox
+
+# 独立于资源元数据索引的全文索引目录名
+CONTENT_INDEX = 'FileContent'
+
+# 文本在抽取进程中已用jieba分词，索引时按空白切分即可
+SCHEMA = Schema(id=ID(stored=True, unique=True),
+                content=TEXT(analyzer=RegexTokenizer(r'\S+') |
+                             LowercaseFilter()))
+
+_WORD_NS = '{http://schemas.openxmlformats.org/wordprocessingml/2006/main}'
+
+
+def segment(text):
+    import jieba
+    return u' '.join(word for word in jieba.cut_for_search(text)
+                     if word.strip())
+
+
+def _plain_text(path, max_chars):
+    # 中文文本多为UTF-8或GB18030编码；按字节读取足够多的内容即可
+    with open(path, 'rb') as f:
+        data = f.read(max_chars * 4)
+        complete = not f.read(1)
+    for encoding in ('utf-8-sig', 'gb18030'):
+        # 读取的内容可能截断在多字节字符中间，增量解码器会忽略末尾
+        # 不完整的字节，而不是判定编码不对
+        decoder = codecs.getincrementaldecoder(encoding)()
+        try:
+            return decoder.decode(data, final=complete)
+        except UnicodeDecodeError:
+            pass
+    return data.decode('utf-8', 'replace')
+
+
+def _docx_text(path):
+    try:
+        with zipfile.ZipFile(path) as docx:
+            xml = docx.read('word/document.xml')
+    except (zipfile.BadZipfile, KeyError):
+        return None
+    paragraphs = []
+    for paragraph in ElementTree.fromstring(xml).iter(_WORD_NS + 'p'):
+        paragraphs.append(u''.join(node.text or u'' for node in
+                                   paragraph.iter(_WORD_NS + 't')))
+    return u'\n'.join(paragraphs)
+
+
+def _pdf_text(path, timeout):
+    try:
+        from pdfminer.high_level import extract_text
+    except ImportError:
+        pass
+    else:
+        return extract_text(path)
+    pdftotext = shutil.which('pdftotext')
+    if pdftotext is None:
+        return None
+    try:
+        output = subprocess.check_output(
+            [pdftotext, '-q', '-enc', 'UTF-8', path, '-'],
+            stdin=subprocess.DEVNULL, timeout=timeout)
+    except (OSError, subprocess.SubprocessError):
+        return None
+    return output.decode('utf-8', 'replace')
+
+
+def extract_text(path, filename, max_chars, timeout):
+    """抽取PDF、DOCX和纯文本文件的文字，不支持的格式返回None"""
+    with open(path, 'rb') as f:
+        head = f.read(5)
+    if head == b'%PDF-':
+        text = _pdf_text(path, timeout)
+    elif head.startswith(b'PK'):
+        text = _docx_text(path)
+    elif os.path.splitext(filename or path)[1].lower() in ('.txt', '.csv',
+                                                           '.md'):
+        text = _plain_text(path, max_chars)
+    else:
+        return None
+    return text[:max_chars] if text else None
+
+
+def _extract(job):
+    """在进程池中运行，返回分词后的文本"""
+    id, path, filename, max_chars, timeout = job
+    text = extract_text(path, filename, max_chars, timeout)
+    return segment(text) if text else None
+
+
+class ContentIndexer(object):
+    """抽取上传文件的文字，写入独立的全文索引
+
+    资源提交后其id被写入本地队列（``CONTENT_QUEUE``），由
+    ``python manage.py content_worker`` 在进程池中抽取文字并用jieba分词，
+    再写入 ``WHOOSH_BASE/FileContent``，不增加资源元数据索引的体积。
+    超过 ``CONTENT_MAX_FILE_SIZE`` 的文件不处理；单个文件抽取超过
+    ``CONTENT_TIMEOUT`` 秒时放弃该文件并重建进程池，不会拖住整个队列。
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self.outbox = None
+        self._pool = None
+        self._worker_pid = None
+        self._lock = threading.Lock()
+        event.listen(flask_sqlalchemy.SignallingSession, 'after_flush',
+                     self._collect)
+        event.listen(flask_sqlalchemy.SignallingSession, 'after_commit',
+                     self._enqueue)
+        event.listen(flask_sqlalchemy.SignallingSession, 'after_rollback',
+                     self._discard)
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        config = app.config
+        self.directory = os.path.join(config['WHOOSH_BASE'], CONTENT_INDEX)
+        self.max_file_size = config.get('CONTENT_MAX_FILE_SIZE',
+                                        50 * 1024 * 1024)
+        self.max_chars = config.get('CONTENT_MAX_CHARS', 500000)
+        self.timeout = config.get('CONTENT_TIMEOUT', 60)
+        self.procs = config.get('CONTENT_PROCS', 2)
+        self.batch_size = config.get('CONTENT_BATCH_SIZE', 20)
+        self.interval = config.get('CONTENT_INTERVAL', 5)
+        self.outbox = Outbox(config['CONTENT_QUEUE'], 'content_index',
+                             lease=max(600, self.timeout * self.batch_size))
+        app.extensions['content_indexer'] = self
+        if config.get('CONTENT_EXTRACTOR_THREAD', False):
+            app.before_request(self.ensure_worker)
+
+    def get_index(self):
+        if whoosh.index.exists_in(self.directory):
+            return whoosh.index.open_dir(self.directory)
+        if not os.path.exists(self.directory):
+            os.makedirs(self.directory)
+        return whoosh.index.create_in(self.directory, SCHEMA)
+
+    def _collect(self, session, flush_context):
+        from .models import File
+        ids = session.info.setdefault('content_changes', set())
+        for obj in session.new:
+            if isinstance(obj, File) and obj.file_path:
+                ids.add(obj.id)
+        for obj in session.dirty | session.deleted:
+            if isinstance(obj, File) and (
+                    obj in session.deleted or
+                    get_history(obj, 'verified').has_changes()):
+                ids.add(obj.id)
+
+    def _enqueue(self, session):
+        ids = session.info.pop('content_changes', None)
+        if ids and self.outbox is not None:
+            self.outbox.put_many([dict(id=id) for id in ids])
+
+    def _discard(self, session):
+        session.info.pop('content_changes', None)
+
+    def backfill(self):
+        """把所有有上传文件的资源加入队列，返回条数"""
+        from . import db
+        from .models import File
+        with self.app.app_context():
+            ids = [id for id, in db.session.query(File.id)
+                   .filter(File.file_path != None)
+                   .filter(File.verified == False)]
+        for start in range(0, len(ids), 1000):
+            self.outbox.put_many([dict(id=id)
+                                  for id in ids[start:start + 1000]])
+        return len(ids)
+
+    def _jobs(self, ids):
+        """返回 (待抽取的任务, 需从索引删除的id)"""
+        from . import db
+        from .models import File
+        jobs = []
+        with self.app.app_context():
+            rows = dict((row[0], row) for row in db.session.query(
+                File.id, File.file_path, File.file_name, File.verified)
+                .filter(File.id.in_(ids)))
+            db.session.remove()
+        removed = [id for id in ids if id not in rows]
+        for id, path, filename, verified in rows.values():
+            if verified or not path or not os.path.isfile(path):
+                removed.append(id)
+            elif os.path.getsize(path) > self.max_file_size:
+                self.app.logger.info('文件过大，不抽取全文: %s', path)
+                removed.append(id)
+            else:
+                jobs.append((id, path, filename, self.max_chars,
+                             self.timeout))
+        return jobs, removed
+
+    def _restart_pool(self):
+        if self._pool is not None:
+            self._pool.terminate()
+            self._pool.join()
+        self._pool = multiprocessing.Pool(self.procs or 1)
+
+    def extract(self, jobs):
+        """在进程池中抽取，返回 {id: 分词后的文本或None}"""
+        results = {}
+        pending = list(jobs)
+        while pending:
+            if self._pool is None:
+                self._restart_pool()
+            submitted = [(job, self._pool.apply_async(_extract, (job,)))
+                         for job in pending]
+            pending = []
+            for i, (job, result) in enumerate(submitted):
+                try:
+                    results[job[0]] = result.get(self.timeout)
+                except multiprocessing.TimeoutError:
+                    self.app.logger.warning('抽取全文超时: %s', job[1])
+                    results[job[0]] = None
+                    # 卡住的进程无法单独结束，重建进程池后继续
+                    self._restart_pool()
+                    pending = [job for job, _ in submitted[i + 1:]]
+                    break
+                except Exception:
+                    self.app.logger.exception('抽取全文失败: %s', job[1])
+                    results[job[0]] = None
+        return results
+
+    def drain(self):
+        """处理队列中所有到期的消息，返回处理的条数"""
+        processed = 0
+        while True:
+            messages = self.outbox.reserve(self.batch_size)
+            if not messages:
+                return processed
+            ids = list(set(payload['id'] for _, payload, _ in messages))
+            jobs, removed = self._jobs(ids)
+            texts = self.extract(jobs)
+            writer = self.get_index().writer(timeout=60)
+            try:
+                for id in removed:
+                    writer.delete_by_term('id', u'%s' % id)
+                for id, text in texts.items():
+                    if text:
+                        writer.update_document(id=u'%s' % id, content=text)
+                    else:
+                        writer.delete_by_term('id', u'%s' % id)
+                writer.commit()
+            except Exception:
+                writer.cancel()
+                raise
+            self.outbox.ack([id for id, _, _ in messages])
+            processed += len(messages)
+
+    def run(self):
+        while True:
+            try:
+                self.drain()
+            except Exception:
+                self.app.logger.exception('全文抽取队列处理失败')
+            time.sleep(self.interval)
+
+    def ensure_worker(self):
+        """确保当前进程中有抽取线程在运行（fork之后需要重新启动）"""
+        if self._worker_pid == os.getpid():
+            return
+        with self._lock:
+            if self._worker_pid == os.getpid():
+                return
+            self._worker_pid = os.getpid()
+            thr = threading.Thread(target=self.run)
+            thr.daemon = True
+            thr.start()
+
+    def search(self, text, page, per_page):
+        """返回 ({id: 名次}, 总数, 实际页码)"""
+        index = self.get_index()
+        parser = QueryParser('content', index.schema)
+        with index.searcher() as searcher:
+            results = searcher.search_page(parser.parse(segment(text)),
+                                           max(page, 1), pagelen=per_page)
+            ranks = dict((int(hit['id']), rank)
+                         for rank, hit in enumerate(results))
+            return ranks, results.total, results.pagenum
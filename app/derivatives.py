@@ -0,0 +1,260 @@
+# -*- coding:utf-8 -*-
+import os
+import shutil
+import subprocess
+import threading
+import time
+
+import flask_sqlalchemy
+from flask import url_for
+from flask_login import current_user
+from sqlalchemy import event
+
+from .outbox import Outbox
+
+# 载体类型对应的派生图生成方式
+KINDS = {'图片': 'image', '视频': 'video', '文档': 'document'}
+
+
+def _image_thumbnail(source, target, size):
+    try:
+        from PIL import Image
+    except ImportError:
+        return False
+    try:
+        image = Image.open(source)
+        # JPEG可在解码时直接缩小，省去大部分解码开销
+        image.draft('RGB', (size, size))
+        image.thumbnail((size, size))
+    except (IOError, OSError, SyntaxError):
+        # 不是Pillow能识别的图片
+        return False
+    if image.mode != 'RGB':
+        image = image.convert('RGB')
+    image.save(target, 'JPEG', quality=85)
+    return True
+
+
+def _run(args, timeout=120):
+    try:
+        return subprocess.call(args, stdin=subprocess.DEVNULL,
+                               stdout=subprocess.DEVNULL,
+                               stderr=subprocess.DEVNULL,
+                               timeout=timeout) == 0
+    except (OSError, subprocess.TimeoutExpired):
+        return False
+
+
+def _video_poster(source, target, size):
+    ffmpeg = shutil.which('ffmpeg')
+    if ffmpeg is None:
+        return False
+    # 取第1秒的画面，不足1秒的视频取第一帧
+    for seek in ('1', '0'):
+        if _run([ffmpeg, '-v', 'error', '-y', '-ss', seek, '-i', source,
+                 '-frames:v', '1',
+                 '-vf', 'scale=w=%d:h=%d:force_original_aspect_ratio='
+                        'decrease' % (size, size),
+                 '-f', 'image2', '-c:v', 'mjpeg', target]) and \
+                os.path.getsize(target) > 0:
+            return True
+    return False
+
+
+def _document_page(source, target, size):
+    with open(source, 'rb') as f:
+        is_pdf = f.read(5) == b'%PDF-'
+    if not is_pdf:
+        # 扫描件等图片格式的文档
+        return _image_thumbnail(source, target, size)
+    pdftoppm = shutil.which('pdftoppm')
+    if pdftoppm is None:
+        return False
+    if not _run([pdftoppm, '-jpeg', '-f', '1', '-l', '1',
+                 '-scale-to', str(size), '-singlefile', source, target]):
+        return False
+    # pdftoppm会在输出文件名后加上扩展名
+    os.replace(target + '.jpg', target)
+    return True
+
+
+_GENERATORS = {
+    'image': _image_thumbnail,
+    'video': _video_poster,
+    'document': _document_page,
+}
+
+
+def generate(source, target, kind, size):
+    """生成一个派生图；缺少所需工具或格式不支持时返回False"""
+    if os.path.exists(target):
+        return True
+    if not os.path.exists(source):
+        return False
+    tmp = '%s.%d.tmp' % (target, os.getpid())
+    try:
+        if not _GENERATORS[kind](source, tmp, size):
+            return False
+        os.replace(tmp, target)
+        return True
+    finally:
+        for path in (tmp, tmp + '.jpg'):
+            if os.path.exists(path):
+                os.remove(path)
+
+
+def _generate(job):
+    try:
+        return generate(*job), None
+    except Exception as e:
+        return False, e
+
+
+class DerivativeGenerator(object):
+    """后台生成缩略图、视频封面和文档首页预览
+
+    新的档案资源提交后，其内容摘要和载体类型被写入本地队列
+    （``DERIVATIVE_QUEUE``），由后台线程或
+    ``python manage.py derivative_worker`` 的进程池处理。派生图按内容
+    摘要保存在原文件旁（``<sha256>.thumb.jpg``），内容相同的文件共用
+    一张；图片用Pillow处理，视频和PDF分别调用ffmpeg和pdftoppm，缺少
+    时跳过。
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self.outbox = None
+        self.root = None
+        self.size = 320
+        self._worker_pid = None
+        self._lock = threading.Lock()
+        event.listen(flask_sqlalchemy.SignallingSession, 'after_flush',
+                     self._collect)
+        event.listen(flask_sqlalchemy.SignallingSession, 'after_commit',
+                     self._enqueue)
+        event.listen(flask_sqlalchemy.SignallingSession, 'after_rollback',
+                     self._discard)
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        self.root = app.config['UPLOAD_DIR']
+        self.size = app.config.get('DERIVATIVE_SIZE', self.size)
+        self.batch_size = app.config.get('DERIVATIVE_BATCH_SIZE', 20)
+        self.interval = app.config.get('DERIVATIVE_INTERVAL', 5)
+        self.outbox = Outbox(app.config['DERIVATIVE_QUEUE'], 'derivatives',
+                             lease=600)
+        app.extensions['derivatives'] = self
+        app.add_template_global(self.thumbnail_url)
+        if app.config.get('DERIVATIVE_THREAD', True):
+            app.before_request(self.ensure_worker)
+
+    def path_for(self, digest):
+        return os.path.join(self.root, digest[:2], digest[2:4],
+                            digest + '.thumb.jpg')
+
+    def thumbnail_url(self, file):
+        """模板中使用，尚未生成或当前用户无权下载时返回None"""
+        from .models import Permission
+        if not current_user.can(Permission.DOWNLOAD_FILE):
+            return None
+        if file.sha256 and os.path.exists(self.path_for(file.sha256)):
+            return url_for('main.thumbnail', digest=file.sha256)
+        return None
+
+    def _collect(self, session, flush_context):
+        from .models import File
+        jobs = session.info.setdefault('derivative_jobs', set())
+        for obj in session.new:
+            if isinstance(obj, File) and obj.sha256 and \
+                    obj.carrier_type in KINDS:
+                jobs.add((obj.sha256, KINDS[obj.carrier_type]))
+
+    def _enqueue(self, session):
+        jobs = session.info.pop('derivative_jobs', None)
+        if jobs and self.outbox is not None:
+            self.put(jobs)
+
+    def _discard(self, session):
+        session.info.pop('derivative_jobs', None)
+
+    def put(self, jobs):
+        """jobs为 [(sha256, 生成方式)]"""
+        self.outbox.put_many([dict(digest=digest, kind=kind)
+                              for digest, kind in jobs])
+
+    def backfill(self):
+        """为还没有派生图的已有资源补充生成任务，返回任务数"""
+        from . import db, code_registry
+        from .models import File
+        jobs = set()
+        with self.app.app_context():
+            # 载体类型代码 -> 生成方式
+            kinds = dict((code, KINDS[label]) for label, code
+                         in code_registry.codes('carrier_type').items()
+                         if label in KINDS)
+            rows = db.session.query(File.sha256, File.carrier_type_id) \
+                .filter(File.sha256 != None) \
+                .filter(File.carrier_type_id.in_(list(kinds))).distinct()
+            for digest, code in rows:
+                if not os.path.exists(self.path_for(digest)):
+                    jobs.add((digest, kinds[code]))
+        if jobs:
+            self.put(jobs)
+        return len(jobs)
+
+    def drain(self, pool=None):
+        """处理队列中所有到期的任务，返回处理的条数"""
+        from . import blob_storage
+        processed = 0
+        while True:
+            messages = self.outbox.reserve(self.batch_size)
+            if not messages:
+                return processed
+            jobs = [(blob_storage.path_for(payload['digest']),
+                     self.path_for(payload['digest']),
+                     payload['kind'], self.size)
+                    for _, payload, _ in messages]
+            results = pool.map(_generate, jobs) if pool is not None \
+                else [_generate(job) for job in jobs]
+            done = []
+            for (id, payload, attempts), (_, error) in zip(messages,
+                                                           results):
+                if error is not None and attempts < 5:
+                    self.app.logger.warning('生成派生图失败 %s: %s',
+                                            payload['digest'], error)
+                    self.outbox.retry(id, min(2 ** attempts * 30, 3600))
+                else:
+                    done.append(id)
+            self.outbox.ack(done)
+            processed += len(messages)
+
+    def run(self, procs=0):
+        """持续处理队列，procs大于0时用进程池并行生成"""
+        pool = None
+        if procs:
+            import multiprocessing
+            pool = multiprocessing.Pool(procs)
+        try:
+            while True:
+                try:
+                    self.drain(pool)
+                except Exception:
+                    self.app.logger.exception('派生图队列读取失败')
+                time.sleep(self.interval)
+        finally:
+            if pool is not None:
+                pool.terminate()
+
+    def ensure_worker(self):
+        """确保当前进程中有生成线程在运行（fork之后需要重新启动）"""
+        if self._worker_pid == os.getpid():
+            return
+        with self._lock:
+            if self._worker_pid == os.getpid():
+                return
+            self._worker_pid = os.getpid()
+            thr = threading.Thread(target=self.run)
+            thr.daemon = True
+            thr.start()
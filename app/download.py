@@ -0,0 +1,115 @@
+# -*- coding:utf-8 -*-
+"""文件下载
+
+支持条件请求（ETag / Last-Modified）和单段Range请求，音视频可以
+拖动播放。配置 ``DOWNLOAD_OFFLOAD`` 后由前端服务器发送文件：
+
+- ``'x-sendfile'``：Apache mod_xsendfile、lighttpd等，直接给出文件路径；
+- ``'x-accel-redirect'``：nginx，把 ``UPLOAD_DIR`` 下的相对路径拼在
+  ``DOWNLOAD_ACCEL_PREFIX`` 之后，该location需设为internal。
+
+此时Python进程在权限检查后立即返回，Range与条件请求由前端服务器处理。
+"""
+import mimetypes
+import os
+from datetime import datetime
+
+from flask import current_app, request
+from werkzeug.datastructures import ContentRange
+from werkzeug.urls import url_quote
+
+
+def content_disposition(filename, inline=False):
+    """兼顾中文文件名的Content-Disposition（RFC 6266）"""
+    fallback = filename.encode('ascii', 'ignore').decode('ascii') \
+        .replace('"', '').strip() or 'download'
+    return '%s; filename="%s"; filename*=UTF-8\'\'%s' % (
+        'inline' if inline else 'attachment', fallback,
+        url_quote(filename, safe=''))
+
+
+def _read(path, start, stop, chunk_size):
+    with open(path, 'rb') as f:
+        f.seek(start)
+        remaining = stop - start
+        while remaining > 0:
+            chunk = f.read(min(chunk_size, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+
+
+def _offload(response, path):
+    """交给前端服务器发送，无法处理时返回False"""
+    mode = current_app.config.get('DOWNLOAD_OFFLOAD')
+    if mode == 'x-sendfile':
+        response.headers['X-Sendfile'] = path
+        return True
+    if mode == 'x-accel-redirect':
+        root = os.path.abspath(current_app.config['UPLOAD_DIR'])
+        relative = os.path.relpath(os.path.abspath(path), root)
+        if relative.startswith(os.pardir):
+            return False
+        response.headers['X-Accel-Redirect'] = url_quote(
+            current_app.config['DOWNLOAD_ACCEL_PREFIX'].rstrip('/') + '/' +
+            relative.replace(os.sep, '/'))
+        return True
+    return False
+
+
+def send_stored_file(path, filename, etag=None, inline=False):
+    """发送已保存的文件，path不存在时返回None
+
+    etag默认由修改时间和大小生成；按内容寻址的文件可直接用sha256。
+    """
+    if not path or not os.path.isfile(path):
+        return None
+    stat = os.stat(path)
+    size = stat.st_size
+    mimetype = mimetypes.guess_type(filename)[0] or \
+        'application/octet-stream'
+
+    response = current_app.response_class(mimetype=mimetype)
+    response.headers['Content-Disposition'] = content_disposition(filename,
+                                                                  inline)
+    response.cache_control.private = True
+    if _offload(response, path):
+        return response
+
+    response.set_etag(etag or '%x-%x' % (int(stat.st_mtime), size))
+    # HTTP日期只精确到秒
+    response.last_modified = datetime.utcfromtimestamp(int(stat.st_mtime))
+    response.accept_ranges = 'bytes'
+    response.make_conditional(request)
+    if response.status_code == 304:
+        return response
+
+    start, stop = 0, size
+    ranges = request.range
+    if_range = request.if_range
+    # If-Range与当前版本不符时忽略Range，返回整个文件
+    if ranges is not None and (
+            (if_range.etag is None and if_range.date is None) or
+            (if_range.etag is not None and
+             if_range.etag == response.get_etag()[0]) or
+            (if_range.date is not None and
+             response.last_modified is not None and
+             if_range.date >= response.last_modified)):
+        bounds = ranges.range_for_length(size)
+        if bounds is not None:
+            start, stop = bounds
+            response.status_code = 206
+            response.content_range = ContentRange('bytes', start, stop, size)
+        elif len(ranges.ranges) == 1:
+            response.status_code = 416
+            response.content_range = ContentRange('bytes', None, None, size)
+            response.content_length = 0
+            return response
+        # 多段Range不支持，按整个文件返回
+
+    chunk_size = current_app.config.get('UPLOAD_CHUNK_SIZE', 64 * 1024)
+    response.response = _read(path, start, stop, chunk_size)
+    response.direct_passthrough = True
+    response.content_length = stop - start
+    return response
@@ -1,22 +1,147 @@
 # -*- coding:utf-8 -*-
+import os
+import smtplib
+import threading
+
 from flask_mail import Message
-from . import mail
 from flask import current_app, render_template
-from threading import Thread
 
+from .outbox import Outbox
+
+
+class MailQueue(object):
+    """持久化的邮件发送队列
+
+    ``send_email`` 只把渲染好的邮件写入本地队列（``MAIL_QUEUE``），由
+    每个进程中固定数量（``MAIL_WORKERS``）的发送线程取出，每批邮件共用
+    一个SMTP连接。发送失败的邮件按指数退避重试，超过
+    ``MAIL_MAX_ATTEMPTS`` 次后放弃。也可以关闭 ``MAIL_THREAD``，改为单独
+    运行 ``python manage.py mail_worker``。
+
+    本地调试时可把 ``MAIL_SERVER``/``MAIL_PORT`` 指向
+    ``python -m smtpd -n -c DebuggingServer localhost:1025``。
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self.outbox = None
+        self._worker_pid = None
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        self.workers = app.config.get('MAIL_WORKERS', 2)
+        self.batch_size = app.config.get('MAIL_BATCH_SIZE', 50)
+        self.max_attempts = app.config.get('MAIL_MAX_ATTEMPTS', 8)
+        self.interval = app.config.get('MAIL_INTERVAL', 5)
+        self.outbox = Outbox(app.config['MAIL_QUEUE'], 'mail', lease=300)
+        app.extensions['mail_queue'] = self
+        if app.config.get('MAIL_THREAD', True):
+            app.before_request(self.ensure_worker)
+
+    def put(self, msg):
+        self.outbox.put(dict(subject=msg.subject, sender=msg.sender,
+                             recipients=msg.recipients, body=msg.body,
+                             html=msg.html))
+        self._wakeup.set()
+
+    def depth(self):
+        """队列中尚未发出的邮件数（含等待重试的）"""
+        return self.outbox.depth()
+
+    def _retry(self, id, attempts, error):
+        if attempts + 1 >= self.max_attempts:
+            self.app.logger.error('邮件发送失败，已放弃: %s', error)
+            self.outbox.ack([id])
+        else:
+            self.app.logger.warning('邮件发送失败，稍后重试: %s', error)
+            self.outbox.retry(id, min(2 ** attempts * 30, 3600))
+
+    def deliver(self, messages):
+        """用一个SMTP连接发送一批邮件，返回处理完毕（发出或放弃）的封数
+
+        服务器拒绝某一封邮件时只处理这一封：5xx放弃，4xx稍后重试，然后
+        在同一个连接上继续发送；只有连接断开时本批剩下的邮件才一起重试。
+        """
+        from . import mail
+        done = []
+        pending = list(messages)
+        with self.app.app_context():
+            try:
+                with mail.connect() as conn:
+                    while pending:
+                        id, payload, attempts = pending.pop(0)
+                        try:
+                            conn.send(Message(**payload))
+                        except smtplib.SMTPRecipientsRefused as e:
+                            # 收件地址无效，重试也不会成功
+                            self.app.logger.error('收件人被拒绝: %s',
+                                                  e.recipients)
+                        except smtplib.SMTPResponseException as e:
+                            if e.smtp_code >= 500:
+                                self.app.logger.error(
+                                    '邮件被服务器拒绝，已放弃: %s', e)
+                            else:
+                                self._retry(id, attempts, e)
+                                continue
+                        except (smtplib.SMTPServerDisconnected, OSError):
+                            pending.insert(0, (id, payload, attempts))
+                            raise
+                        except Exception as e:
+                            # 邮件本身有问题（如无法构造），不影响其他邮件
+                            self._retry(id, attempts, e)
+                            continue
+                        done.append(id)
+            except OSError as e:
+                # 连接不可用（smtplib的异常都是OSError），本批剩下的邮件
+                # 都稍后重试
+                for id, payload, attempts in pending:
+                    self._retry(id, attempts, e)
+            finally:
+                self.outbox.ack(done)
+        return len(done)
+
+    def drain(self):
+        """发送队列中所有到期的邮件，返回发出的封数"""
+        sent = 0
+        while True:
+            messages = self.outbox.reserve(self.batch_size)
+            if not messages:
+                return sent
+            sent += self.deliver(messages)
+
+    def run(self):
+        while True:
+            try:
+                self.drain()
+            except Exception:
+                self.app.logger.exception('邮件队列读取失败')
+            self._wakeup.wait(self.interval)
+            self._wakeup.clear()
 
-def send_async_email(app, msg):
-    with app.app_context():
-        mail.send(msg)
+    def ensure_worker(self):
+        """确保当前进程中有发送线程在运行（fork之后需要重新启动）"""
+        if self._worker_pid == os.getpid():
+            return
+        with self._lock:
+            if self._worker_pid == os.getpid():
+                return
+            self._worker_pid = os.getpid()
+            for _ in range(self.workers):
+                thr = threading.Thread(target=self.run)
+                thr.daemon = True
+                thr.start()
 
 
 def send_email(to, subject, template, **kw):
+    from . import mail_queue
     app = current_app._get_current_object()
     msg = Message(app.config['METADATA_MAIL_SUBJECT_PREFIX'] + subject,
                   sender=app.config['METADATA_MAIL_SENDER'],
                   recipients=[to])
     msg.body = render_template(template + '.txt', **kw)
     msg.html = render_template(template + '.html', **kw)
-    thr = Thread(target=send_async_email, args=[app, msg])
-    thr.start()
-    return thr
+    mail_queue.put(msg)
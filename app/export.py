@@ -0,0 +1,219 @@
+# -*- coding:utf-8 -*-
+"""档案著录信息的流式导出
+
+按id顺序以服务器端游标（``stream_results`` + ``yield_per``）逐批读取，
+只查询需要的列，边读边序列化，内存占用与导出的行数无关。
+"""
+import csv
+import io
+import json
+import re
+from datetime import datetime
+from xml.sax.saxutils import escape, quoteattr
+
+from . import db
+from .models import File, Dossier, User, FileView, Language, \
+    CarrierType, ClassificationLevel
+
+# 导出的字段，“全宗或类”、“上传者”及以代码保存的字段导出为名称
+EXPORT_FIELDS = (
+    'id', 'timestamp', 'file_name', 'title_proper', 'title_parallel',
+    'title_sub', 'key_who', 'key_why', 'key_when', 'key_where', 'key_how',
+    'key_what', 'archive_num', 'annotation', 'summary', 'dossier',
+    'language', 'relation_name', 'archive_guide', 'dossier_guide',
+    'coverage_note', 'classification_level', 'retention_period', 'creator_',
+    'publisher', 'contributor', 'rights', 'date', 'version', 'record_type',
+    'carrier_type', 'number', 'specification', 'record_num', 'identifier',
+    'creator'
+)
+
+# 字段对应的Dublin Core元素，其余字段导出为 <archive:field>
+DUBLIN_CORE = (
+    ('title_proper', 'title'),
+    ('title_parallel', 'title'),
+    ('title_sub', 'title'),
+    ('key_who', 'subject'),
+    ('key_why', 'subject'),
+    ('key_when', 'subject'),
+    ('key_where', 'subject'),
+    ('key_how', 'subject'),
+    ('key_what', 'subject'),
+    ('summary', 'description'),
+    ('annotation', 'description'),
+    ('creator_', 'creator'),
+    ('publisher', 'publisher'),
+    ('contributor', 'contributor'),
+    ('date', 'date'),
+    ('record_type', 'type'),
+    ('carrier_type', 'format'),
+    ('specification', 'format'),
+    ('identifier', 'identifier'),
+    ('archive_num', 'identifier'),
+    ('dossier', 'source'),
+    ('language', 'language'),
+    ('relation_name', 'relation'),
+    ('coverage_note', 'coverage'),
+    ('rights', 'rights'),
+)
+
+# 格式: (Content-Type, 扩展名)
+EXPORT_FORMATS = {
+    'csv': ('text/csv; charset=utf-8', 'csv'),
+    'jsonl': ('application/x-ndjson; charset=utf-8', 'jsonl'),
+    'xml': ('application/xml; charset=utf-8', 'xml'),
+}
+
+# XML 1.0 不允许的控制字符
+_INVALID_XML = re.compile('[\x00-\x08\x0b\x0c\x0e-\x1f]')
+
+
+# 以代码保存的字段及其代码表
+_CODE_TABLES = {
+    'language': Language,
+    'carrier_type': CarrierType,
+    'classification_level': ClassificationLevel,
+}
+
+
+def record_query(*extra):
+    """按EXPORT_FIELDS排列的列，extra中的列附加在末尾"""
+    columns = []
+    for field in EXPORT_FIELDS:
+        if field == 'dossier':
+            columns.append(Dossier.name.label('dossier'))
+        elif field == 'creator':
+            columns.append(User.username.label('creator'))
+        elif field in _CODE_TABLES:
+            columns.append(_CODE_TABLES[field].name.label(field))
+        else:
+            columns.append(getattr(File, field))
+    query = db.session.query(*(columns + list(extra))) \
+        .outerjoin(Dossier, File.dossier_id == Dossier.id) \
+        .outerjoin(User, File.creator_id == User.id)
+    for field, model in _CODE_TABLES.items():
+        query = query.outerjoin(
+            model, getattr(File, field + '_id') == model.id)
+    return query
+
+
+def to_record(row):
+    """record_query的一行转换为 {字段: 文本}"""
+    return dict(zip(EXPORT_FIELDS, (_text(value) for value in row)))
+
+
+def export_query(dossier=None, carrier_type=None, since=None, until=None):
+    """待导出的行
+
+    dossier可以是案卷id或名称；since/until按上传时间筛选。
+    """
+    query = record_query().filter(File.verified == False)
+    if dossier:
+        if str(dossier).isdigit():
+            query = query.filter(File.dossier_id == int(dossier))
+        else:
+            query = query.filter(Dossier.name == dossier)
+    if carrier_type:
+        query = query.filter(CarrierType.name == carrier_type)
+    if since is not None:
+        query = query.filter(File.timestamp >= since)
+    if until is not None:
+        query = query.filter(File.timestamp < until)
+    return query.order_by(File.id)
+
+
+def parse_date(value):
+    """解析 YYYY-MM-DD，为空时返回None，格式不对时抛出ValueError"""
+    if not value:
+        return None
+    return datetime.strptime(value, '%Y-%m-%d')
+
+
+def _text(value):
+    if value is None:
+        return ''
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return u'%s' % value
+
+
+def _records(query, batch_size):
+    query = query.execution_options(stream_results=True) \
+        .yield_per(batch_size)
+    for row in query:
+        yield to_record(row)
+
+
+def _csv(records):
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    # 带BOM，Excel才能正确识别中文
+    buf.write('\ufeff')
+    writer.writerow([FileView.column_labels.get(field, field)
+                     for field in EXPORT_FIELDS])
+    yield buf.getvalue()
+    buf.seek(0)
+    buf.truncate()
+    for record in records:
+        writer.writerow([record[field] for field in EXPORT_FIELDS])
+        yield buf.getvalue()
+        buf.seek(0)
+        buf.truncate()
+
+
+def _jsonl(records):
+    for record in records:
+        yield json.dumps(record, ensure_ascii=False) + '\n'
+
+
+def dublin_core(record):
+    """记录中有值的Dublin Core元素，[(元素名, 值)]"""
+    return [(element, record[field]) for field, element in DUBLIN_CORE
+            if record.get(field)]
+
+
+def xml_text(value):
+    return escape(_INVALID_XML.sub('', value))
+
+
+def _xml(records):
+    mapped = set(field for field, _ in DUBLIN_CORE)
+    yield ('<?xml version="1.0" encoding="UTF-8"?>\n'
+           '<records xmlns:dc="http://purl.org/dc/elements/1.1/" '
+           'xmlns:archive="urn:metadata:archive">\n')
+    for record in records:
+        parts = ['<record id=%s>\n' % quoteattr(record['id'])]
+        for element, value in dublin_core(record):
+            parts.append('  <dc:%s>%s</dc:%s>\n'
+                         % (element, xml_text(value), element))
+        for field in EXPORT_FIELDS:
+            if field in mapped or field == 'id' or not record[field]:
+                continue
+            parts.append('  <archive:field name=%s label=%s>%s'
+                         '</archive:field>\n' % (
+                             quoteattr(field),
+                             quoteattr(FileView.column_labels.get(field,
+                                                                  field)),
+                             xml_text(record[field])))
+        parts.append('</record>\n')
+        yield ''.join(parts)
+    yield '</records>\n'
+
+
+_SERIALIZERS = {'csv': _csv, 'jsonl': _jsonl, 'xml': _xml}
+
+
+def export_files(format, batch_size=1000, **filters):
+    """以字符串片段的形式逐批产生导出内容"""
+    serialize = _SERIALIZERS[format]
+    chunk = []
+    size = 0
+    for piece in serialize(_records(export_query(**filters), batch_size)):
+        chunk.append(piece)
+        size += len(piece)
+        # 合并成较大的块再输出，减少写入次数
+        if size >= 64 * 1024:
+            yield ''.join(chunk)
+            chunk = []
+            size = 0
+    if chunk:
+        yield ''.join(chunk)
@@ -0,0 +1,190 @@
+# -*- coding:utf-8 -*-
+from flask_sqlalchemy import SignallingSession
+from sqlalchemy import event
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm.attributes import get_history
+
+from . import db, code_registry
+from .models import File, FacetCount
+
+# 知识导航中的主题词：(链接中的编号, 字段名, 显示名)
+KEYWORD_FIELDS = (
+    ('1', 'key_who', '何人'),
+    ('2', 'key_why', '何故'),
+    ('3', 'key_when', '何时'),
+    ('4', 'key_where', '何地'),
+    ('5', 'key_how', '何方式'),
+    ('6', 'key_what', '何事'),
+)
+
+
+def keyword_column(field):
+    """链接中的编号转换为File的列，未知编号按“何事”处理"""
+    for number, name, _ in KEYWORD_FIELDS:
+        if number == field:
+            return getattr(File, name)
+    return File.key_what
+
+
+def keyword_facets(file):
+    """返回[(编号, 显示名, 取值, 资源数)]
+
+    资源数取自随File维护的FacetCount，六个主题词按主键一次查出。
+    """
+    facets = []
+    for number, name, label in KEYWORD_FIELDS:
+        value = getattr(file, name)
+        if value:
+            facets.append((number, name, label, value))
+    if not facets:
+        return []
+    counts = dict(
+        ((facet, value), count) for facet, value, count in
+        db.session.query(FacetCount.facet, FacetCount.value, FacetCount.count)
+        .filter(db.or_(*[db.and_(FacetCount.facet == name,
+                                 FacetCount.value == value)
+                         for _, name, _, value in facets]))
+    )
+    return [(number, label, value, counts.get((name, value), 0))
+            for number, name, label, value in facets]
+
+
+def facet_count(facet, value=''):
+    """某个分面取值下未删除资源的数量，按主键查一行"""
+    count = db.session.query(FacetCount.count) \
+        .filter_by(facet=facet, value=u'%s' % value).scalar()
+    return count or 0
+
+
+def facet_counts(facet):
+    """某个分面所有取值的数量，{取值: 数量}"""
+    return dict(db.session.query(FacetCount.value, FacetCount.count)
+                .filter_by(facet=facet))
+
+
+def code_facet_counts(field):
+    """以代码保存的字段各取值的数量，{名称: 数量}"""
+    return dict((code_registry.label(field, int(code)), count)
+                for code, count in facet_counts(field + '_id').items()
+                if code)
+
+
+# 外键分面：(列名, 关系名)
+_RELATION_FACETS = {'dossier_id': 'dossier', 'creator_id': 'creator'}
+
+
+def _values(obj, facet):
+    """返回某分面flush前后的取值"""
+    history = get_history(obj, facet)
+    if history.has_changes():
+        old = history.deleted[0] if history.deleted else None
+        new = history.added[0] if history.added else None
+    else:
+        old = new = getattr(obj, facet)
+    relation = _RELATION_FACETS.get(facet)
+    if relation is not None:
+        # 通过关系赋值时外键要到flush时才同步
+        history = get_history(obj, relation)
+        if history.has_changes():
+            # 同时新建的目标对象要到flush之后才有主键，在_apply_deltas中再取
+            new = history.added[0] if history.added else None
+    return old, new
+
+
+def _collect_deltas(session, flush_context, instances):
+    deltas = session.info.setdefault('facet_deltas', {})
+
+    def add(facet, value, delta):
+        if value is None:
+            value = u''
+        elif not isinstance(value, db.Model):
+            value = u'%s' % value
+        key = (facet, value)
+        deltas[key] = deltas.get(key, 0) + delta
+
+    for obj in session.new | session.dirty | session.deleted:
+        if not isinstance(obj, File):
+            continue
+        old_verified, new_verified = _values(obj, 'verified')
+        old_live = obj not in session.new and not old_verified
+        new_live = obj not in session.deleted and not new_verified
+        if not old_live and not new_live:
+            continue
+        add('*', None, int(new_live) - int(old_live))
+        for facet in FacetCount.FACETS:
+            old, new = _values(obj, facet)
+            if old_live:
+                add(facet, old, -1)
+            if new_live:
+                add(facet, new, 1)
+
+
+def count_inserted(session, rows):
+    """计入批量插入的资源
+
+    ``bulk_insert_mappings`` 不触发flush事件，rows为插入时使用的字典。
+    """
+    deltas = {}
+    for row in rows:
+        if row.get('verified'):
+            continue
+        for facet in ('*',) + FacetCount.FACETS:
+            value = row.get(facet) if facet != '*' else None
+            key = (facet, u'' if value is None else u'%s' % value)
+            deltas[key] = deltas.get(key, 0) + 1
+    _upsert_deltas(session, deltas)
+
+
+def _apply_deltas(session, flush_context):
+    deltas = session.info.pop('facet_deltas', None)
+    if not deltas:
+        return
+    resolved = {}
+    for (facet, value), delta in deltas.items():
+        if isinstance(value, db.Model):
+            value = u'%s' % value.id
+        resolved[facet, value] = resolved.get((facet, value), 0) + delta
+    _upsert_deltas(session, resolved)
+
+
+def _upsert_deltas(session, deltas):
+    """把增量加到计数上
+
+    并发的两次flush可能同时引入同一个新取值，插入不能因主键冲突而使
+    调用方的事务回滚：PostgreSQL用ON CONFLICT DO UPDATE；SQLite与MySQL
+    先插入（忽略冲突）计数为0的行再UPDATE；其他数据库在SAVEPOINT中
+    插入，冲突时改为UPDATE。
+    """
+    table = FacetCount.__table__
+    connection = session.connection()
+    dialect = connection.dialect.name
+    for (facet, value), delta in deltas.items():
+        if delta == 0:
+            continue
+        if dialect == 'postgresql':
+            from sqlalchemy.dialects.postgresql import insert
+            statement = insert(table).values(facet=facet, value=value,
+                                             count=delta)
+            connection.execute(statement.on_conflict_do_update(
+                index_elements=['facet', 'value'],
+                set_=dict(count=table.c.count + statement.excluded.count)))
+            continue
+        if dialect in ('sqlite', 'mysql'):
+            prefix = 'OR IGNORE' if dialect == 'sqlite' else 'IGNORE'
+            connection.execute(table.insert().prefix_with(prefix)
+                               .values(facet=facet, value=value, count=0))
+        update = table.update() \
+            .where(table.c.facet == facet) \
+            .where(table.c.value == value) \
+            .values(count=table.c.count + delta)
+        if connection.execute(update).rowcount == 0:
+            try:
+                with connection.begin_nested():
+                    connection.execute(table.insert().values(
+                        facet=facet, value=value, count=delta))
+            except IntegrityError:
+                connection.execute(update)
+
+
+event.listen(SignallingSession, 'before_flush', _collect_deltas)
+event.listen(SignallingSession, 'after_flush', _apply_deltas)
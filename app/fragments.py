@@ -0,0 +1,164 @@
+# -*- coding:utf-8 -*-
+import json
+import os
+import shutil
+import threading
+import time
+from collections import OrderedDict
+
+from sqlalchemy import event, select
+from sqlalchemy.orm import object_session
+
+
+class FragmentCache(object):
+    """单个档案页面主体的渲染结果缓存
+
+    以 (档案id, 页面名, row_version) 为键，先查进程内的LRU，再查
+    ``FRAGMENT_CACHE_DIR`` 下的文件（可放在多个进程共享的目录上）。
+    File或Dossier被修改时 ``row_version`` 递增，旧的片段不会再被读到，
+    并在修改时即删除；知识导航中的主题词计数随其他档案变化，因此片段
+    最多保留 ``FRAGMENT_CACHE_TTL`` 秒。
+    """
+
+    def __init__(self, app=None):
+        self.ttl = 600
+        self.size = 512
+        self.directory = None
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.ttl = app.config.get('FRAGMENT_CACHE_TTL', self.ttl)
+        self.size = app.config.get('FRAGMENT_CACHE_SIZE', self.size)
+        self.directory = app.config.get('FRAGMENT_CACHE_DIR')
+        if self.directory and not os.path.exists(self.directory):
+            os.makedirs(self.directory)
+        app.extensions['fragment_cache'] = self
+
+    def _path(self, id, name, version):
+        return os.path.join(self.directory, str(id),
+                            '%s-%d.json' % (name, version))
+
+    def get(self, id, name, version):
+        key = (id, name, version)
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry[0] >= now:
+                    self._entries.move_to_end(key)
+                    return entry[1]
+                del self._entries[key]
+        if not self.directory or not self.ttl:
+            return None
+        path = self._path(id, name, version)
+        try:
+            expires = os.path.getmtime(path) + self.ttl
+            if expires < now:
+                return None
+            with open(path, encoding='utf-8') as f:
+                value = json.load(f)
+        except (OSError, ValueError):
+            return None
+        self._remember(key, value, expires)
+        return value
+
+    def set(self, id, name, version, value):
+        if not self.ttl:
+            return
+        self._remember((id, name, version), value, time.time() + self.ttl)
+        if not self.directory:
+            return
+        path = self._path(id, name, version)
+        tmp = '%s.%d.%d' % (path, os.getpid(), threading.get_ident())
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(tmp, 'w', encoding='utf-8') as f:
+                json.dump(value, f)
+            os.replace(tmp, path)
+        except OSError:
+            pass
+
+    def _remember(self, key, value, expires):
+        with self._lock:
+            self._entries[key] = (expires, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+
+    def evict(self, ids):
+        """删除这些档案的全部片段"""
+        ids = set(ids)
+        if not ids:
+            return
+        with self._lock:
+            for key in [k for k in self._entries if k[0] in ids]:
+                del self._entries[key]
+        if self.directory:
+            for id in ids:
+                shutil.rmtree(os.path.join(self.directory, str(id)),
+                              ignore_errors=True)
+
+    def etag(self, id, name, version, user_id):
+        """页面的ETag
+
+        页面头部随登录用户不同，且带有有时效的CSRF令牌，所以ETag中
+        还包含用户和按 ``FRAGMENT_CACHE_TTL`` 划分的时间段。
+        """
+        period = int(time.time() // self.ttl) if self.ttl else 0
+        return 'file-%d-%s-%d-%s-%d' % (id, name, version,
+                                        user_id or 0, period)
+
+    def watch(self, file_model, dossier_model):
+        """File或Dossier被修改时递增row_version并删除旧片段"""
+        files = file_model.__table__
+
+        def changed(target, include_collections=False):
+            return object_session(target).is_modified(
+                target, include_collections=include_collections)
+
+        def file_before_update(mapper, connection, target):
+            # 标签的增减也会改变页面片段
+            if changed(target, include_collections=True):
+                target.row_version = file_model.row_version + 1
+
+        def file_after_change(mapper, connection, target):
+            self.evict([target.id])
+
+        def dossier_after_update(mapper, connection, target):
+            if not changed(target):
+                return
+            ids = [row[0] for row in connection.execute(
+                select([files.c.id]).where(files.c.dossier_id == target.id))]
+            if ids:
+                connection.execute(
+                    files.update()
+                    .where(files.c.dossier_id == target.id)
+                    .values(row_version=files.c.row_version + 1))
+                self.evict(ids)
+
+        event.listen(file_model, 'before_update', file_before_update)
+        event.listen(file_model, 'after_update', file_after_change)
+        event.listen(file_model, 'after_delete', file_after_change)
+        event.listen(dossier_model, 'after_update', dossier_after_update)
+
+    def watch_tags(self, file_model, tag_model, ref_table):
+        """标签改名时递增带有该标签的File的row_version"""
+        files = file_model.__table__
+
+        def tag_after_update(mapper, connection, target):
+            if not object_session(target).is_modified(
+                    target, include_collections=False):
+                return
+            ids = [row[0] for row in connection.execute(
+                select([ref_table.c.file_id])
+                .where(ref_table.c.tag_id == target.id))]
+            if ids:
+                connection.execute(
+                    files.update().where(files.c.id.in_(ids))
+                    .values(row_version=files.c.row_version + 1))
+                self.evict(ids)
+
+        event.listen(tag_model, 'after_update', tag_after_update)
@@ -0,0 +1,92 @@
+# -*- coding:utf-8 -*-
+import threading
+import time
+from collections import OrderedDict
+
+from sqlalchemy import event, inspect
+
+
+class IdentityCache(object):
+    """进程内缓存已登录用户及其角色，带过期时间的LRU
+
+    缓存的是与会话分离的User（连同已加载的Role）副本，每个请求用
+    ``session.merge(user, load=False)`` 得到属于本请求会话的对象，
+    不发出任何查询。User或Role被修改、删除时通过映射器事件失效；
+    其他进程中的修改最迟在 ``IDENTITY_CACHE_TTL`` 秒后生效。
+    """
+
+    def __init__(self, app=None):
+        self.ttl = 30
+        self.size = 1024
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.ttl = app.config.get('IDENTITY_CACHE_TTL', self.ttl)
+        self.size = app.config.get('IDENTITY_CACHE_SIZE', self.size)
+        app.extensions['identity_cache'] = self
+
+    def get(self, user_id):
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None:
+                return None
+            expires, user = entry
+            if expires < time.time():
+                del self._entries[user_id]
+                return None
+            self._entries.move_to_end(user_id)
+            return user
+
+    def put(self, user_id, user):
+        if not self.ttl:
+            return
+        with self._lock:
+            self._entries[user_id] = (time.time() + self.ttl, user)
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, user_id=None):
+        """user_id为None时清空全部"""
+        with self._lock:
+            if user_id is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(user_id, None)
+
+    def load(self, session, query, user_id):
+        """取得属于session的User，未命中时用query加载（需预先加载role）"""
+        cached = self.get(user_id)
+        if cached is not None:
+            return session.merge(cached, load=False)
+        loaded = set(session.identity_map.keys())
+        user = query.get(user_id)
+        if user is None:
+            return None
+        if any(inspect(obj).key in loaded
+               for obj in (user, user.role) if obj is not None):
+            # 会话中原本就有这些对象，移出会使调用方对它们的修改丢失，
+            # 这次不缓存
+            return user
+        # 从会话中移出，避免提交时被过期；返回合并后的副本
+        if user.role is not None:
+            session.expunge(user.role)
+        session.expunge(user)
+        self.put(user_id, user)
+        return session.merge(user, load=False)
+
+    def watch(self, user_model, role_model):
+        """User或Role被修改、删除时使缓存失效"""
+        def user_changed(mapper, connection, target):
+            self.invalidate(target.id)
+
+        def role_changed(mapper, connection, target):
+            # 角色权限变化影响其下所有用户
+            self.invalidate()
+
+        for name in ('after_update', 'after_delete'):
+            event.listen(user_model, name, user_changed)
+            event.listen(role_model, name, role_changed)
@@ -4,9 +4,10 @@ from wtforms import StringField, BooleanField, SubmitField, \
     TextAreaField, SelectField, FileField, DateField
 from wtforms.validators import Required, Length, Email
 from wtforms import ValidationError
-from flask import current_app
 
-from ..models import Role, User, File, TagListField, Dossier
+from .. import code_registry
+from ..models import Role, User, File, TagListField, Dossier, \
+    normalize_title
 
 
 class EditProfileForm(FlaskForm):
@@ -97,25 +98,18 @@ class FileMetaDataForm(FlaskForm):
 
     def __init__(self, *args, **kw):
         super(FileMetaDataForm, self).__init__(*args, **kw)
-        self.carrier_type.choices = [
-            (key, value)
-            for key, value in enumerate(current_app.config['FILE_TYPES'], 1)
-        ]
-        self.language.choices = [
-            (key, value)
-            for key, value in enumerate(current_app.config['LANGUAGES'], 1)
-        ]
+        self.carrier_type.choices = code_registry.choices('carrier_type')
+        self.language.choices = code_registry.choices('language')
         self.dossier.choices = [
             (dossier.id, dossier.name)
             for dossier in Dossier.query.order_by(Dossier.id).all()
         ]
-        self.classification_level.choices = [
-            (num, name)
-            for num, name in enumerate(current_app.config['CONFIDENTIALITIES'], 1)
-        ]
+        self.classification_level.choices = \
+            code_registry.choices('classification_level')
 
-    def validate_title(self, field):
-        if File.query.filter_by(title_proper=field.data).first():
+    def validate_title_proper(self, field):
+        if File.query.filter_by(title_key=normalize_title(field.data),
+                                verified=False).first():
             raise ValidationError('同名资源已上传！')
 
     def validate_tags(self, field):
@@ -139,6 +133,8 @@ class EditFileMetaDataForm(FlaskForm):
     key_how = StringField('何方式：')
     key_what = StringField('何事')
 
+    tags = TagListField('标签：')
+
     archive_num = StringField('分类号', validators=[Required()])
 
     annotation = TextAreaField('附注：')
@@ -177,19 +173,16 @@ class EditFileMetaDataForm(FlaskForm):
 
     def __init__(self, *args, **kw):
         super(EditFileMetaDataForm, self).__init__(*args, **kw)
-        self.carrier_type.choices = [
-            (key, value)
-            for key, value in enumerate(current_app.config['FILE_TYPES'], 1)
-        ]
-        self.language.choices = [
-            (key, value)
-            for key, value in enumerate(current_app.config['LANGUAGES'], 1)
-        ]
+        self.carrier_type.choices = code_registry.choices('carrier_type')
+        self.language.choices = code_registry.choices('language')
         self.dossier.choices = [
             (dossier.id, dossier.name)
             for dossier in Dossier.query.order_by(Dossier.id).all()
         ]
-        self.classification_level.choices = [
-            (num, name)
-            for num, name in enumerate(current_app.config['CONFIDENTIALITIES'], 1)
-        ]
+        self.classification_level.choices = \
+            code_registry.choices('classification_level')
+
+
+class ImportManifestForm(FlaskForm):
+    manifest = FileField('著录清单（CSV或XLSX）', validators=[Required()])
+    submit = SubmitField('导入')
@@ -1,39 +1,84 @@
 # -*- coding:utf-8 -*-
+import os
+
 from flask import render_template, abort, \
     redirect, url_for, flash, current_app, request, \
-    g
+    g, jsonify, make_response, session, Markup, stream_with_context, \
+    send_file
 from flask_login import login_required, current_user
-import os
-from time import time
 
 from . import main
-from .. import db
-from ..models import User, Role, File, Tag, Dossier
+from .. import db, blob_storage, query_profiler, fragment_cache, \
+    derivative_generator, mail_queue, suggestions, code_registry
+from ..models import User, Role, File, Tag, Dossier, Permission, \
+    normalize_title
 from .forms import EditProfileForm, EditProfileAdminForm, \
-    FileMetaDataForm, EditFileMetaDataForm
-from ..decorators import admin_required
+    FileMetaDataForm, EditFileMetaDataForm, ImportManifestForm
+from ..decorators import admin_required, permission_required
+from ..search import paginate_search, paginate_content_search
+from ..facets import keyword_column, keyword_facets, facet_count, \
+    code_facet_counts
+from ..pagination import keyset_paginate
+from ..manifest import import_manifest, ManifestError
+from ..export import EXPORT_FORMATS, export_files, parse_date
+from ..changes import changes_since
+from ..download import send_stored_file
+from ..suggest import FIELDS as SUGGEST_FIELDS
 
 
 @main.route('/')
 def index():
     return render_template('index.html')
 
+def render_file_page(id, name, **context):
+    """渲染单个档案的标签页，页面主体取自fragment_cache
+
+    只查询档案的row_version；浏览器缓存的页面仍有效时直接返回304。
+    context中的可调用对象在需要重新渲染时以file为参数调用。
+    """
+    version = db.session.query(File.row_version).filter_by(id=id).scalar()
+    if version is None:
+        abort(404)
+    etag = fragment_cache.etag(id, name, version, current_user.get_id())
+    # 有待显示的闪现消息时不能让浏览器沿用旧页面
+    if '_flashes' not in session and \
+            request.if_none_match.contains_weak(etag):
+        response = current_app.response_class(status=304)
+    else:
+        fragment = fragment_cache.get(id, name, version)
+        if fragment is None:
+            file = File.query.get_or_404(id)
+            values = dict((key, value(file) if callable(value) else value)
+                          for key, value in context.items())
+            fragment = dict(title=file.title_proper,
+                            html=render_template('_%s.html' % name,
+                                                 file=file, **values))
+            fragment_cache.set(id, name, version, fragment)
+        response = make_response(render_template(
+            'file_page.html', title=fragment['title'],
+            fragment=Markup(fragment['html'])))
+    response.set_etag(etag, weak=True)
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response
+
 @main.route('/knowledge/<int:id>', methods=['GET'])
 def knowledge(id):
-    file = File.query.get_or_404(id)
-    return render_template('knowledge.html', file=file)
+    return render_file_page(id, 'knowledge', keyword_facets=keyword_facets)
 
 @main.route('/scan')
 def scan():
-    page = request.args.get('page', 1, type=int)
-    pagination = File.query.filter_by(verified=False).order_by(File.timestamp.desc()).paginate(
-        page,
+    pagination = keyset_paginate(
+        File.query.filter_by(verified=False),
         per_page=current_app.config['METADATA_FILES_PER_PAGE'],
-        error_out=False
+        after=request.args.get('after'),
+        before=request.args.get('before'),
+        total=facet_count('*')
     )
     files = pagination.items
     return render_template('scan.html', files=files,
-                           pagination=pagination)
+                           pagination=pagination,
+                           carrier_counts=code_facet_counts('carrier_type'))
 
 
 @main.route('/me', methods=['GET', 'POST'])
@@ -103,21 +148,20 @@ def upload_file():
     if form.validate_on_submit():
 
         filename = form.file_path.data.filename
-        file_path = os.path.join(current_app.config['UPLOAD_DIR'], str(time())+filename)
-        language = list(enumerate(current_app.config['LANGUAGES'], 1))[form.language.data-1][1]
-        carrier_type = list(enumerate(current_app.config["FILE_TYPES"], 1))[form.carrier_type.data-1][1]
-        classification_level = list(enumerate(current_app.config['CONFIDENTIALITIES'], 1))[form.classification_level.data-1][1]
+        blob = blob_storage.save(form.file_path.data)
 
         if form.relation_path.data.filename:
             relation = form.relation_path.data.filename
-            relation_path = os.path.join(current_app.config['UPLOAD_DIR'], str(time())+relation)
+            relation_path = blob_storage.save(form.relation_path.data).path
         else:
             relation = None
             relation_path = None
 
         file = File(
-            file_path=file_path,
+            file_path=blob.path,
             file_name=filename,
+            sha256=blob.digest,
+            file_size=blob.size,
             creator=current_user,
             title_proper=form.title_proper.data,
             title_parallel=form.title_parallel.data,
@@ -132,13 +176,13 @@ def upload_file():
             annotation=form.annotation.data,
             summary=form.summary.data,
             dossier=Dossier.query.get(form.dossier.data),
-            language=language,
+            language_id=form.language.data,
             relation_path=relation_path,
             relation_name=relation,
             archive_guide=form.archive_guide.data,
             dossier_guide=form.dossier_guide.data,
             coverage_note=form.coverage_note.data,
-            classification_level = classification_level,
+            classification_level_id=form.classification_level.data,
             retention_period=form.retention_period.data,
             creator_=form.creator_.data,
             publisher=form.publisher.data,
@@ -147,7 +191,7 @@ def upload_file():
             date=form.date.data,
             version=form.version.data,
             record_type=form.record_type.data,
-            carrier_type=carrier_type,
+            carrier_type_id=form.carrier_type.data,
             number=form.number.data,
             specification=form.specification.data,
             record_num=form.record_num,
@@ -156,10 +200,10 @@ def upload_file():
 
         db.session.add(file)
         db.session.commit()
-        flash('文件上传成功！')
-        form.file_path.data.save(file_path)
-        if relation:
-            form.relation_path.data.save(relation_path)
+        if blob.created:
+            flash('文件上传成功！')
+        else:
+            flash('文件上传成功！已存在相同内容的文件，未重复保存。')
         return redirect(url_for('main.upload_file'))
     return render_template('upload_file.html', form=form)
 
@@ -191,15 +235,16 @@ def edit_file(ID):
         file.key_where = form.key_where.data
         file.key_how = form.key_how.data
         file.key_what = form.key_what.data
+        form.tags.populate_obj(file, 'tags')
         file.archive_num = form.archive_num.data
         file.annotation = form.annotation.data
         file.summary = form.summary.data
         file.dossier = Dossier.query.get(form.dossier.data)
-        file.language = form.language.data
+        file.language_id = form.language.data
         file.archive_guide = form.archive_guide.data
         file.dossier_guide = form.dossier_guide.data
         file.coverage_note = form.coverage_note.data
-        file.classification_level = form.classification_level.data
+        file.classification_level_id = form.classification_level.data
         file.retention_period = form.retention_period.data
         file.creator_ = form.creator_.data
         file.publisher = form.publisher.data
@@ -227,16 +272,17 @@ def edit_file(ID):
     form.key_where.data = file.key_where
     form.key_how.data = file.key_how
     form.key_what.data = file.key_what
+    form.tags.data = file.tags
     form.archive_num.data = file.archive_num
     form.annotation.data = file.annotation
     form.summary.data = file.summary
     form.dossier.data = file.dossier
-    form.language.data = file.language
+    form.language.data = file.language_id
     form.relation_name.data = file.relation_name
     form.archive_guide.data = file.archive_guide
     form.dossier_guide.data = file.dossier_guide
     form.coverage_note.data = file.coverage_note
-    form.classification_level.data = file.classification_level
+    form.classification_level.data = file.classification_level_id
     form.retention_period.data = file.retention_period
     form.creator_.data = file.creator_
     form.publisher.data = file.publisher
@@ -256,36 +302,105 @@ def edit_file(ID):
 
 @main.route('/search-result/', methods=['GET', 'POST'])
 def search(key_word=None):
-    searched_word = request.form['search']
-    results = File.query.filter_by(verified=False).whoosh_search(searched_word,
-                                       like=True, or_=True).all()
-    return render_template('search_result.html', files=results)
+    searched_word = request.values.get('search', '')
+    page = request.args.get('page', 1, type=int)
+    # scope=content时搜索上传文件的正文
+    scope = request.values.get('scope')
+    paginate = paginate_content_search if scope == 'content' \
+        else paginate_search
+    pagination = paginate(
+        File.query.options(db.subqueryload(File.tags))
+        .filter_by(verified=False),
+        searched_word,
+        page,
+        per_page=current_app.config['METADATA_FILES_PER_PAGE']
+    )
+    return render_template('search_result.html', files=pagination.items,
+                           pagination=pagination, endpoint='main.search',
+                           endpoint_args=dict(search=searched_word,
+                                              scope=scope))
 
 
 @main.route('/file-profile/<int:id>', methods=["GET"])
 def file_detail(id):
-    file = File.query.get_or_404(id)
-    return render_template('file_detail.html', file=file)
+    return render_file_page(id, 'file_detail')
 
 @main.route('/file-profile/<file_name>', methods=["GET", "POST"])
 def file_detail_by_name(file_name):
-    file = File.query.filter_by(title_proper=file_name).first()
-    return render_template('file_detail.html', file=file)
+    # 题名写法略有不同（全半角、空格、标点）也能找到，优先未删除的资源
+    file = File.query.filter_by(title_key=normalize_title(file_name)) \
+        .order_by(File.verified, File.id).first_or_404()
+    return render_file_page(file.id, 'file_detail')
 
 @main.route('/file-profile/<int:id>/er', methods=["GET"])
 def er(id):
-    file = File.query.get_or_404(id)
-    return render_template('er.html', file=file)
+    return render_file_page(id, 'er')
+
+
+# 浏览器中可以直接播放、拖动的载体类型
+INLINE_CARRIER_TYPES = ('视频', '音频', '图片')
+
+
+@main.route('/download/<int:id>')
+@login_required
+@permission_required(Permission.DOWNLOAD_FILE)
+def download(id):
+    file = File.query.filter_by(id=id, verified=False).first_or_404()
+    response = send_stored_file(
+        file.file_path, file.file_name or os.path.basename(file.file_path),
+        etag=file.sha256,
+        inline=file.carrier_type in INLINE_CARRIER_TYPES)
+    if response is None:
+        abort(404)
+    return response
+
+
+@main.route('/download/<int:id>/relation')
+@login_required
+@permission_required(Permission.DOWNLOAD_FILE)
+def download_relation(id):
+    file = File.query.filter_by(id=id, verified=False).first_or_404()
+    if not file.relation_path:
+        abort(404)
+    response = send_stored_file(
+        file.relation_path,
+        file.relation_name or os.path.basename(file.relation_path))
+    if response is None:
+        abort(404)
+    return response
+
+
+@main.route('/thumbnail/<digest>.jpg')
+@login_required
+@permission_required(Permission.DOWNLOAD_FILE)
+def thumbnail(digest):
+    if len(digest) != 64 or digest.strip('0123456789abcdef'):
+        abort(404)
+    # 与下载相同：只提供未删除资源的缩略图
+    if not db.session.query(
+            File.query.filter_by(sha256=digest, verified=False).exists()) \
+            .scalar():
+        abort(404)
+    path = derivative_generator.path_for(digest)
+    if not os.path.exists(path):
+        abort(404)
+    response = send_file(path, mimetype='image/jpeg', conditional=True,
+                         cache_timeout=current_app.config['DERIVATIVE_MAX_AGE'])
+    # 内容受权限保护，不能由共享缓存保存（send_file默认标记为public）
+    response.cache_control.public = False
+    response.cache_control.private = True
+    return response
 
 
 @main.route('/file-manage')
 @login_required
 def file_manage():
-    page = request.args.get('page', 1, type=int)
-    pagination = File.query.filter_by(verified=False).filter_by(creator=current_user).order_by(File.timestamp.desc()).paginate(
-        page,
+    pagination = keyset_paginate(
+        File.query.filter_by(verified=False).filter_by(creator=current_user),
         per_page=current_app.config['METADATA_FILES_PER_PAGE'],
-        error_out=False
+        after=request.args.get('after'),
+        before=request.args.get('before'),
+        total=facet_count('creator_id', current_user.id)
     )
     files = pagination.items
     return render_template('file_manage.html', files=files, pagination=pagination)
@@ -297,24 +412,126 @@ def admin_manage():
     return render_template('admin/index.html')
 
 
+@main.route('/admin/query-stats')
+@login_required
+@admin_required
+def query_stats():
+    return jsonify(query_profiler.report())
+
+
+@main.route('/admin/mail-queue')
+@login_required
+@admin_required
+def mail_queue_status():
+    return jsonify(depth=mail_queue.depth())
+
+
+@main.route('/admin/import-manifest', methods=['GET', 'POST'])
+@login_required
+@admin_required
+def import_manifest_admin():
+    form = ImportManifestForm()
+    result = None
+    if form.validate_on_submit():
+        manifest = form.manifest.data
+        # 在请求中不另开进程池，以免复制WSGI工作进程；大清单用
+        # python manage.py import-manifest --procs 并行校验
+        try:
+            result = import_manifest(
+                manifest.stream, manifest.filename,
+                creator_id=current_user.id,
+                chunk_size=current_app.config['MANIFEST_CHUNK_SIZE']
+            )
+        except ManifestError as e:
+            flash(str(e))
+        else:
+            flash('共 %d 行，导入 %d 行' % (result.total, result.imported))
+    return render_template('import_manifest.html', form=form, result=result)
+
+
+@main.route('/export/files.<format>')
+@login_required
+@permission_required(Permission.DOWNLOAD_FILE)
+def export(format):
+    """流式导出著录信息，可按dossier、carrier_type、since、until筛选"""
+    if format not in EXPORT_FORMATS:
+        abort(404)
+    try:
+        since = parse_date(request.args.get('since'))
+        until = parse_date(request.args.get('until'))
+    except ValueError:
+        abort(400)
+    content_type, extension = EXPORT_FORMATS[format]
+    content = export_files(
+        format,
+        batch_size=current_app.config['METADATA_EXPORT_BATCH_SIZE'],
+        dossier=request.args.get('dossier'),
+        carrier_type=request.args.get('carrier_type'),
+        since=since,
+        until=until
+    )
+    filename = 'files.%s' % extension
+    return current_app.response_class(
+        stream_with_context(content), content_type=content_type,
+        headers={'Content-Disposition': 'attachment; filename=%s' % filename})
+
+
+@main.route('/changes')
+@login_required
+@permission_required(Permission.DOWNLOAD_FILE)
+def changes():
+    """序号since之后的资源变更，用返回的next作为下一次的since"""
+    since = request.args.get('since', 0, type=int)
+    limit = max(1, min(request.args.get('limit', 500, type=int), 5000))
+    # 多取一行判断是否还有后续，恰好取完时不会让客户端再请求一次
+    rows = changes_since(since, limit + 1,
+                         settle=current_app.config['CHANGE_LOG_SETTLE'])
+    more = len(rows) > limit
+    rows = rows[:limit]
+    return jsonify(changes=[change.to_json() for change in rows],
+                   next=rows[-1].seq if rows else since,
+                   more=more)
+
+
 @main.route('/search-result/<field>-<keyword>')
 def search_keyword(field, keyword):
-    print(field)
-    print(keyword)
-    if field == '1':
-        results = File.query.filter_by(verified=False).filter_by(key_who=keyword).all()
-    elif field == '2':
-        results = File.query.filter_by(verified=False).filter_by(key_why=keyword).all()
-    elif field == '3':
-        results = File.query.filter_by(verified=False).filter_by(key_when=keyword).all()
-    elif field == '4':
-        results = File.query.filter_by(verified=False).filter_by(key_where=keyword).all()
-    elif field == '5':
-        results = File.query.filter_by(verified=False).filter_by(key_how=keyword).all()
-    else:
-        results = File.query.filter_by(verified=False).filter_by(key_what=keyword).all()
+    page = request.args.get('page', 1, type=int)
+    pagination = File.query.filter_by(verified=False).filter(keyword_column(field) == keyword).order_by(File.timestamp.desc()).paginate(
+        page,
+        per_page=current_app.config['METADATA_FILES_PER_PAGE'],
+        error_out=False
+    )
+    return render_template('search_result.html',
+                           files=pagination.items, pagination=pagination,
+                           endpoint='main.search_keyword',
+                           endpoint_args=dict(field=field, keyword=keyword))
+
+
+@main.route('/suggest/<field>')
+@login_required
+def suggest(field):
+    """著录表单的输入提示，q为已输入的前缀（可为拼音）"""
+    if field not in SUGGEST_FIELDS:
+        abort(404)
+    prefix = request.args.get('q', '').strip()
+    values = suggestions.suggest(field, prefix) if prefix else []
+    return jsonify(field=field, suggestions=values)
+
+
+@main.route('/tag/<name>')
+def tagged_files(name):
+    tag = Tag.query.filter_by(name=name).first_or_404()
+    page = request.args.get('page', 1, type=int)
+    pagination = tag.files.options(db.subqueryload(File.tags)) \
+        .filter_by(verified=False).order_by(File.timestamp.desc()).paginate(
+            page,
+            per_page=current_app.config['METADATA_FILES_PER_PAGE'],
+            error_out=False
+        )
     return render_template('search_result.html',
-                           files=results)
+                           files=pagination.items, pagination=pagination,
+                           endpoint='main.tagged_files',
+                           endpoint_args=dict(name=name))
 
 
 @main.route('/add-dossier/', methods=['GET', 'POST'])
@@ -343,14 +560,18 @@ def scan_file(file_type):
     # if file_type is None:
     #     flash('请选择文件类型进行浏览！')
     #     return redirect(url_for('main.index'))
-    page = request.args.get('page', 1, type=int)
-    pagination = File.query.filter_by(verified=False).filter_by(carrier_type=carrier_type).order_by(File.timestamp.desc()).paginate(
-        page,
+    carrier_counts = code_facet_counts('carrier_type')
+    pagination = keyset_paginate(
+        File.query.filter_by(verified=False).filter_by(
+            carrier_type_id=code_registry.code('carrier_type', carrier_type)),
         per_page=current_app.config['METADATA_FILES_PER_PAGE'],
-        error_out=False
+        after=request.args.get('after'),
+        before=request.args.get('before'),
+        total=carrier_counts.get(carrier_type, 0)
     )
     if carrier_type in classes:
         classes[carrier_type] = 'active'
     files = pagination.items
     return render_template('file_list.html', files=files,
-                           pagination=pagination, classes=classes, carrier_type=carrier_type)
+                           pagination=pagination, classes=classes, carrier_type=carrier_type,
+                           carrier_counts=carrier_counts)
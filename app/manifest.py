@@ -0,0 +1,284 @@
+# -*- coding:utf-8 -*-
+"""从CSV/XLSX清单批量导入档案著录信息
+
+清单第一行为表头，列名可以是File的字段名，也可以是后台资源管理中的
+中文列名（如“正题名”）；“全宗或类”填案卷名称，“上传者”填用户名或
+邮箱。案卷与用户在导入前一次性读入内存，各行在进程池中校验，校验
+通过的行按块用 ``bulk_insert_mappings`` 写入，出错的行只记录行号与
+原因，不影响其他行。
+"""
+import codecs
+import csv
+import multiprocessing
+import os
+from collections import deque
+from datetime import datetime
+
+from . import db, search_indexer, suggestions, code_registry
+from .facets import count_inserted
+from .changes import record_changes
+from .models import File, Dossier, User, FileView, FileChange, \
+    normalize_title
+from .upload.views import REQUIRED_FIELDS, METADATA_FIELDS, CHOICE_FIELDS
+
+# 可以直接写入的File字段
+IMPORT_FIELDS = METADATA_FIELDS + tuple(CHOICE_FIELDS) + ('file_name',)
+
+
+class ManifestError(Exception):
+    """整个清单无法导入，如格式不支持、缺少必填列"""
+
+
+class ImportResult(object):
+    """一次导入的结果"""
+
+    def __init__(self, ignored=()):
+        self.total = 0
+        self.imported = 0
+        # [(行号, 原因)]
+        self.errors = []
+        # 无法识别、被忽略的列名
+        self.ignored = list(ignored)
+
+    def __repr__(self):
+        return '<ImportResult %d/%d, %d errors>' % (
+            self.imported, self.total, len(self.errors))
+
+
+def _cell(value):
+    if value is None:
+        return ''
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    return str(value)
+
+
+def read_rows(stream, filename):
+    """逐行读取清单，产生 (行号, [单元格文本])"""
+    ext = os.path.splitext(filename)[1].lower()
+    if ext == '.csv':
+        reader = csv.reader(codecs.getreader('utf-8-sig')(stream))
+        for line, row in enumerate(reader, 1):
+            yield line, row
+    elif ext == '.xlsx':
+        try:
+            import openpyxl
+        except ImportError:
+            raise ManifestError('读取xlsx清单需要安装openpyxl')
+        book = openpyxl.load_workbook(stream, read_only=True, data_only=True)
+        for line, row in enumerate(book.active.iter_rows(), 1):
+            yield line, [_cell(cell.value) for cell in row]
+    else:
+        raise ManifestError('只支持csv和xlsx格式的清单')
+
+
+def map_columns(headers):
+    """表头映射为字段，返回 ({列序号: 字段}, [被忽略的列名])"""
+    names = dict((field, field) for field in IMPORT_FIELDS)
+    names.update(dossier='dossier', creator='creator')
+    for field, label in FileView.column_labels.items():
+        if field in names:
+            names[label] = field
+    columns = {}
+    ignored = []
+    for index, header in enumerate(headers):
+        header = header.strip()
+        if header in names:
+            columns[index] = names[header]
+        elif header:
+            ignored.append(header)
+    return columns, ignored
+
+
+def build_context(creator_id=None):
+    """校验各行所需的全部数据，一次查出后交给各校验进程"""
+    users = {}
+    for id, username, email in db.session.query(User.id, User.username,
+                                                User.email):
+        users[email] = id
+        users[username] = id
+    columns = File.__table__.c
+    return dict(
+        required=REQUIRED_FIELDS,
+        # {字段: {名称: 代码}}
+        choices=dict((field, code_registry.codes(field))
+                     for field in CHOICE_FIELDS),
+        lengths=dict((field, getattr(columns[field].type, 'length', None))
+                     for field in IMPORT_FIELDS if field in columns),
+        dossiers=dict(db.session.query(Dossier.name, Dossier.id)),
+        # 已有未删除资源的题名键，用于查重
+        title_keys=set(key for key, in db.session.query(File.title_key)
+                       .filter(File.verified == False)),
+        users=users,
+        creator_id=creator_id
+    )
+
+
+_context = None
+
+
+def _init_worker(context):
+    global _context
+    _context = context
+
+
+def validate_row(line, values):
+    """校验一行，返回 (行号, 可插入的字典或None, [错误])"""
+    ctx = _context
+    labels = FileView.column_labels
+    mapping = dict(creator_id=ctx['creator_id'])
+    errors = []
+    for field, value in values.items():
+        value = value.strip()
+        if not value:
+            continue
+        if field == 'dossier':
+            if value not in ctx['dossiers']:
+                errors.append('全宗或类“%s”不存在' % value)
+            mapping['dossier_id'] = ctx['dossiers'].get(value)
+        elif field == 'creator':
+            if value not in ctx['users']:
+                errors.append('上传者“%s”不存在' % value)
+            mapping['creator_id'] = ctx['users'].get(value)
+        elif field in ctx['choices']:
+            if value not in ctx['choices'][field]:
+                errors.append('%s的取值“%s”不合法' % (labels[field], value))
+            mapping[field + '_id'] = ctx['choices'][field].get(value)
+        elif ctx['lengths'][field] and len(value) > ctx['lengths'][field]:
+            errors.append('%s超过%d个字符' % (labels.get(field, field),
+                                             ctx['lengths'][field]))
+        else:
+            mapping[field] = value
+    for field in ctx['required']:
+        if not values.get(field, '').strip():
+            errors.append('缺少%s' % labels[field])
+    if errors:
+        return line, None, errors
+    # 批量插入不经过File的validates
+    mapping['title_key'] = normalize_title(mapping['title_proper'])
+    if mapping['title_key'] in ctx['title_keys']:
+        return line, None, ['同名资源“%s”已上传' % mapping['title_proper']]
+    return line, mapping, []
+
+
+def _validate_chunk(rows):
+    return [validate_row(line, values) for line, values in rows]
+
+
+def _chunks(rows, columns, size):
+    chunk = []
+    for line, row in rows:
+        if not any(cell.strip() for cell in row):
+            continue
+        chunk.append((line, dict((field, row[index] if index < len(row)
+                                  else '')
+                                 for index, field in columns.items())))
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _validate_parallel(pool, chunks, window):
+    """按顺序返回校验结果，同时在途的块不超过window个"""
+    pending = deque()
+    for chunk in chunks:
+        pending.append(pool.apply_async(_validate_chunk, (chunk,)))
+        if len(pending) >= window:
+            yield pending.popleft().get()
+    while pending:
+        yield pending.popleft().get()
+
+
+def _insert(mappings):
+    """写入一块校验通过的行
+
+    批量插入不经过flush，分面计数、变更日志和全文索引队列需要单独登记。
+    """
+    # return_defaults会使每行单独INSERT；改为一条多行INSERT，再按题名与
+    # 本块共同的上传时间取回主键（块内题名不重复；精确到秒，MySQL的
+    # DATETIME不保存微秒）
+    now = datetime.utcnow().replace(microsecond=0)
+    for mapping in mappings:
+        mapping['timestamp'] = now
+    db.session.bulk_insert_mappings(File, mappings)
+    keys = dict(db.session.query(File.title_key, File.id).filter(
+        File.timestamp == now,
+        File.title_key.in_([mapping['title_key'] for mapping in mappings])))
+    for mapping in mappings:
+        mapping['id'] = keys[mapping['title_key']]
+    count_inserted(db.session, mappings)
+    ids = [mapping['id'] for mapping in mappings]
+    record_changes(db.session, ids, FileChange.CREATE)
+    search_indexer.queue(db.session, File, ids)
+    db.session.commit()
+    suggestions.add_mappings(mappings)
+
+
+def import_manifest(stream, filename, creator_id=None, procs=0,
+                    chunk_size=500, report=None):
+    """导入清单，返回ImportResult
+
+    procs为0时在当前进程中校验；report(result)在每写入一块后调用。
+    """
+    rows = read_rows(stream, filename)
+    try:
+        _, headers = next(rows)
+    except StopIteration:
+        raise ManifestError('清单为空')
+    columns, ignored = map_columns(headers)
+    if 'title_proper' not in columns.values():
+        raise ManifestError('清单缺少正题名列')
+
+    result = ImportResult(ignored)
+    context = build_context(creator_id)
+    # 清单内各行之间的查重，校验可能在多个进程中进行，在这里按顺序检查
+    seen = set()
+    chunks = _chunks(rows, columns, chunk_size)
+    pool = None
+    if procs:
+        pool = multiprocessing.Pool(procs, _init_worker, (context,))
+        validated = _validate_parallel(pool, chunks, procs * 2)
+    else:
+        _init_worker(context)
+        validated = (_validate_chunk(chunk) for chunk in chunks)
+    try:
+        for checked in validated:
+            lines = []
+            mappings = []
+            for line, mapping, errors in checked:
+                result.total += 1
+                result.errors.extend((line, error) for error in errors)
+                if mapping is not None and mapping['title_key'] in seen:
+                    result.errors.append((line, '与清单中前面的行同名'))
+                    continue
+                if mapping is not None:
+                    seen.add(mapping['title_key'])
+                    lines.append(line)
+                    mappings.append(mapping)
+            if mappings:
+                try:
+                    _insert(mappings)
+                except Exception:
+                    db.session.rollback()
+                    # 逐行重试，只有写不进去的行记为错误
+                    for line, mapping in zip(lines, mappings):
+                        try:
+                            _insert([mapping])
+                        except Exception as e:
+                            db.session.rollback()
+                            result.errors.append((line, '写入数据库失败：%s'
+                                                  % getattr(e, 'orig', e)))
+                        else:
+                            result.imported += 1
+                else:
+                    result.imported += len(mappings)
+            if report is not None:
+                report(result)
+    finally:
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+    result.errors.sort()
+    return result
@@ -8,12 +8,21 @@ from flask_admin.contrib.sqla import ModelView
 from flask_admin import expose, AdminIndexView
 from flask_login import current_user
 from wtforms.widgets import TextInput
-from wtforms import Field
+from wtforms import Field, SelectField
+from wtforms.validators import Optional
+from sqlalchemy.orm import validates
 import re
+import unicodedata
 from jieba.analyse.analyzer import ChineseAnalyzer
 
 from . import db
 from . import login_manager
+from . import presence_tracker
+from . import identity_cache
+from . import fragment_cache
+from . import tag_service
+from . import code_registry
+from . import suggestions
 
 
 class Permission(object):
@@ -59,59 +68,106 @@ class TagListField(Field):
     widget = TextInput()
 
     def __init__(self, label=None, validators=None, **kwargs):
+        # Flask-Admin为关系字段传入的选择框参数，这里用不到
+        kwargs.pop('allow_blank', None)
         super(TagListField, self).__init__(label, validators, **kwargs)
 
     def _value(self):
         if self.data:
-            r = ''
-            for obj in self.data:
-                r += self.obj_to_str(obj)
-            return ''
+            return ', '.join(self.obj_to_str(obj) for obj in self.data)
         else:
             return ''
 
     def process_formdata(self, valuelist):
+        # 只保留标签名，表单校验通过后才在populate_obj中解析（并创建）
+        # 标签，校验失败的提交不会留下无主的标签
         if valuelist:
-            tags = self._remove_duplicates(
-                [x.strip() for x in re.split(',|，', valuelist[0])]
-            )
-            self.data = [self.str_to_obj(tag) for tag in tags]
+            self.data = [name.strip() for name in
+                         re.split(',|，', valuelist[0]) if name.strip()]
         else:
             self.data = None
 
+    def populate_obj(self, obj, name):
+        # 一次解析所有标签，而不是每个标签查询一次
+        setattr(obj, name, tag_service.resolve(self.data or []))
+
     def pre_validate(self, form):
         pass
 
-    @classmethod
-    def _remove_duplicates(cls, seq):
-        """去重"""
-        d = {}
-        for item in seq:
-            if item.lower() not in d:
-                d[item.lower()] = True
-                yield item
-
     @classmethod
     def str_to_obj(cls, tag):
         """将字符串转换位obj对象"""
-        tag_obj = Tag.query.filter_by(name=tag).first()
-        if tag_obj is None:
-            tag_obj = Tag(name=tag)
-        return tag_obj
+        tags = tag_service.resolve([tag])
+        return tags[0] if tags else None
 
     @classmethod
     def obj_to_str(cls, obj):
-        """将对象转换为字符串"""
+        """将对象转换为字符串，校验失败重新显示时data中是标签名"""
         if obj:
-            return obj.name
+            return getattr(obj, 'name', obj)
         else:
             return u''
 
 
+def normalize_title(title):
+    """题名的比较键：全角转半角、忽略大小写，去掉空白和标点"""
+    title = unicodedata.normalize('NFKC', title or '').casefold()
+    return ''.join(c for c in title
+                   if unicodedata.category(c)[0] not in 'PZC')[:128]
+
+
+class Language(db.Model):
+    """语言代码表"""
+    __tablename__ = 'languages'
+    id = db.Column(db.SmallInteger, primary_key=True, autoincrement=False)
+    name = db.Column(db.String(64), unique=True, nullable=False)
+
+    def __repr__(self):
+        return self.name
+
+
+class CarrierType(db.Model):
+    """载体类型代码表"""
+    __tablename__ = 'carrier_types'
+    id = db.Column(db.SmallInteger, primary_key=True, autoincrement=False)
+    name = db.Column(db.String(64), unique=True, nullable=False)
+
+    def __repr__(self):
+        return self.name
+
+
+class ClassificationLevel(db.Model):
+    """密级代码表"""
+    __tablename__ = 'classification_levels'
+    id = db.Column(db.SmallInteger, primary_key=True, autoincrement=False)
+    name = db.Column(db.String(64), unique=True, nullable=False)
+
+    def __repr__(self):
+        return self.name
+
+
+def _code_label(field):
+    """以名称读写 ``<field>_id`` 代码列的属性"""
+    column = field + '_id'
+
+    def get(self):
+        return code_registry.label(field, getattr(self, column))
+
+    def set(self, label):
+        code = code_registry.code(field, label)
+        if label and code is None:
+            raise ValueError('%s的取值“%s”不存在' % (field, label))
+        setattr(self, column, code)
+
+    return property(get, set)
+
+
 file_tag_ref = db.Table(
     'file_tag_ref',
     db.Column('file_id', db.Integer, db.ForeignKey('files.id')),
-    db.Column('tag_id', db.Integer, db.ForeignKey('tags.id'))
+    db.Column('tag_id', db.Integer, db.ForeignKey('tags.id'), index=True),
+    db.Index('ix_file_tag_ref_file_id_tag_id', 'file_id', 'tag_id',
+             unique=True)
 )
 
 
@@ -121,19 +177,58 @@ class File(db.Model):
     __searchable__ = ['title_proper', 'title_parallel', 'title_sub', 'key_who',
                       'key_why', 'key_when', 'key_what', 'key_where', 'key_how']
     __analyzer__ = ChineseAnalyzer()
+    __table_args__ = tuple(
+        # 知识导航按主题词筛选未删除的资源并按时间排序
+        db.Index('ix_files_%s_verified_timestamp' % column,
+                 column, 'verified', 'timestamp')
+        for column in ('key_who', 'key_why', 'key_when',
+                       'key_where', 'key_how', 'key_what')
+    ) + (
+        # 浏览页按 (timestamp, id) 游标分页
+        db.Index('ix_files_verified_timestamp_id',
+                 'verified', 'timestamp', 'id'),
+        db.Index('ix_files_carrier_type_id_verified_timestamp_id',
+                 'carrier_type_id', 'verified', 'timestamp', 'id'),
+        # 按语言、密级筛选及重新统计分面
+        db.Index('ix_files_language_id_verified',
+                 'language_id', 'verified'),
+        db.Index('ix_files_classification_level_id_verified',
+                 'classification_level_id', 'verified'),
+        db.Index('ix_files_creator_id_verified_timestamp_id',
+                 'creator_id', 'verified', 'timestamp', 'id'),
+        # OAI-PMH按 (updated_at, id) 增量收割
+        db.Index('ix_files_updated_at_id', 'updated_at', 'id'),
+        # 按题名查找与查重
+        db.Index('ix_files_title_key_verified', 'title_key', 'verified'),
+    )
 
     # 数据库存储基本字段
     id = db.Column(db.Integer, primary_key=True)
     timestamp = db.Column(db.DateTime(), index=True, default=datetime.utcnow)
-    file_path = db.Column(db.String(128), unique=True)
+    # 最后修改时间，删除（verified）与案卷改名也会更新
+    updated_at = db.Column(db.DateTime(), default=datetime.utcnow,
+                           onupdate=datetime.utcnow)
+    # 按内容寻址存储，内容相同的档案共用同一路径
+    file_path = db.Column(db.String(256), index=True)
     file_name = db.Column(db.String(128))
+    sha256 = db.Column(db.String(64), index=True)
+    file_size = db.Column(db.BigInteger)
     verified = db.Column(db.Boolean, default=False)
+    # 被删除（verified置为True）的时间
+    deleted_at = db.Column(db.DateTime())
     creator_id = db.Column(db.Integer, db.ForeignKey('users.id'))
+    # 每次修改递增，用作页面片段缓存的版本
+    row_version = db.Column(db.Integer, nullable=False, default=1,
+                            server_default='1')
+    tags = db.relationship('Tag', secondary=file_tag_ref,
+                           backref=db.backref('files', lazy='dynamic'))
 
     # 档案资源属性
     # 档案资源内容特征
     # 题名（Title）
     title_proper = db.Column(db.String(128), nullable=False)
+    # normalize_title(title_proper)，随title_proper自动更新
+    title_key = db.Column(db.String(128))
     title_parallel = db.Column(db.String(128))
     title_sub = db.Column(db.String(128))
 
@@ -156,11 +251,12 @@ class File(db.Model):
     # dossier = db.Column(db.String(128))  # 全宗或类
     dossier_id = db.Column(db.Integer, db.ForeignKey('dossiers.id'))
 
-    # 语言（Language）
-    language = db.Column(db.String(128))
+    # 语言（Language），以代码保存，language为其名称
+    language_id = db.Column(db.SmallInteger, db.ForeignKey('languages.id'))
+    language = _code_label('language')
 
     # 相关资源
-    relation_path = db.Column(db.String(128), unique=True)
+    relation_path = db.Column(db.String(256))
     relation_name = db.Column(db.String(128))
 
     # 范围（Coverage)
@@ -169,7 +265,9 @@ class File(db.Model):
     coverage_note = db.Column(db.String(1024))
 
     # 密级
-    classification_level = db.Column(db.String(128))
+    classification_level_id = db.Column(
+        db.SmallInteger, db.ForeignKey('classification_levels.id'))
+    classification_level = _code_label('classification_level')
 
     # 保管期限
     retention_period = db.Column(db.String(128))
@@ -190,7 +288,9 @@ class File(db.Model):
     record_type = db.Column(db.String(128))
 
     # 格式
-    carrier_type = db.Column(db.String(128))
+    carrier_type_id = db.Column(db.SmallInteger,
+                                db.ForeignKey('carrier_types.id'))
+    carrier_type = _code_label('carrier_type')
     number = db.Column(db.String(128))
     specification = db.Column(db.String(128))
 
@@ -226,10 +326,73 @@ class File(db.Model):
     # location = db.Column(db.String(64))
     # rights = db.Column(db.String(64))
 
+    @validates('title_proper')
+    def _update_title_key(self, key, value):
+        self.title_key = normalize_title(value)
+        return value
+
     def __repr__(self):
         return self.title_proper
 
 
+class FacetCount(db.Model):
+    """各分面取值下未删除资源的数量，随File的增删改同步维护"""
+    __tablename__ = 'facet_counts'
+    # 全部未删除资源的总数记在 facet='*', value='' 下
+    FACETS = ('carrier_type_id', 'language_id', 'classification_level_id',
+              'dossier_id', 'creator_id', 'key_who', 'key_why', 'key_when',
+              'key_where', 'key_how', 'key_what')
+
+    facet = db.Column(db.String(32), primary_key=True)
+    value = db.Column(db.String(128), primary_key=True)
+    count = db.Column(db.Integer, nullable=False, default=0)
+
+    @staticmethod
+    def rebuild():
+        """从files表重新统计"""
+        FacetCount.query.delete()
+        live = File.query.filter_by(verified=False)
+        db.session.add(FacetCount(facet='*', value='', count=live.count()))
+        for facet in FacetCount.FACETS:
+            column = getattr(File, facet)
+            rows = db.session.query(column, db.func.count(File.id)) \
+                .filter(File.verified == False).group_by(column)
+            for value, count in rows:
+                db.session.add(FacetCount(
+                    facet=facet,
+                    value='' if value is None else str(value),
+                    count=count
+                ))
+        db.session.commit()
+
+    def __repr__(self):
+        return '%s=%s: %d' % (self.facet, self.value, self.count)
+
+
+class FileChange(db.Model):
+    """File的变更日志，seq单调递增，供增量同步按序读取
+
+    不设外键，资源被物理删除后其删除记录仍然保留。
+    """
+    __tablename__ = 'file_changes'
+    CREATE = 'create'
+    UPDATE = 'update'
+    DELETE = 'delete'
+
+    seq = db.Column(db.Integer, primary_key=True)
+    file_id = db.Column(db.Integer, nullable=False, index=True)
+    action = db.Column(db.String(16), nullable=False)
+    changed_at = db.Column(db.DateTime(), nullable=False,
+                           default=datetime.utcnow)
+
+    def to_json(self):
+        return dict(seq=self.seq, file_id=self.file_id, action=self.action,
+                    changed_at=self.changed_at.isoformat())
+
+    def __repr__(self):
+        return '<FileChange %d %s %d>' % (self.seq, self.action, self.file_id)
+
+
 class Dossier(db.Model):
     """docstring for Dodb.Model"""
     __tablename__ = 'dossiers'
@@ -250,6 +413,13 @@ class Tag(db.Model):
 
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(128), unique=True)
+    # name.casefold()，随name自动更新，用于不区分大小写地查找标签
+    name_key = db.Column(db.String(128), unique=True, index=True)
+
+    @validates('name')
+    def _update_name_key(self, key, value):
+        self.name_key = value.casefold() if value is not None else None
+        return value
 
     def __repr__(self):
         return self.name
@@ -353,8 +523,8 @@ class User(UserMixin, db.Model):
         return self.can(Permission.ADMINISTER)
 
     def ping(self):
-        self.last_seen = datetime.utcnow()
-        db.session.add(self)
+        # 由presence_tracker缓冲后批量写入，不在请求中更新users表
+        presence_tracker.ping(self.id)
 
 
 class AnonymousUser(AnonymousUserMixin):
@@ -371,7 +541,24 @@ login_manager.anonymous_user = AnonymousUser
 
 @login_manager.user_loader
 def load_user(user_id):
-    return User.query.get(int(user_id))
+    # 命中缓存时不查询数据库，角色随用户一起缓存
+    return identity_cache.load(db.session,
+                               User.query.options(db.joinedload('role')),
+                               int(user_id))
+
+
+# 用户或角色被修改（个人资料、后台管理、insert_roles等）时使缓存失效
+identity_cache.watch(User, Role)
+# 档案或其案卷被修改时递增row_version，使已缓存的页面片段失效
+fragment_cache.watch(File, Dossier)
+fragment_cache.watch_tags(File, Tag, file_tag_ref)
+# 标签被改名或删除时更新进程内的标签词典
+tag_service.watch(Tag)
+# 代码表被修改时重新读入代码与名称的对照
+code_registry.watch(language=Language, carrier_type=CarrierType,
+                    classification_level=ClassificationLevel)
+# 著录值被修改时从输入提示中移除旧值
+suggestions.watch(File, Dossier)
 
 
 class AdminModelView(ModelView):
@@ -443,19 +630,41 @@ class RoleView(AdminModelView):
     )
 
 
+def _code_formatter(view, context, model, name):
+    return code_registry.label(name[:-len('_id')], getattr(model, name))
+
+
+def _code_or_none(value):
+    """代码选项的值，空选项为None（未著录）"""
+    if value in ('', None):
+        return None
+    return int(value)
+
+
 class FileView(AdminModelView):
     """docstring for ClassName"""
     can_delete = True
     can_edit = True
     can_create = False
-    # form_overrides = dict(tags=TagListField)
+    form_overrides = dict(tags=TagListField)
+    # 由title_proper生成，不能单独编辑
+    form_excluded_columns = ('title_key',)
+    # 外键列不会自动生成表单字段，选项在edit_form中由代码表填充；
+    # 这些列可以为空，Optional使空选项通过校验
+    form_extra_fields = dict(
+        language_id=SelectField('语言', coerce=_code_or_none,
+                                validators=[Optional()]),
+        classification_level_id=SelectField('密级', coerce=_code_or_none,
+                                            validators=[Optional()]),
+        carrier_type_id=SelectField('载体类型', coerce=_code_or_none,
+                                    validators=[Optional()])
+    )
     # column_display_pk = True
     column_display_all_relations = True
     column_searchable_list = (
         File.title_sub,
         File.title_parallel,
         File.title_proper,
-        File.language,
         File.key_what,
         File.key_how,
         File.key_where,
@@ -470,20 +679,27 @@ class FileView(AdminModelView):
         "archive_num",
         "annotation",
         "dossier",
-        "language",
+        "language_id",
         "relation_name",
-        "classification_level",
+        "classification_level_id",
         "retention_period",
         "creator_",
         "publisher",
         "contributor",
         "rights",
         "date",
-        "carrier_type",
+        "carrier_type_id",
         "identifier",
         "verified"
     ]
 
+    # 代码列显示为名称
+    column_formatters = dict(
+        language_id=_code_formatter,
+        classification_level_id=_code_formatter,
+        carrier_type_id=_code_formatter
+    )
+
     column_labels = dict(
         id="索引编号",
         timestamp="上传时间",
@@ -507,12 +723,14 @@ class FileView(AdminModelView):
         dossier_id="全宗或类ID",
         dossier="全宗或类",
         language="语言",
+        language_id="语言",
         relation_path="相关资源路径",
         relation_name="相关资源名",
         archive_guide="档案馆指南",
         dossier_guide="全宗指南",
         coverage_note="卷、件内容覆盖范围说明",
         classification_level="密级",
+        classification_level_id="密级",
         retention_period="保管期限",
         creator_="责任者",
         publisher="发布者",
@@ -522,6 +740,7 @@ class FileView(AdminModelView):
         version="版本",
         record_type="文种",
         carrier_type="载体类型",
+        carrier_type_id="载体类型",
         number="数量及单位",
         specification="规格",
         record_num="文件编号",
@@ -529,6 +748,13 @@ class FileView(AdminModelView):
     )
     # inline_models = (Tag,)
 
+    def edit_form(self, obj=None):
+        form = super(FileView, self).edit_form(obj)
+        for field in ('language', 'classification_level', 'carrier_type'):
+            getattr(form, field + '_id').choices = \
+                [('', '')] + code_registry.choices(field)
+        return form
+
 
 class TagView(AdminModelView):
     """docstring for ClassName"""
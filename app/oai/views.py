@@ -0,0 +1,314 @@
+# -*- coding:utf-8 -*-
+"""OAI-PMH 2.0 数据提供接口
+
+``/oai`` 支持 Identify、ListMetadataFormats、ListSets、GetRecord、
+ListIdentifiers 和 ListRecords，元数据格式为 oai_dc。增量收割按
+``(updated_at, id)`` 排序，``from``/``until`` 落在同一索引上；
+resumptionToken 中保存上一页最后一条的游标和收割条件，每一页都是
+一次索引范围扫描，记录边查询边输出。被删除（verified）的资源以
+``status="deleted"`` 的记录头返回。
+"""
+import base64
+import binascii
+import json
+from datetime import datetime, timedelta
+from itertools import chain
+
+from flask import request, current_app, url_for, stream_with_context
+from sqlalchemy import and_, or_
+
+from . import oai
+from .. import db
+from ..models import File
+from ..export import record_query, to_record, dublin_core, xml_text
+from ..pagination import encode_cursor, decode_cursor
+
+OAI_DC_PREFIX = 'oai_dc'
+OAI_DC_SCHEMA = 'http://www.openarchives.org/OAI/2.0/oai_dc.xsd'
+OAI_DC_NAMESPACE = 'http://www.openarchives.org/OAI/2.0/oai_dc/'
+
+# 各动词允许的参数，(必需, 可选, 排他)
+VERBS = {
+    'Identify': ((), (), None),
+    'ListMetadataFormats': ((), ('identifier',), None),
+    'ListSets': ((), (), 'resumptionToken'),
+    'GetRecord': (('identifier', 'metadataPrefix'), (), None),
+    'ListIdentifiers': (('metadataPrefix',), ('from', 'until', 'set'),
+                        'resumptionToken'),
+    'ListRecords': (('metadataPrefix',), ('from', 'until', 'set'),
+                    'resumptionToken'),
+}
+
+_GRANULARITIES = (
+    ('%Y-%m-%dT%H:%M:%SZ', timedelta(seconds=1)),
+    ('%Y-%m-%d', timedelta(days=1)),
+)
+
+
+class OAIError(Exception):
+    def __init__(self, code, message):
+        Exception.__init__(self, message)
+        self.code = code
+        self.message = message
+
+
+def datestamp(value):
+    return value.strftime('%Y-%m-%dT%H:%M:%SZ')
+
+
+def parse_datestamp(value):
+    """返回 (时间, 该粒度下的一个单位)"""
+    for fmt, step in _GRANULARITIES:
+        try:
+            return datetime.strptime(value, fmt), step
+        except ValueError:
+            pass
+    raise OAIError('badArgument', '日期格式不合法：%s' % value)
+
+
+def oai_identifier(id):
+    return 'oai:%s:%d' % (current_app.config['OAI_REPOSITORY_IDENTIFIER'],
+                          id)
+
+
+def parse_identifier(identifier):
+    prefix = 'oai:%s:' % current_app.config['OAI_REPOSITORY_IDENTIFIER']
+    if identifier.startswith(prefix) and identifier[len(prefix):].isdigit():
+        return int(identifier[len(prefix):])
+    raise OAIError('idDoesNotExist', '标识符不存在：%s' % identifier)
+
+
+def encode_token(cursor, prefix, since, until):
+    raw = json.dumps(dict(c=cursor, m=prefix, f=since, u=until))
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii')
+
+
+def decode_token(token):
+    try:
+        raw = base64.urlsafe_b64decode(token.encode('ascii'))
+        data = json.loads(raw.decode('utf-8'))
+        cursor = decode_cursor(data['c'])
+    except (binascii.Error, UnicodeError, ValueError, KeyError, TypeError):
+        cursor = None
+    if cursor is None:
+        raise OAIError('badResumptionToken', 'resumptionToken不合法')
+    return cursor, data['m'], data['f'], data['u']
+
+
+def check_arguments(verb):
+    """校验参数，返回 {参数: 值}"""
+    required, optional, exclusive = VERBS[verb]
+    args = {}
+    for key in request.values:
+        if key == 'verb':
+            continue
+        values = request.values.getlist(key)
+        if len(values) > 1:
+            raise OAIError('badArgument', '参数重复：%s' % key)
+        if key not in required and key not in optional and \
+                key != exclusive:
+            raise OAIError('badArgument', '不支持的参数：%s' % key)
+        args[key] = values[0]
+    if exclusive in args:
+        if len(args) > 1:
+            raise OAIError('badArgument', '%s必须单独使用' % exclusive)
+        return args
+    for key in required:
+        if key not in args:
+            raise OAIError('badArgument', '缺少参数：%s' % key)
+    if 'metadataPrefix' in args and args['metadataPrefix'] != OAI_DC_PREFIX:
+        raise OAIError('cannotDisseminateFormat', '只支持oai_dc')
+    if 'set' in args:
+        raise OAIError('noSetHierarchy', '不支持集合')
+    return args
+
+
+def envelope(verb, args, body):
+    """产生完整的响应，body为字符串片段的可迭代对象"""
+    attributes = ''.join(' %s="%s"' % (key, xml_text(value))
+                         for key, value in sorted(args.items()))
+    if verb is not None:
+        attributes = ' verb="%s"%s' % (verb, attributes)
+    yield ('<?xml version="1.0" encoding="UTF-8"?>\n'
+           '<OAI-PMH xmlns="http://www.openarchives.org/OAI/2.0/" '
+           'xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" '
+           'xsi:schemaLocation="http://www.openarchives.org/OAI/2.0/ '
+           'http://www.openarchives.org/OAI/2.0/OAI-PMH.xsd">\n'
+           '<responseDate>%s</responseDate>\n'
+           '<request%s>%s</request>\n' % (
+               datestamp(datetime.utcnow()), attributes,
+               xml_text(url_for('oai.endpoint', _external=True))))
+    for piece in body:
+        yield piece
+    yield '</OAI-PMH>\n'
+
+
+def xml_response(chunks):
+    return current_app.response_class(
+        stream_with_context(chunks), content_type='text/xml; charset=utf-8')
+
+
+def header(record, updated_at, deleted):
+    return ('<header%s><identifier>%s</identifier>'
+            '<datestamp>%s</datestamp></header>' % (
+                ' status="deleted"' if deleted else '',
+                oai_identifier(int(record['id'])), datestamp(updated_at)))
+
+
+def metadata(record):
+    parts = ['<metadata><oai_dc:dc xmlns:oai_dc="%s" '
+             'xmlns:dc="http://purl.org/dc/elements/1.1/" '
+             'xsi:schemaLocation="%s %s">'
+             % (OAI_DC_NAMESPACE, OAI_DC_NAMESPACE, OAI_DC_SCHEMA)]
+    for element, value in dublin_core(record):
+        parts.append('<dc:%s>%s</dc:%s>' % (element, xml_text(value),
+                                            element))
+    parts.append('<dc:identifier>%s</dc:identifier>' % xml_text(url_for(
+        'main.file_detail', id=int(record['id']), _external=True)))
+    parts.append('</oai_dc:dc></metadata>')
+    return ''.join(parts)
+
+
+def record_xml(row, headers_only):
+    record = to_record(row[:-2])
+    deleted, updated_at = row[-2], row[-1]
+    if headers_only:
+        return header(record, updated_at, deleted) + '\n'
+    if deleted:
+        return '<record>%s</record>\n' % header(record, updated_at, deleted)
+    return '<record>%s%s</record>\n' % (header(record, updated_at, deleted),
+                                        metadata(record))
+
+
+def harvest_query(cursor, since, until):
+    query = record_query(File.verified, File.updated_at)
+    if since is not None:
+        query = query.filter(File.updated_at >= since)
+    if until is not None:
+        query = query.filter(File.updated_at < until)
+    if cursor is not None:
+        updated_at, id = cursor
+        query = query.filter(or_(
+            File.updated_at > updated_at,
+            and_(File.updated_at == updated_at, File.id > id)
+        ))
+    return query.order_by(File.updated_at, File.id)
+
+
+def list_records(verb, args):
+    if 'resumptionToken' in args:
+        cursor, prefix, since, until = decode_token(args['resumptionToken'])
+    else:
+        cursor = None
+        prefix = args['metadataPrefix']
+        since = args.get('from')
+        until = args.get('until')
+    since_value = until_value = None
+    if since:
+        since_value, since_step = parse_datestamp(since)
+    if until:
+        until_value, until_step = parse_datestamp(until)
+        # until包含该粒度内的整个时间段
+        until_value += until_step
+    if since and until and since_step != until_step:
+        raise OAIError('badArgument', 'from与until的粒度不一致')
+
+    page_size = current_app.config['OAI_PAGE_SIZE']
+    rows = iter(harvest_query(cursor, since_value, until_value)
+                .limit(page_size + 1)
+                .execution_options(stream_results=True)
+                .yield_per(page_size + 1))
+    first = next(rows, None)
+    if first is None:
+        raise OAIError('noRecordsMatch', '没有符合条件的记录')
+    headers_only = verb == 'ListIdentifiers'
+
+    def body():
+        yield '<%s>\n' % verb
+        last = None
+        for count, row in enumerate(chain([first], rows)):
+            if count == page_size:
+                token = encode_token(encode_cursor(last[-1], int(last[0])),
+                                     prefix, since, until)
+                yield '<resumptionToken>%s</resumptionToken>\n' % token
+                break
+            yield record_xml(row, headers_only)
+            last = row
+        else:
+            if cursor is not None:
+                # 最后一页以空的resumptionToken结束
+                yield '<resumptionToken/>\n'
+        yield '</%s>\n' % verb
+
+    return body()
+
+
+def identify():
+    earliest = db.session.query(db.func.min(File.updated_at)).scalar()
+    config = current_app.config
+    return [
+        '<Identify>\n',
+        '<repositoryName>%s</repositoryName>\n'
+        % xml_text(config['OAI_REPOSITORY_NAME']),
+        '<baseURL>%s</baseURL>\n'
+        % xml_text(url_for('oai.endpoint', _external=True)),
+        '<protocolVersion>2.0</protocolVersion>\n',
+        '<adminEmail>%s</adminEmail>\n'
+        % xml_text(config['METADATA_ADMIN'] or ''),
+        '<earliestDatestamp>%s</earliestDatestamp>\n'
+        % datestamp(earliest or datetime(1970, 1, 1)),
+        '<deletedRecord>transient</deletedRecord>\n',
+        '<granularity>YYYY-MM-DDThh:mm:ssZ</granularity>\n',
+        '</Identify>\n',
+    ]
+
+
+def list_metadata_formats(args):
+    if 'identifier' in args:
+        id = parse_identifier(args['identifier'])
+        if db.session.query(File.id).filter_by(id=id).first() is None:
+            raise OAIError('idDoesNotExist', '标识符不存在')
+    return [
+        '<ListMetadataFormats><metadataFormat>'
+        '<metadataPrefix>%s</metadataPrefix><schema>%s</schema>'
+        '<metadataNamespace>%s</metadataNamespace>'
+        '</metadataFormat></ListMetadataFormats>\n'
+        % (OAI_DC_PREFIX, OAI_DC_SCHEMA, OAI_DC_NAMESPACE)
+    ]
+
+
+def get_record(args):
+    id = parse_identifier(args['identifier'])
+    row = record_query(File.verified, File.updated_at) \
+        .filter(File.id == id).first()
+    if row is None:
+        raise OAIError('idDoesNotExist', '标识符不存在')
+    return ['<GetRecord>\n', record_xml(row, False), '</GetRecord>\n']
+
+
+@oai.route('', methods=['GET', 'POST'])
+def endpoint():
+    verb = request.values.get('verb')
+    args = {}
+    try:
+        if verb not in VERBS or len(request.values.getlist('verb')) > 1:
+            verb = None
+            raise OAIError('badVerb', '不支持的动词')
+        args = check_arguments(verb)
+        if verb == 'Identify':
+            body = identify()
+        elif verb == 'ListMetadataFormats':
+            body = list_metadata_formats(args)
+        elif verb == 'ListSets':
+            raise OAIError('noSetHierarchy', '不支持集合')
+        elif verb == 'GetRecord':
+            body = get_record(args)
+        else:
+            body = list_records(verb, args)
+    except OAIError as e:
+        # badVerb与badArgument时request元素不带参数
+        if e.code in ('badVerb', 'badArgument'):
+            verb, args = None, {}
+        body = ['<error code="%s">%s</error>\n'
+                % (e.code, xml_text(e.message))]
+    return xml_response(envelope(verb, args, body))
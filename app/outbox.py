@@ -0,0 +1,92 @@
+# -*- coding:utf-8 -*-
+import json
+import os
+import sqlite3
+import time
+
+
+class Outbox(object):
+    """基于本地SQLite文件的持久化消息队列
+
+    消息以JSON保存，进程崩溃或重启后不会丢失。消费者用 ``reserve``
+    领取一批消息（领取有租期，超时未确认的消息会被重新领取），处理完
+    后用 ``ack`` 删除。多个进程可以同时写入同一个队列文件。
+    """
+
+    def __init__(self, path, name='outbox', lease=300):
+        self.path = path
+        self.name = name
+        self.lease = lease
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        with self._connect() as conn:
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS %s ('
+                'id INTEGER PRIMARY KEY AUTOINCREMENT, '
+                'payload TEXT NOT NULL, '
+                'attempts INTEGER NOT NULL DEFAULT 0, '
+                'available_at REAL NOT NULL)' % self.name)
+            conn.execute(
+                'CREATE INDEX IF NOT EXISTS ix_%s_available_at '
+                'ON %s (available_at)' % (self.name, self.name))
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30)
+        conn.execute('PRAGMA journal_mode=WAL')
+        return conn
+
+    def put(self, payload, delay=0):
+        self.put_many([payload], delay)
+
+    def put_many(self, payloads, delay=0):
+        available_at = time.time() + delay
+        with self._connect() as conn:
+            conn.executemany(
+                'INSERT INTO %s (payload, available_at) VALUES (?, ?)'
+                % self.name,
+                [(json.dumps(p), available_at) for p in payloads])
+
+    def reserve(self, limit=100):
+        """领取至多limit条到期的消息，返回[(id, payload, attempts)]"""
+        now = time.time()
+        conn = self._connect()
+        try:
+            # BEGIN IMMEDIATE保证多个消费者不会领到同一批消息
+            conn.isolation_level = None
+            conn.execute('BEGIN IMMEDIATE')
+            rows = conn.execute(
+                'SELECT id, payload, attempts FROM %s '
+                'WHERE available_at <= ? ORDER BY id LIMIT ?' % self.name,
+                (now, limit)).fetchall()
+            if rows:
+                conn.executemany(
+                    'UPDATE %s SET available_at = ?, attempts = attempts + 1 '
+                    'WHERE id = ?' % self.name,
+                    [(now + self.lease, row[0]) for row in rows])
+            conn.execute('COMMIT')
+        finally:
+            conn.close()
+        return [(id, json.loads(payload), attempts)
+                for id, payload, attempts in rows]
+
+    def ack(self, ids):
+        if not ids:
+            return
+        with self._connect() as conn:
+            conn.executemany('DELETE FROM %s WHERE id = ?' % self.name,
+                             [(id,) for id in ids])
+
+    def retry(self, id, delay):
+        """处理失败，delay秒后重新投递"""
+        with self._connect() as conn:
+            conn.execute('UPDATE %s SET available_at = ? WHERE id = ?'
+                         % self.name, (time.time() + delay, id))
+
+    def depth(self):
+        conn = self._connect()
+        try:
+            return conn.execute('SELECT COUNT(*) FROM %s'
+                                % self.name).fetchone()[0]
+        finally:
+            conn.close()
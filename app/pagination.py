@@ -0,0 +1,88 @@
+# -*- coding:utf-8 -*-
+import base64
+import binascii
+from datetime import datetime
+
+from sqlalchemy import and_, or_
+
+_FORMATS = ('%Y-%m-%dT%H:%M:%S.%f', '%Y-%m-%dT%H:%M:%S')
+
+
+def encode_cursor(timestamp, id):
+    """把(timestamp, id)编码为可放在URL中的游标"""
+    raw = '%s|%d' % (timestamp.isoformat(), id)
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(cursor):
+    """解码游标，格式不对时返回None"""
+    if not cursor:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8')
+        timestamp, id = raw.rsplit('|', 1)
+        id = int(id)
+    except (binascii.Error, UnicodeError, ValueError):
+        return None
+    for fmt in _FORMATS:
+        try:
+            return datetime.strptime(timestamp, fmt), id
+        except ValueError:
+            pass
+    return None
+
+
+class KeysetPagination(object):
+    """按(timestamp, id)倒序的游标分页结果"""
+
+    def __init__(self, items, per_page, has_prev, has_next, total=None):
+        self.items = items
+        self.per_page = per_page
+        self.has_prev = has_prev
+        self.has_next = has_next
+        self.total = total
+
+    @property
+    def prev_cursor(self):
+        if self.has_prev and self.items:
+            first = self.items[0]
+            return encode_cursor(first.timestamp, first.id)
+
+    @property
+    def next_cursor(self):
+        if self.has_next and self.items:
+            last = self.items[-1]
+            return encode_cursor(last.timestamp, last.id)
+
+
+def keyset_paginate(query, per_page, after=None, before=None, total=None):
+    """游标分页，按时间倒序
+
+    after为上一页最后一条的游标，before为下一页第一条的游标，都不给时
+    返回第一页。每一页都是 (verified, timestamp, id) 索引上的一次范围
+    扫描，代价与翻到第几页无关。
+    """
+    model = query._mapper_zero().class_
+    after = decode_cursor(after)
+    before = decode_cursor(before) if after is None else None
+    if before is not None:
+        timestamp, id = before
+        rows = query.filter(or_(
+            model.timestamp > timestamp,
+            and_(model.timestamp == timestamp, model.id > id)
+        )).order_by(model.timestamp.asc(), model.id.asc()) \
+            .limit(per_page + 1).all()
+        has_prev = len(rows) > per_page
+        items = list(reversed(rows[:per_page]))
+        return KeysetPagination(items, per_page, has_prev, True, total)
+
+    if after is not None:
+        timestamp, id = after
+        query = query.filter(or_(
+            model.timestamp < timestamp,
+            and_(model.timestamp == timestamp, model.id < id)
+        ))
+    rows = query.order_by(model.timestamp.desc(), model.id.desc()) \
+        .limit(per_page + 1).all()
+    return KeysetPagination(rows[:per_page], per_page, after is not None,
+                            len(rows) > per_page, total)
@@ -0,0 +1,99 @@
+# -*- coding:utf-8 -*-
+import atexit
+import os
+import threading
+import time
+from datetime import datetime
+
+from sqlalchemy import case
+
+
+class PresenceTracker(object):
+    """延迟写入用户的 ``last_seen``
+
+    每次请求只在内存中记下用户的最近访问时间，同一用户在
+    ``PRESENCE_GRANULARITY`` 秒内的多次访问只记一次；后台线程每隔
+    ``PRESENCE_FLUSH_INTERVAL`` 秒用一条 ``UPDATE ... CASE`` 语句批量
+    写入数据库，进程退出时再写一次。写入使用独立连接，不影响请求中的
+    会话和事务。
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self.flush_interval = 60
+        self.granularity = 60
+        self._pending = {}
+        self._seen = {}
+        self._lock = threading.Lock()
+        self._worker_pid = None
+        atexit.register(self._flush_at_exit)
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        self.flush_interval = app.config.get('PRESENCE_FLUSH_INTERVAL',
+                                             self.flush_interval)
+        self.granularity = app.config.get('PRESENCE_GRANULARITY',
+                                          self.granularity)
+        app.extensions['presence'] = self
+
+    def ping(self, user_id):
+        now = time.time()
+        if now - self._seen.get(user_id, 0) < self.granularity:
+            return
+        with self._lock:
+            self._seen[user_id] = now
+            self._pending[user_id] = datetime.utcfromtimestamp(now)
+        self._ensure_worker()
+
+    def flush(self):
+        """把缓冲的访问时间写入数据库，返回写入的用户数"""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending or self.app is None:
+            return 0
+        from . import db
+        from .models import User
+        users = User.__table__
+        try:
+            with self.app.app_context():
+                with db.engine.begin() as conn:
+                    conn.execute(
+                        users.update()
+                        .where(users.c.id.in_(list(pending)))
+                        .values(last_seen=case(pending, value=users.c.id))
+                    )
+        except Exception:
+            # 放回缓冲区，下次再写；期间更新的时间优先
+            with self._lock:
+                for user_id, last_seen in pending.items():
+                    self._pending.setdefault(user_id, last_seen)
+            raise
+        return len(pending)
+
+    def _flush_at_exit(self):
+        try:
+            self.flush()
+        except Exception as e:
+            # 进程即将退出，无法再重试
+            self.app.logger.warning('退出时写入用户访问时间失败：%s', e)
+
+    def _ensure_worker(self):
+        if self._worker_pid == os.getpid():
+            return
+        with self._lock:
+            if self._worker_pid == os.getpid():
+                return
+            self._worker_pid = os.getpid()
+            thr = threading.Thread(target=self._flush_forever)
+            thr.daemon = True
+            thr.start()
+
+    def _flush_forever(self):
+        while True:
+            time.sleep(self.flush_interval)
+            try:
+                self.flush()
+            except Exception:
+                self.app.logger.exception('写入用户访问时间失败')
@@ -0,0 +1,115 @@
+# -*- coding:utf-8 -*-
+import threading
+import time
+from collections import Counter, deque
+from datetime import datetime
+
+from flask import g, request, has_request_context
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+
+class QueryProfiler(object):
+    """按请求统计SQL语句
+
+    打开 ``METADATA_QUERY_PROFILING`` 后，记录每个请求执行的语句数、
+    数据库总耗时以及重复执行的语句（常见于逐条懒加载关系），写入响应头
+    ``X-DB-Query-Count`` / ``X-DB-Query-Time`` / ``X-DB-Duplicate-Queries``；
+    耗时超过 ``METADATA_SLOW_DB_QUERY_TIME`` 秒的语句记入慢查询日志。
+    最近的统计可由管理员通过 ``/admin/query-stats`` 查看。
+
+    ``SQLALCHEMY_COMMIT_ON_TEARDOWN`` 的提交发生在响应之后，不计入。
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self.slow_query_time = 0.5
+        self.requests = deque(maxlen=200)
+        self.slow_queries = deque(maxlen=200)
+        self._lock = threading.Lock()
+        self._listening = False
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.extensions['query_profiler'] = self
+        if not app.config.get('METADATA_QUERY_PROFILING'):
+            return
+        self.app = app
+        self.slow_query_time = app.config.get('METADATA_SLOW_DB_QUERY_TIME',
+                                              self.slow_query_time)
+        size = app.config.get('METADATA_QUERY_STATS_SIZE', 200)
+        self.requests = deque(maxlen=size)
+        self.slow_queries = deque(maxlen=size)
+        app.before_request(self._start_request)
+        app.after_request(self._finish_request)
+        if not self._listening:
+            event.listen(Engine, 'before_cursor_execute',
+                         self._before_cursor_execute)
+            event.listen(Engine, 'after_cursor_execute',
+                         self._after_cursor_execute)
+            self._listening = True
+
+    @property
+    def enabled(self):
+        return self.app is not None
+
+    def _start_request(self):
+        g.query_stats = dict(count=0, duration=0.0, statements=Counter())
+
+    def _before_cursor_execute(self, conn, cursor, statement, parameters,
+                               context, executemany):
+        conn.info.setdefault('query_start_time', []).append(time.time())
+
+    def _after_cursor_execute(self, conn, cursor, statement, parameters,
+                              context, executemany):
+        duration = time.time() - conn.info['query_start_time'].pop()
+        in_request = has_request_context()
+        stats = getattr(g, 'query_stats', None) if in_request else None
+        if stats is not None:
+            stats['count'] += 1
+            stats['duration'] += duration
+            stats['statements'][statement] += 1
+        if duration >= self.slow_query_time:
+            entry = dict(
+                statement=statement,
+                parameters=repr(parameters)[:500],
+                duration=round(duration, 4),
+                endpoint=request.endpoint if in_request else None,
+                time=datetime.utcnow().isoformat()
+            )
+            with self._lock:
+                self.slow_queries.append(entry)
+            self.app.logger.warning('慢查询 %.3fs: %s', duration, statement)
+
+    def _finish_request(self, response):
+        stats = getattr(g, 'query_stats', None)
+        if stats is None:
+            return response
+        duplicates = [(statement, n)
+                      for statement, n in stats['statements'].most_common()
+                      if n > 1]
+        response.headers['X-DB-Query-Count'] = str(stats['count'])
+        response.headers['X-DB-Query-Time'] = '%.1fms' % (
+            stats['duration'] * 1000)
+        response.headers['X-DB-Duplicate-Queries'] = str(
+            sum(n - 1 for _, n in duplicates))
+        with self._lock:
+            self.requests.append(dict(
+                endpoint=request.endpoint,
+                path=request.path,
+                method=request.method,
+                count=stats['count'],
+                duration=round(stats['duration'], 4),
+                duplicates=[dict(statement=statement, count=n)
+                            for statement, n in duplicates[:10]],
+                time=datetime.utcnow().isoformat()
+            ))
+        return response
+
+    def report(self):
+        with self._lock:
+            return dict(enabled=self.enabled,
+                        slow_query_time=self.slow_query_time,
+                        requests=list(self.requests),
+                        slow_queries=list(self.slow_queries))
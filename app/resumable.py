@@ -0,0 +1,210 @@
+# -*- coding:utf-8 -*-
+import hashlib
+import json
+import os
+import threading
+import time
+import uuid
+
+
+class UploadError(Exception):
+    """断点续传请求不合法，status为应返回的HTTP状态码"""
+
+    def __init__(self, message, status=400):
+        super(UploadError, self).__init__(message)
+        self.message = message
+        self.status = status
+
+
+class ResumableUploads(object):
+    """大文件断点续传
+
+    每个上传会话在暂存目录中对应两个文件：``<id>.part`` 保存已收到的
+    数据，``<id>.json`` 为会话清单（文件名、总大小、已收到的偏移量、
+    著录信息、过期时间）。两者都在磁盘上，进程重启后可以从清单记录的
+    偏移量继续上传。过期未完成的会话由后台线程定期清理。
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self.staging_dir = None
+        self.expires = 24 * 3600
+        self.sweep_interval = 600
+        self.chunk_size = 64 * 1024
+        self._sweeper_pid = None
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        self.staging_dir = app.config.get('RESUMABLE_UPLOAD_DIR') or \
+            os.path.join(app.config['UPLOAD_DIR'], '.staging')
+        self.expires = app.config.get('RESUMABLE_UPLOAD_EXPIRES',
+                                      self.expires)
+        self.sweep_interval = app.config.get(
+            'RESUMABLE_UPLOAD_SWEEP_INTERVAL', self.sweep_interval)
+        self.chunk_size = app.config.get('UPLOAD_CHUNK_SIZE', self.chunk_size)
+        if not os.path.exists(self.staging_dir):
+            os.makedirs(self.staging_dir)
+        app.extensions['resumable_uploads'] = self
+
+    def _paths(self, upload_id):
+        # id只由uuid4生成，拒绝其他形式以防路径穿越
+        try:
+            upload_id = uuid.UUID(upload_id).hex
+        except ValueError:
+            raise UploadError('上传会话不存在', 404)
+        base = os.path.join(self.staging_dir, upload_id)
+        return base + '.json', base + '.part'
+
+    def _write_manifest(self, manifest):
+        manifest_path, _ = self._paths(manifest['id'])
+        tmp_path = manifest_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(manifest, f)
+        os.replace(tmp_path, manifest_path)
+
+    def load(self, upload_id):
+        manifest_path, _ = self._paths(upload_id)
+        try:
+            with open(manifest_path) as f:
+                return json.load(f)
+        except (IOError, OSError, ValueError):
+            raise UploadError('上传会话不存在', 404)
+
+    def create(self, user_id, filename, size, metadata, sha256=None):
+        """新建上传会话，返回清单"""
+        if size < 0:
+            raise UploadError('文件大小不合法')
+        now = time.time()
+        manifest = dict(
+            id=uuid.uuid4().hex,
+            user_id=user_id,
+            filename=filename,
+            size=size,
+            sha256=sha256,
+            offset=0,
+            metadata=metadata,
+            created=now,
+            expires=now + self.expires
+        )
+        _, part_path = self._paths(manifest['id'])
+        open(part_path, 'wb').close()
+        self._write_manifest(manifest)
+        return manifest
+
+    def write_chunk(self, upload_id, offset, stream):
+        """把请求体从offset处写入暂存文件，返回更新后的清单
+
+        offset不能超过已收到的字节数，允许重发已收到的部分。
+        """
+        manifest = self.load(upload_id)
+        if offset > manifest['offset']:
+            raise UploadError('偏移量不连续，应从%d继续' % manifest['offset'],
+                              409)
+        _, part_path = self._paths(upload_id)
+        position = offset
+        with open(part_path, 'r+b') as f:
+            f.seek(offset)
+            while True:
+                chunk = stream.read(self.chunk_size)
+                if not chunk:
+                    break
+                if position + len(chunk) > manifest['size']:
+                    raise UploadError('数据超出声明的文件大小', 413)
+                f.write(chunk)
+                position += len(chunk)
+        manifest['offset'] = max(manifest['offset'], position)
+        manifest['expires'] = time.time() + self.expires
+        self._write_manifest(manifest)
+        return manifest
+
+    def finalize(self, upload_id, blob_storage):
+        """校验并把暂存文件移入内容寻址存储，返回(清单, StoredBlob)"""
+        manifest = self.load(upload_id)
+        if manifest['offset'] != manifest['size']:
+            raise UploadError('文件尚未上传完毕，已收到%d字节' %
+                              manifest['offset'], 409)
+        _, part_path = self._paths(upload_id)
+        sha256 = hashlib.sha256()
+        with open(part_path, 'rb') as f:
+            while True:
+                chunk = f.read(self.chunk_size)
+                if not chunk:
+                    break
+                sha256.update(chunk)
+        digest = sha256.hexdigest()
+        if manifest['sha256'] and manifest['sha256'].lower() != digest:
+            self.discard(upload_id)
+            raise UploadError('文件校验失败，请重新上传', 422)
+        blob = blob_storage.adopt(part_path, digest, manifest['size'])
+        self.discard(upload_id)
+        return manifest, blob
+
+    def discard(self, upload_id):
+        for path in self._paths(upload_id):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def sweep(self, now=None):
+        """删除过期的上传会话，返回删除的个数"""
+        now = now or time.time()
+        removed = 0
+        for name in os.listdir(self.staging_dir):
+            # <id>.json、<id>.part，以及写清单时的 <id>.json.tmp
+            upload_id, _, ext = name.partition('.')
+            path = os.path.join(self.staging_dir, name)
+            try:
+                uuid.UUID(upload_id)
+            except ValueError:
+                # 不是上传会话留下的文件
+                continue
+            try:
+                if ext == 'json':
+                    try:
+                        with open(path) as f:
+                            expired = json.load(f)['expires'] < now
+                    except (IOError, OSError, ValueError, KeyError):
+                        expired = os.path.getmtime(path) + self.expires < now
+                    if expired:
+                        self.discard(upload_id)
+                        removed += 1
+                elif ext == 'part':
+                    # 写清单前进程退出留下的孤立文件
+                    manifest_path = os.path.join(self.staging_dir,
+                                                 upload_id + '.json')
+                    if not os.path.exists(manifest_path) and \
+                            os.path.getmtime(path) + self.expires < now:
+                        os.remove(path)
+                elif ext == 'json.tmp':
+                    # 替换清单前进程退出留下的临时文件
+                    if os.path.getmtime(path) + self.expires < now:
+                        os.remove(path)
+            except FileNotFoundError:
+                # 列出目录之后已被删除（如同一会话的清单过期时一并删除）
+                continue
+        return removed
+
+    def ensure_sweeper(self):
+        """确保当前进程中有清理线程在运行（fork之后需要重新启动）"""
+        if not self.sweep_interval or self._sweeper_pid == os.getpid():
+            return
+        with self._lock:
+            if self._sweeper_pid == os.getpid():
+                return
+            self._sweeper_pid = os.getpid()
+            thr = threading.Thread(target=self._sweep_forever)
+            thr.daemon = True
+            thr.start()
+
+    def _sweep_forever(self):
+        while True:
+            try:
+                self.sweep()
+            except Exception:
+                if self.app is not None:
+                    self.app.logger.exception('清理上传会话失败')
+            time.sleep(self.sweep_interval)
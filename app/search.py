@@ -0,0 +1,288 @@
+# -*- coding:utf-8 -*-
+import multiprocessing
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+import flask_sqlalchemy
+import flask_whooshalchemyplus as whooshalchemy
+import whoosh.index
+from flask import current_app
+from flask_sqlalchemy import Pagination
+from sqlalchemy import event
+from whoosh.filedb.filestore import FileStorage
+from whoosh.qparser import MultifieldParser, OrGroup
+from whoosh.writing import AsyncWriter
+
+from .outbox import Outbox
+
+
+def get_index(app, model):
+    """取得模型的whoosh索引，已打开的索引直接复用"""
+    indexes = getattr(app, 'whoosh_indexes', {})
+    if model.__name__ in indexes:
+        return indexes[model.__name__]
+    return whooshalchemy.whoosh_index(app, model)
+
+
+def paginate_search(query, text, page, per_page):
+    """按BM25相关度分页搜索
+
+    只从whoosh取出当前页的主键，再用一条IN查询加载这些记录，并按相关
+    度排序；总数由whoosh统计命中文档号得出，不加载其余记录。
+    query为模型的查询对象（可带过滤条件），返回Pagination。
+    """
+    model = query._mapper_zero().class_
+    index = get_index(current_app._get_current_object(), model)
+    primary = model.whoosh_primary_key
+    fields = [name for name in index.schema.names() if name != primary]
+    parser = MultifieldParser(fields, index.schema, group=OrGroup)
+    with index.searcher() as searcher:
+        results = searcher.search_page(parser.parse(text), max(page, 1),
+                                       pagelen=per_page)
+        total = results.total
+        page = results.pagenum
+        ranks = dict((int(hit[primary]), rank)
+                     for rank, hit in enumerate(results))
+    return ranked_pagination(query, primary, ranks, page, per_page, total)
+
+
+def paginate_content_search(query, text, page, per_page):
+    """在上传文件的全文索引中搜索，用法同paginate_search"""
+    indexer = current_app.extensions['content_indexer']
+    ranks, total, page = indexer.search(text, page, per_page)
+    return ranked_pagination(query, 'id', ranks, page, per_page, total)
+
+
+def ranked_pagination(query, primary, ranks, page, per_page, total):
+    """用一条IN查询加载 {主键: 名次} 中的记录，按名次排序"""
+    model = query._mapper_zero().class_
+    items = []
+    if ranks:
+        items = query.filter(getattr(model, primary).in_(list(ranks))).all()
+        items.sort(key=lambda item: ranks[getattr(item, primary)])
+    return Pagination(query, page, per_page, total, items)
+
+
+def searchable_document(obj, primary):
+    """按 ``__searchable__`` 生成要写入索引的文档"""
+    doc = dict((key, u'%s' % (getattr(obj, key) or u''))
+               for key in obj.__searchable__)
+    doc[primary] = u'%s' % getattr(obj, primary)
+    return doc
+
+
+def is_indexable(obj):
+    # File用verified标记删除，已删除的资源从索引中移除
+    return not getattr(obj, 'verified', False)
+
+
+class SearchIndexer(object):
+    """异步写入全文索引
+
+    提交数据库事务时只把变动记录的主键写入本地SQLite队列
+    （``WHOOSH_QUEUE``），由后台线程批量取出，用一个AsyncWriter写入
+    whoosh索引并提交一次。用户请求不再等待分词和索引写锁。
+
+    whoosh同一时间只允许一个写者，各进程的索引线程通过索引目录下的
+    文件锁互斥；也可以关闭 ``WHOOSH_INDEXER_THREAD``，改为单独运行
+    ``python manage.py index_worker``。
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self.outbox = None
+        self._worker_pid = None
+        self._lock = threading.Lock()
+        event.listen(flask_sqlalchemy.SignallingSession, 'after_flush',
+                     self._collect)
+        event.listen(flask_sqlalchemy.SignallingSession, 'after_commit',
+                     self._enqueue)
+        event.listen(flask_sqlalchemy.SignallingSession, 'after_rollback',
+                     self._discard)
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        self.batch_size = app.config.get('WHOOSH_INDEX_BATCH_SIZE', 500)
+        self.interval = app.config.get('WHOOSH_INDEX_INTERVAL', 2)
+        self.outbox = Outbox(app.config['WHOOSH_QUEUE'], 'search_index')
+        # 不再在提交事务的请求中同步更新索引
+        receiver = getattr(whooshalchemy, '_after_flush', None)
+        if receiver is not None:
+            flask_sqlalchemy.models_committed.disconnect(receiver)
+        app.extensions['search_indexer'] = self
+        if app.config.get('WHOOSH_INDEXER_THREAD', True):
+            app.before_request(self.ensure_worker)
+
+    def _models(self):
+        from . import db
+        return dict((cls.__name__, cls)
+                    for cls in db.Model._decl_class_registry.values()
+                    if hasattr(cls, '__searchable__'))
+
+    def _collect(self, session, flush_context):
+        changes = session.info.setdefault('search_changes', set())
+        for obj in session.new | session.dirty | session.deleted:
+            if hasattr(obj, '__searchable__') and obj.id is not None:
+                changes.add((obj.__class__.__name__, obj.id))
+
+    def _enqueue(self, session):
+        changes = session.info.pop('search_changes', None)
+        if changes and self.outbox is not None:
+            self.outbox.put_many([dict(model=model, id=id)
+                                  for model, id in changes])
+
+    def queue(self, session, model, ids):
+        """登记不经过flush的变动（如批量插入），随session提交写入队列"""
+        changes = session.info.setdefault('search_changes', set())
+        changes.update((model.__name__, id) for id in ids)
+
+    def _discard(self, session):
+        session.info.pop('search_changes', None)
+
+    def index(self, payloads):
+        """把一批变动写入索引，每个模型只提交一次"""
+        from . import db
+        models = self._models()
+        bymodel = {}
+        for payload in payloads:
+            bymodel.setdefault(payload['model'], set()).add(payload['id'])
+        with self.app.app_context():
+            try:
+                for name, ids in bymodel.items():
+                    model = models[name]
+                    index = get_index(self.app, model)
+                    primary = model.whoosh_primary_key
+                    rows = model.query.filter(
+                        getattr(model, primary).in_(ids)).all()
+                    writer = AsyncWriter(index)
+                    for row in rows:
+                        ids.discard(getattr(row, primary))
+                        if is_indexable(row):
+                            writer.update_document(
+                                **searchable_document(row, primary))
+                        else:
+                            writer.delete_by_term(
+                                primary, u'%s' % getattr(row, primary))
+                    for id in ids:
+                        writer.delete_by_term(primary, u'%s' % id)
+                    writer.commit()
+            finally:
+                db.session.remove()
+
+    def drain(self):
+        """处理队列中所有到期的消息，返回处理的条数"""
+        processed = 0
+        while True:
+            messages = self.outbox.reserve(self.batch_size)
+            if not messages:
+                return processed
+            try:
+                self.index([payload for _, payload, _ in messages])
+            except Exception:
+                self.app.logger.exception('写入全文索引失败')
+                for id, _, attempts in messages:
+                    self.outbox.retry(id, min(2 ** attempts, 300))
+                return processed
+            self.outbox.ack([id for id, _, _ in messages])
+            processed += len(messages)
+
+    def run(self):
+        """持续处理队列；同一时刻只有拿到索引目录锁的进程在写"""
+        storage = FileStorage(self.app.config['WHOOSH_BASE'])
+        if not os.path.exists(storage.folder):
+            os.makedirs(storage.folder)
+        lock = storage.lock('INDEXER')
+        while True:
+            if lock.acquire(blocking=False):
+                try:
+                    self.drain()
+                except Exception:
+                    self.app.logger.exception('全文索引队列读取失败')
+                finally:
+                    lock.release()
+            time.sleep(self.interval)
+
+    def ensure_worker(self):
+        """确保当前进程中有索引线程在运行（fork之后需要重新启动）"""
+        if self._worker_pid == os.getpid():
+            return
+        with self._lock:
+            if self._worker_pid == os.getpid():
+                return
+            self._worker_pid = os.getpid()
+            thr = threading.Thread(target=self.run)
+            thr.daemon = True
+            thr.start()
+
+
+def rebuild_index(app, model, procs=None, limitmb=256, batch_size=1000,
+                  report=None):
+    """在新目录中重建模型的全文索引，完成后替换旧索引
+
+    逐批读取数据库记录，由whoosh的多进程写入器在procs个子进程中分词并
+    各自写入分段，提交时合并为一个分段。重建期间持有索引锁，后台索引
+    线程暂停，期间的变动留在队列中，替换完成后再写入新索引。
+    ``WHOOSH_BASE/<模型名>`` 是指向当前一代索引目录的符号链接，新索引
+    建在新目录中，完成后原子地替换链接，查询始终能打开完整的索引。
+    report(count, seconds) 每处理batch_size条调用一次。返回写入的文档数。
+    """
+    base = os.path.join(app.config['WHOOSH_BASE'], model.__name__)
+    if not os.path.exists(app.config['WHOOSH_BASE']):
+        os.makedirs(app.config['WHOOSH_BASE'])
+    # 每次都用新目录：同一秒内再次重建时不能删掉当前一代索引
+    build_dir = tempfile.mkdtemp(prefix='%s.' % model.__name__,
+                                 dir=app.config['WHOOSH_BASE'])
+
+    analyzer = whooshalchemy._get_analyzer(app, model)
+    schema, primary = whooshalchemy._get_whoosh_schema_and_primary_key(
+        model, analyzer)
+    index = whoosh.index.create_in(build_dir, schema)
+
+    lock = FileStorage(app.config['WHOOSH_BASE']).lock('INDEXER')
+    lock.acquire(blocking=True)
+    try:
+        writer = index.writer(procs=procs or multiprocessing.cpu_count(),
+                              limitmb=limitmb)
+        query = model.query.order_by(getattr(model, primary)) \
+            .execution_options(stream_results=True).yield_per(batch_size)
+        count = 0
+        start = time.time()
+        try:
+            for row in query:
+                if not is_indexable(row):
+                    continue
+                writer.add_document(**searchable_document(row, primary))
+                count += 1
+                if report and count % batch_size == 0:
+                    report(count, time.time() - start)
+            writer.commit()
+        except BaseException:
+            writer.cancel()
+            shutil.rmtree(build_dir, ignore_errors=True)
+            raise
+        if report:
+            report(count, time.time() - start)
+
+        old_dir = None
+        if os.path.islink(base):
+            old_dir = os.path.realpath(base)
+        elif os.path.isdir(base):
+            # 目录不能原子地替换为链接，旧的索引目录先改名（只在第一次
+            # 重建时发生）
+            old_dir = '%s.legacy' % base
+            os.rename(base, old_dir)
+        link = '%s.link-%d' % (base, os.getpid())
+        if os.path.lexists(link):
+            os.remove(link)
+        os.symlink(os.path.basename(build_dir), link)
+        os.replace(link, base)
+        if old_dir is not None:
+            shutil.rmtree(old_dir, ignore_errors=True)
+    finally:
+        lock.release()
+    return count
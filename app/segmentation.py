@@ -0,0 +1,71 @@
+# -*- coding:utf-8 -*-
+import os
+import time
+
+
+class JiebaDictionary(object):
+    """预加载jieba词典
+
+    jieba在第一次分词时才构建前缀词典，每个新的工作进程的第一次搜索或
+    索引写入都要等待数秒。``JIEBA_PRELOAD`` 为True时在create_app中加载，
+    只在启动服务时打开，配合 ``gunicorn --preload`` 在主进程fork之前完成，
+    各worker以写时复制的方式共享同一份词典。编译后的词典缓存写在 ``JIEBA_CACHE_DIR``，
+    ``JIEBA_USER_DICT`` 为档案术语等自定义词典（jieba词典格式）。
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self.timings = {}
+        # 已载入的自定义词典路径
+        self.user_dict = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        import jieba
+        self.app = app
+        cache_dir = app.config.get('JIEBA_CACHE_DIR')
+        if cache_dir:
+            if not os.path.exists(cache_dir):
+                os.makedirs(cache_dir)
+            jieba.dt.tmp_dir = cache_dir
+        app.extensions['jieba_dictionary'] = self
+        if app.config.get('JIEBA_PRELOAD', False):
+            self.load()
+        elif app.config.get('JIEBA_USER_DICT'):
+            # 不预加载时自定义词典仍需在第一次分词前载入
+            app.before_first_request(self.load)
+
+    def load(self):
+        """加载词典和自定义词典并预热分析器，返回本次各步骤的 {步骤: 秒}
+
+        可以重复调用，已完成的步骤不再执行。索引写入等命令行任务也要在
+        开始前调用，使文档与查询按同样的词典分词。
+        """
+        import jieba
+        from .models import File
+        timings = {}
+        if not jieba.dt.initialized:
+            start = time.time()
+            jieba.initialize()
+            timings['dictionary'] = time.time() - start
+
+        # 其他代码已经触发jieba初始化时，自定义词典仍需单独载入
+        user_dict = self.app.config.get('JIEBA_USER_DICT')
+        if user_dict and user_dict != self.user_dict:
+            start = time.time()
+            jieba.load_userdict(user_dict)
+            self.user_dict = user_dict
+            timings['user_dict'] = time.time() - start
+
+        if not timings:
+            return timings
+        # 分析器中的过滤器也有各自的缓存
+        start = time.time()
+        list(File.__analyzer__(u'档案资源知识服务系统'))
+        timings['analyzer'] = time.time() - start
+
+        self.timings.update(timings)
+        self.app.logger.info('jieba词典加载完成：%s', '，'.join(
+            '%s %.2f秒' % item for item in sorted(timings.items())))
+        return timings
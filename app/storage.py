@@ -0,0 +1,95 @@
+# -*- coding:utf-8 -*-
+import hashlib
+import os
+import tempfile
+
+
+class StoredBlob(object):
+    """一次写入存储后的结果"""
+
+    def __init__(self, digest, size, path, created):
+        self.digest = digest
+        self.size = size
+        self.path = path
+        # 为False时说明同样内容的文件已存在，本次写入被跳过
+        self.created = created
+
+    def __repr__(self):
+        return '<StoredBlob %s (%d bytes)>' % (self.digest, self.size)
+
+
+class BlobStorage(object):
+    """按SHA-256内容寻址的上传文件存储
+
+    上传内容按块读取、边读边计算摘要并写入临时文件，写完后再原子地
+    重命名到 ``UPLOAD_DIR/ab/cd/<sha256>``。内容相同的文件只保存一份，
+    内存占用只与块大小有关，与文件大小无关。
+    """
+
+    def __init__(self, app=None):
+        self.root = None
+        self.chunk_size = 64 * 1024
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.root = app.config['UPLOAD_DIR']
+        self.chunk_size = app.config.get('UPLOAD_CHUNK_SIZE', self.chunk_size)
+        app.extensions['blob_storage'] = self
+
+    @property
+    def tmp_dir(self):
+        return os.path.join(self.root, '.tmp')
+
+    def path_for(self, digest):
+        return os.path.join(self.root, digest[:2], digest[2:4], digest)
+
+    def exists(self, digest):
+        return os.path.exists(self.path_for(digest))
+
+    def save(self, storage):
+        """保存werkzeug的FileStorage对象"""
+        return self.save_stream(storage.stream)
+
+    def save_stream(self, stream):
+        """分块读取stream，返回StoredBlob"""
+        if not os.path.exists(self.tmp_dir):
+            os.makedirs(self.tmp_dir)
+        sha256 = hashlib.sha256()
+        size = 0
+        fd, tmp_path = tempfile.mkstemp(dir=self.tmp_dir)
+        try:
+            with os.fdopen(fd, 'wb') as out:
+                while True:
+                    chunk = stream.read(self.chunk_size)
+                    if not chunk:
+                        break
+                    sha256.update(chunk)
+                    out.write(chunk)
+                    size += len(chunk)
+        except Exception:
+            os.remove(tmp_path)
+            raise
+        return self.adopt(tmp_path, sha256.hexdigest(), size)
+
+    def adopt(self, tmp_path, digest, size):
+        """将已写好并算出摘要的临时文件移入内容寻址位置
+
+        临时文件必须和存储目录位于同一文件系统。
+        """
+        path = self.path_for(digest)
+        if os.path.exists(path):
+            os.remove(tmp_path)
+            return StoredBlob(digest, size, path, False)
+        directory = os.path.dirname(path)
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+        try:
+            os.rename(tmp_path, path)
+        except OSError:
+            # 并发上传了同样的内容，另一方已先写入
+            if not os.path.exists(path):
+                raise
+            os.remove(tmp_path)
+            return StoredBlob(digest, size, path, False)
+        return StoredBlob(digest, size, path, True)
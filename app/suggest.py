@@ -0,0 +1,243 @@
+# -*- coding:utf-8 -*-
+import bisect
+import threading
+import time
+
+import flask_sqlalchemy
+from sqlalchemy import event
+from sqlalchemy.orm.attributes import get_history, PASSIVE_OFF
+
+try:
+    from pypinyin import lazy_pinyin
+except ImportError:
+    # 未安装pypinyin时只按原文前缀检索
+    lazy_pinyin = None
+
+# 提供输入提示的File字段；dossier为案卷名
+FILE_FIELDS = ('key_who', 'key_why', 'key_when', 'key_where', 'key_how',
+               'key_what', 'creator_', 'title_proper')
+FIELDS = FILE_FIELDS + ('dossier',)
+
+
+def prefix_keys(value):
+    """value可被检索的前缀键：原文小写，以及全拼和拼音首字母"""
+    keys = set([value.casefold()])
+    if lazy_pinyin is None:
+        return keys
+    syllables = [s.casefold() for s in lazy_pinyin(value) if s.strip()]
+    if syllables:
+        keys.add(''.join(syllables))
+        keys.add(''.join(s[0] for s in syllables))
+    return keys
+
+
+class PrefixIndex(object):
+    """一个字段的有序前缀表
+
+    ``_items`` 为按键排序的 ``(键, 值)``，用bisect找到前缀的起点后顺序
+    扫描；``counts`` 为每个值的资源数，用于排序。
+    """
+
+    def __init__(self):
+        self._items = []
+        self.counts = {}
+
+    def add(self, value, count=1):
+        if not value:
+            return
+        if value not in self.counts:
+            self.counts[value] = 0
+            for key in prefix_keys(value):
+                bisect.insort(self._items, (key, value))
+        self.counts[value] += count
+
+    def remove(self, value, count=1):
+        """count为None时不论资源数直接移除"""
+        if value not in self.counts:
+            return
+        if count is not None:
+            self.counts[value] -= count
+            if self.counts[value] > 0:
+                return
+        del self.counts[value]
+        for key in prefix_keys(value):
+            i = bisect.bisect_left(self._items, (key, value))
+            if i < len(self._items) and self._items[i] == (key, value):
+                del self._items[i]
+
+    def search(self, prefix, limit=10, scan=200):
+        """以prefix开头的值，按资源数从多到少，最多检查scan个键"""
+        prefix = prefix.casefold()
+        i = bisect.bisect_left(self._items, (prefix, ''))
+        found = set()
+        for key, value in self._items[i:i + scan]:
+            if not key.startswith(prefix):
+                break
+            found.add(value)
+        return sorted(found, key=lambda v: (-self.counts[v], v))[:limit]
+
+
+class SuggestionIndex(object):
+    """著录表单的输入提示
+
+    每个进程在内存中为 ``FIELDS`` 各保存一个PrefixIndex，由各列的
+    ``GROUP BY`` 结果在后台线程中构建：``SUGGEST_PRELOAD`` 为True时在
+    进程收到第一个请求时开始，否则在第一次查询时开始，构建完成前查询
+    返回空列表。查询始终不访问数据库。本进程提交的新增和修改随即更新
+    索引；其他进程（以及批量导入）的变动在 ``SUGGEST_REFRESH`` 秒后
+    整体重建时生效。安装pypinyin后中文值也可用全拼或拼音首字母检索。
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self.indexes = None
+        self.built_at = 0
+        self._lock = threading.Lock()
+        self._rebuilding = False
+        event.listen(flask_sqlalchemy.SignallingSession, 'before_flush',
+                     self._collect)
+        event.listen(flask_sqlalchemy.SignallingSession, 'after_commit',
+                     self._apply)
+        event.listen(flask_sqlalchemy.SignallingSession, 'after_rollback',
+                     self._discard)
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        self.refresh = app.config.get('SUGGEST_REFRESH', 300)
+        self.limit = app.config.get('SUGGEST_LIMIT', 10)
+        app.extensions['suggestions'] = self
+        if app.config.get('SUGGEST_PRELOAD', False):
+            app.before_first_request(self.start_build)
+
+    def _load(self):
+        from . import db
+        from .models import File, Dossier
+        indexes = dict((field, PrefixIndex()) for field in FIELDS)
+        with self.app.app_context():
+            try:
+                for field in FILE_FIELDS:
+                    column = getattr(File, field)
+                    rows = db.session.query(column, db.func.count()) \
+                        .filter(File.verified == False) \
+                        .group_by(column)
+                    for value, count in rows:
+                        indexes[field].add(value, count)
+                # 案卷按其下的资源数排序，没有资源的案卷也要提示
+                rows = db.session.query(Dossier.name,
+                                        db.func.count(File.id)) \
+                    .outerjoin(File, db.and_(File.dossier_id == Dossier.id,
+                                             File.verified == False)) \
+                    .group_by(Dossier.name)
+                for value, count in rows:
+                    indexes['dossier'].add(value, max(count, 1))
+            finally:
+                db.session.remove()
+        return indexes
+
+    def build(self):
+        """从数据库构建索引，返回各字段的取值数"""
+        indexes = self._load()
+        with self._lock:
+            self.indexes = indexes
+            self.built_at = time.time()
+        return dict((field, len(index.counts))
+                    for field, index in indexes.items())
+
+    def _rebuild(self):
+        try:
+            self.build()
+        except Exception:
+            self.app.logger.exception('构建输入提示索引失败')
+        finally:
+            self._rebuilding = False
+
+    def start_build(self):
+        """在后台线程中（重新）构建索引，期间继续使用旧索引"""
+        with self._lock:
+            if self._rebuilding:
+                return
+            self._rebuilding = True
+        thr = threading.Thread(target=self._rebuild)
+        thr.daemon = True
+        thr.start()
+
+    def suggest(self, field, prefix, limit=None):
+        if self.indexes is None or self.refresh and \
+                time.time() - self.built_at > self.refresh:
+            self.start_build()
+        with self._lock:
+            if self.indexes is None:
+                return []
+            return self.indexes[field].search(prefix, limit or self.limit)
+
+    def watch(self, file_model, dossier_model):
+        """赋值时先加载旧值，提交后才能从索引中移除被替换的值"""
+        def replaced(target, value, oldvalue, initiator):
+            pass
+
+        for attr in FILE_FIELDS + ('verified',):
+            event.listen(getattr(file_model, attr), 'set', replaced,
+                         active_history=True)
+        event.listen(dossier_model.name, 'set', replaced,
+                     active_history=True)
+
+    def add_mappings(self, mappings):
+        """登记不经过flush的批量插入，在提交之后调用"""
+        if self.indexes is None:
+            return
+        with self._lock:
+            for mapping in mappings:
+                for field in FILE_FIELDS:
+                    self.indexes[field].add(mapping.get(field))
+
+    def _collect(self, session, flush_context, instances):
+        # 在flush之前收集：被删除的对象此时还能加载已过期的属性
+        from .models import File, Dossier
+        changes = session.info.setdefault('suggestion_changes', [])
+        for obj in session.new | session.dirty | session.deleted:
+            if isinstance(obj, File):
+                fields = [(field, field) for field in FILE_FIELDS]
+                verified = get_history(obj, 'verified', PASSIVE_OFF)
+                old_verified = verified.deleted[0] if verified.deleted \
+                    else bool(obj.verified)
+                new_verified = bool(obj.verified)
+            elif isinstance(obj, Dossier):
+                fields = [('dossier', 'name')]
+                old_verified = new_verified = False
+            else:
+                continue
+            # 修改前后该对象是否计入提示（被删除的资源不计入）
+            was = obj not in session.new and not old_verified
+            now = obj not in session.deleted and not new_verified
+            for field, attr in fields:
+                history = get_history(obj, attr, PASSIVE_OFF)
+                if was and now and not history.has_changes():
+                    continue
+                # History的各部分可能是元组也可能是列表
+                if was:
+                    changes.extend((field, value, -1) for value in
+                                   list(history.unchanged) +
+                                   list(history.deleted))
+                if now:
+                    changes.extend((field, value, 1) for value in
+                                   list(history.unchanged) +
+                                   list(history.added))
+
+    def _apply(self, session):
+        changes = session.info.pop('suggestion_changes', None)
+        if not changes or self.indexes is None:
+            return
+        with self._lock:
+            for field, value, delta in changes:
+                if delta > 0:
+                    self.indexes[field].add(value)
+                elif field == 'dossier':
+                    # 案卷的计数是资源数，改名或删除时整个移除
+                    self.indexes[field].remove(value, None)
+                else:
+                    self.indexes[field].remove(value)
+
+    def _discard(self, session):
+        session.info.pop('suggestion_changes', None)
@@ -0,0 +1,123 @@
+# -*- coding:utf-8 -*-
+import threading
+from collections import OrderedDict
+
+from sqlalchemy import event, select
+
+
+class TagService(object):
+    """批量解析标签
+
+    进程内保存按casefold归一的 {标签名: id} 词典，首次使用时一次读入
+    所有标签。不在词典中的标签先用一条IN查询查找，仍不存在的用一条
+    INSERT批量创建；其他进程同时创建同名标签时忽略唯一约束冲突，再查询
+    一次取得id。最后用一条IN查询加载Tag对象。
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self.model = None
+        self._ids = None
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        app.extensions['tag_service'] = self
+
+    def watch(self, tag_model):
+        """标签被改名或删除时从词典中移除"""
+        self.model = tag_model
+
+        def tag_changed(mapper, connection, target):
+            self.forget(target.id)
+
+        for name in ('after_update', 'after_delete'):
+            event.listen(tag_model, name, tag_changed)
+
+    @staticmethod
+    def normalize(names):
+        """去掉空白与不区分大小写的重复，返回有序的 {casefold: 标签名}"""
+        result = OrderedDict()
+        for name in names:
+            name = name.strip()
+            if name and name.casefold() not in result:
+                result[name.casefold()] = name
+        return result
+
+    def forget(self, id=None):
+        with self._lock:
+            if id is None or self._ids is None:
+                self._ids = None
+            else:
+                self._ids = dict((key, value) for key, value
+                                 in self._ids.items() if value != id)
+
+    def _select(self, connection, names=None):
+        table = self.model.__table__
+        query = select([table.c.id, table.c.name_key])
+        if names is not None:
+            # 与词典一样按casefold比较，避免创建只有大小写不同的标签；
+            # 数据库的lower()不一定能转换非ASCII字母，这里比较name_key
+            query = query.where(table.c.name_key.in_(
+                list(set(name.casefold() for name in names))))
+        return dict((key, id) for id, key in connection.execute(query))
+
+    def _insert(self, connection, names):
+        """插入标签，忽略与已有标签的冲突"""
+        table = self.model.__table__
+        dialect = connection.dialect.name
+        if dialect == 'postgresql':
+            from sqlalchemy.dialects.postgresql import insert
+            statement = insert(table).on_conflict_do_nothing()
+        elif dialect == 'mysql':
+            statement = table.insert().prefix_with('IGNORE')
+        elif dialect == 'sqlite':
+            statement = table.insert().prefix_with('OR IGNORE')
+        else:
+            statement = table.insert()
+        connection.execute(statement, [
+            dict(name=name, name_key=name.casefold()) for name in names])
+
+    def ids(self, names):
+        """返回有序的 {casefold: id}，不存在的标签随即创建"""
+        from . import db
+        wanted = self.normalize(names)
+        with self._lock:
+            if self._ids is None:
+                with db.engine.connect() as connection:
+                    self._ids = self._select(connection)
+            known = dict(self._ids)
+        missing = [name for key, name in wanted.items() if key not in known]
+        if missing:
+            # 在独立的事务中创建并立即提交，不受调用方事务回滚的影响
+            with db.engine.begin() as connection:
+                found = self._select(connection, missing)
+                new = [name for name in missing
+                       if name.casefold() not in found]
+                if new:
+                    self._insert(connection, new)
+            if new:
+                with db.engine.connect() as connection:
+                    found.update(self._select(connection, new))
+            with self._lock:
+                if self._ids is not None:
+                    self._ids.update(found)
+            known.update(found)
+        return OrderedDict((key, known[key]) for key in wanted
+                           if key in known)
+
+    def resolve(self, names, retry=True):
+        """把标签名列表解析为Tag对象列表"""
+        ids = self.ids(names)
+        if not ids:
+            return []
+        tags = dict((tag.id, tag) for tag in self.model.query.filter(
+            self.model.id.in_(list(set(ids.values())))))
+        if len(tags) < len(set(ids.values())) and retry:
+            # 词典中的标签已被其他进程删除
+            self.forget()
+            return self.resolve(names, retry=False)
+        return [tags[id] for id in OrderedDict.fromkeys(ids.values())
+                if id in tags]
@@ -0,0 +1,6 @@
+# -*- coding:utf-8 -*-
+from flask import Blueprint
+
+upload = Blueprint('upload', __name__)
+
+from . import views
@@ -0,0 +1,146 @@
+# -*- coding:utf-8 -*-
+"""大文件断点续传接口
+
+1. ``POST /upload/sessions`` 提交文件名、大小、（可选的）sha256及著录信息，
+   返回会话id；
+2. ``PUT /upload/sessions/<id>/<offset>`` 以原始字节流上传从offset开始的
+   一段数据，可重复发送；
+3. ``GET /upload/sessions/<id>`` 查询已收到的偏移量，断线后据此续传；
+4. ``POST /upload/sessions/<id>/finalize`` 校验文件并创建档案资源。
+
+所有写请求需在 ``X-CSRFToken`` 头中带上CSRF令牌。
+"""
+from flask import request, jsonify, url_for
+from flask_login import login_required, current_user
+
+from . import upload
+from .. import db, blob_storage, resumable_uploads, code_registry
+from ..codes import CODE_FIELDS
+from ..models import File, Dossier, normalize_title
+from ..resumable import UploadError
+
+REQUIRED_FIELDS = ('title_proper', 'key_who', 'key_when', 'key_where',
+                   'key_what', 'archive_num', 'creator_', 'date',
+                   'identifier')
+
+METADATA_FIELDS = REQUIRED_FIELDS + (
+    'title_parallel', 'title_sub', 'key_why', 'key_how', 'annotation',
+    'summary', 'archive_guide', 'dossier_guide', 'coverage_note',
+    'retention_period', 'publisher', 'contributor', 'rights', 'version',
+    'record_type', 'number', 'specification', 'record_num'
+)
+
+# 取值受代码表限制的字段，以名称提交，保存为 ``<字段>_id`` 代码
+CHOICE_FIELDS = CODE_FIELDS
+
+
+def clean_metadata(data):
+    """校验著录信息，返回可直接用于构造File的字典"""
+    metadata = {}
+    for field in METADATA_FIELDS:
+        value = data.get(field)
+        if field in REQUIRED_FIELDS and not value:
+            raise UploadError('%s是必填字段' % field)
+        if value:
+            metadata[field] = value
+    if File.query.filter_by(title_key=normalize_title(metadata['title_proper']),
+                            verified=False).first():
+        raise UploadError('同名资源已上传', 409)
+    for field in CHOICE_FIELDS:
+        value = data.get(field)
+        code = code_registry.code(field, value)
+        if value is not None and code is None:
+            raise UploadError('%s的取值不合法' % field)
+        metadata[field + '_id'] = code
+    dossier_id = data.get('dossier_id')
+    if dossier_id is not None:
+        if Dossier.query.get(dossier_id) is None:
+            raise UploadError('全宗或类不存在')
+        metadata['dossier_id'] = dossier_id
+    return metadata
+
+
+def session_json(manifest):
+    return dict(
+        id=manifest['id'],
+        filename=manifest['filename'],
+        size=manifest['size'],
+        offset=manifest['offset'],
+        expires=manifest['expires'],
+        chunk_url=url_for('upload.put_chunk', upload_id=manifest['id'],
+                          offset=manifest['offset'])
+    )
+
+
+def load_own_session(upload_id):
+    manifest = resumable_uploads.load(upload_id)
+    if manifest['user_id'] != current_user.id:
+        raise UploadError('上传会话不存在', 404)
+    return manifest
+
+
+@upload.before_app_request
+def start_sweeper():
+    resumable_uploads.ensure_sweeper()
+
+
+@upload.errorhandler(UploadError)
+def upload_error(e):
+    return jsonify(error=e.message), e.status
+
+
+@upload.route('/sessions', methods=['POST'])
+@login_required
+def create_session():
+    data = request.get_json(force=True, silent=True) or {}
+    filename = data.get('filename')
+    size = data.get('size')
+    if not filename or not isinstance(size, int):
+        raise UploadError('需要提供filename和size')
+    metadata = clean_metadata(data.get('metadata') or {})
+    manifest = resumable_uploads.create(current_user.id, filename, size,
+                                        metadata, sha256=data.get('sha256'))
+    return jsonify(session_json(manifest)), 201
+
+
+@upload.route('/sessions/<upload_id>', methods=['GET'])
+@login_required
+def get_session(upload_id):
+    return jsonify(session_json(load_own_session(upload_id)))
+
+
+@upload.route('/sessions/<upload_id>/<int:offset>', methods=['PUT'])
+@login_required
+def put_chunk(upload_id, offset):
+    load_own_session(upload_id)
+    manifest = resumable_uploads.write_chunk(upload_id, offset,
+                                             request.stream)
+    return jsonify(session_json(manifest))
+
+
+@upload.route('/sessions/<upload_id>/finalize', methods=['POST'])
+@login_required
+def finalize_session(upload_id):
+    load_own_session(upload_id)
+    manifest, blob = resumable_uploads.finalize(upload_id, blob_storage)
+    file = File(
+        file_path=blob.path,
+        file_name=manifest['filename'],
+        sha256=blob.digest,
+        file_size=blob.size,
+        creator=current_user._get_current_object(),
+        **manifest['metadata']
+    )
+    db.session.add(file)
+    db.session.commit()
+    return jsonify(id=file.id, sha256=blob.digest, size=blob.size,
+                   duplicate=not blob.created,
+                   url=url_for('main.file_detail', id=file.id)), 201
+
+
+@upload.route('/sessions/<upload_id>', methods=['DELETE'])
+@login_required
+def delete_session(upload_id):
+    load_own_session(upload_id)
+    resumable_uploads.discard(upload_id)
+    return '', 204
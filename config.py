@@ -1,5 +1,6 @@
 # -*- coding:utf-8 -*-
 import os
+import tempfile
 # 获取当前文件所在目录，即metadata文件夹的路径
 basedir = os.path.abspath(os.path.dirname(__file__))
 
@@ -8,16 +9,105 @@ class Config(object):
     """docstring for Config"""
     FILEPATH = os.path.join(basedir, 'testfile')
     UPLOAD_DIR = os.path.join(basedir, 'uploads')
+    # 上传文件分块读写的块大小（字节）
+    UPLOAD_CHUNK_SIZE = 64 * 1024
+    # 断点续传的暂存目录，需与UPLOAD_DIR在同一文件系统
+    RESUMABLE_UPLOAD_DIR = os.path.join(UPLOAD_DIR, '.staging')
+    # 未完成的上传会话多久无活动后被清理（秒）
+    RESUMABLE_UPLOAD_EXPIRES = 24 * 3600
+    RESUMABLE_UPLOAD_SWEEP_INTERVAL = 600
     SECRET_KEY = os.environ.get('SECRET_KEY')
     SQLALCHEMY_COMMIT_ON_TEARDOWN = True
     SQLALCHEMY_TRACK_MODIFICATIONS = False
     METADATA_MAIL_SUBJECT_PREFIX = '[档案资源知识服务系统]'
     METADATA_MAIL_SENDER = os.environ.get("METADATA_MAIL_SENDER")
+    # 邮件发送队列：每个进程的发送线程数、每个SMTP连接发送的邮件数、
+    # 最多尝试次数与轮询间隔（秒）；MAIL_THREAD为False时需单独运行
+    # python manage.py mail_worker
+    MAIL_QUEUE = os.path.join(basedir, 'mail-queue.sqlite')
+    MAIL_WORKERS = 2
+    MAIL_BATCH_SIZE = 50
+    MAIL_MAX_ATTEMPTS = 8
+    MAIL_INTERVAL = 5
+    MAIL_THREAD = True
     METADATA_ADMIN = os.environ.get('METADATA_ADMIN')
     WHOOSH_BASE = os.path.join(basedir, 'search.db')
+    # 待写入全文索引的变动队列，由后台线程批量写入
+    WHOOSH_QUEUE = os.path.join(basedir, 'search-queue.sqlite')
+    WHOOSH_INDEX_BATCH_SIZE = 500
+    WHOOSH_INDEX_INTERVAL = 2
+    # 为False时需单独运行 python manage.py index_worker
+    WHOOSH_INDEXER_THREAD = True
     BABEL_DEFAULT_LOCALE = 'zh_CN'
     CSRF_TOKEN = SECRET_KEY
     METADATA_FILES_PER_PAGE = 5
+    # 统计每个请求的SQL语句数与耗时，记录慢查询（秒）；默认关闭，
+    # 设置环境变量 METADATA_QUERY_PROFILING=1 开启
+    METADATA_QUERY_PROFILING = \
+        os.environ.get('METADATA_QUERY_PROFILING', '') in ('1', 'true')
+    METADATA_SLOW_DB_QUERY_TIME = 0.5
+    METADATA_QUERY_STATS_SIZE = 200
+    # 用户last_seen的批量写入间隔与记录精度（秒）
+    PRESENCE_FLUSH_INTERVAL = 60
+    PRESENCE_GRANULARITY = 60
+    # 已登录用户及其角色的进程内缓存：过期时间（秒，0为不缓存）与容量。
+    # 本进程中的修改立即生效，但其他进程中的角色变更、停用或删除用户
+    # 最迟要过期后才生效，过期时间即撤销权限的最大延迟，不宜设得过长
+    IDENTITY_CACHE_TTL = 30
+    IDENTITY_CACHE_SIZE = 1024
+    # 档案详情页面主体的缓存：保留时间（秒，0为不缓存）、进程内容量，
+    # 以及可选的共享缓存目录
+    FRAGMENT_CACHE_TTL = 600
+    FRAGMENT_CACHE_SIZE = 512
+    FRAGMENT_CACHE_DIR = os.environ.get('FRAGMENT_CACHE_DIR')
+    # 清单导入每块写入的行数
+    MANIFEST_CHUNK_SIZE = 500
+    # 导出时每次从数据库游标读取的行数
+    METADATA_EXPORT_BATCH_SIZE = 1000
+    # OAI-PMH接口：仓储名称、oai标识符中的仓储标识与每页记录数
+    OAI_REPOSITORY_NAME = '档案资源知识服务系统'
+    OAI_REPOSITORY_IDENTIFIER = os.environ.get('OAI_REPOSITORY_IDENTIFIER') \
+        or 'metadata'
+    OAI_PAGE_SIZE = 200
+    # 变更日志接口只返回早于此秒数的记录，等待并发事务提交
+    CHANGE_LOG_SETTLE = 5
+    # 缩略图等派生图：生成任务队列、边长（像素）、每批任务数与轮询间隔（秒）
+    DERIVATIVE_QUEUE = os.path.join(basedir, 'derivative-queue.sqlite')
+    DERIVATIVE_SIZE = 320
+    DERIVATIVE_BATCH_SIZE = 20
+    DERIVATIVE_INTERVAL = 5
+    # 为False时需单独运行 python manage.py derivative_worker
+    DERIVATIVE_THREAD = True
+    # 派生图按内容摘要命名，内容不会变化，可在浏览器中长期缓存（秒）
+    DERIVATIVE_MAX_AGE = 365 * 24 * 3600
+    # 上传文件正文的全文索引：抽取任务队列、单个文件的大小上限（字节）、
+    # 抽取时限（秒）与保留的字数；抽取较慢，默认由
+    # python manage.py content_worker 单独运行
+    CONTENT_QUEUE = os.path.join(basedir, 'content-queue.sqlite')
+    CONTENT_MAX_FILE_SIZE = 50 * 1024 * 1024
+    CONTENT_TIMEOUT = 60
+    CONTENT_MAX_CHARS = 500000
+    CONTENT_PROCS = 2
+    CONTENT_BATCH_SIZE = 20
+    CONTENT_INTERVAL = 5
+    CONTENT_EXTRACTOR_THREAD = False
+    # 著录输入提示：每次返回的条数，以及从数据库整体重建的间隔（秒），
+    # 用于同步其他进程的修改；安装pypinyin后支持拼音检索。
+    # SUGGEST_PRELOAD为True时每个进程收到第一个请求后即在后台构建
+    SUGGEST_LIMIT = 10
+    SUGGEST_PRELOAD = True
+    SUGGEST_REFRESH = 300
+    # 设置了JIEBA_PRELOAD环境变量时在create_app中加载jieba词典，只在启动
+    # 服务时设置（如 JIEBA_PRELOAD=1 gunicorn --preload manage:app），在
+    # fork之前完成，各worker共享；迁移等命令行任务不必等待加载。
+    # 编译后的词典缓存目录与自定义词典（档案术语）路径
+    JIEBA_PRELOAD = bool(os.environ.get('JIEBA_PRELOAD'))
+    JIEBA_CACHE_DIR = os.path.join(basedir, 'jieba-cache')
+    JIEBA_USER_DICT = os.environ.get('JIEBA_USER_DICT')
+    # 由前端服务器发送下载的文件：None、'x-sendfile'或'x-accel-redirect'，
+    # 后者需在nginx中把DOWNLOAD_ACCEL_PREFIX设为指向UPLOAD_DIR的internal location
+    DOWNLOAD_OFFLOAD = os.environ.get('DOWNLOAD_OFFLOAD')
+    DOWNLOAD_ACCEL_PREFIX = '/protected-uploads/'
     FILE_TYPES = ['文档', '图片', '视频', '音频', '其他']
     LANGUAGES = ['中文', '英语', '日语', '法语', '西班牙语', '德语', '俄语', '其他']
     CONFIDENTIALITIES = ['无密级', '秘密', '机密', '绝密']
@@ -41,6 +131,25 @@ class DevConfig(Config):
 
 class TestConfig(Config):
     TESTING = True
+    # 队列、索引和上传文件与开发环境分开，测试中入队的邮件等不会被
+    # 开发环境的后台线程处理
+    TEST_DATA_DIR = os.environ.get('TEST_DATA_DIR') or \
+        os.path.join(tempfile.gettempdir(), 'metadata-test')
+    UPLOAD_DIR = os.path.join(TEST_DATA_DIR, 'uploads')
+    RESUMABLE_UPLOAD_DIR = os.path.join(UPLOAD_DIR, '.staging')
+    MAIL_QUEUE = os.path.join(TEST_DATA_DIR, 'mail-queue.sqlite')
+    WHOOSH_BASE = os.path.join(TEST_DATA_DIR, 'search.db')
+    WHOOSH_QUEUE = os.path.join(TEST_DATA_DIR, 'search-queue.sqlite')
+    DERIVATIVE_QUEUE = os.path.join(TEST_DATA_DIR, 'derivative-queue.sqlite')
+    CONTENT_QUEUE = os.path.join(TEST_DATA_DIR, 'content-queue.sqlite')
+    JIEBA_CACHE_DIR = os.path.join(TEST_DATA_DIR, 'jieba-cache')
+    WHOOSH_INDEXER_THREAD = False
+    DERIVATIVE_THREAD = False
+    JIEBA_PRELOAD = False
+    SUGGEST_PRELOAD = False
+    MAIL_THREAD = False
+    IDENTITY_CACHE_TTL = 0
+    FRAGMENT_CACHE_TTL = 0
     SQLALCHEMY_DATABASE_URI = os.environ.get('TEST_DATABASE_URL') or \
         'sqlite:///' + os.path.join(basedir, 'data-test.sqlite')
 
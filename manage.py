@@ -1,8 +1,10 @@
 # -*- coding:utf-8 -*-
 import os
-from app import create_app, db
+import time
+from app import create_app, db, search_indexer, derivative_generator, \
+    content_indexer, jieba_dictionary, mail_queue, suggestions
 from app.models import User, Role, File
-from flask_script import Manager, Shell
+from flask_script import Manager, Shell, Command, Option
 from flask_migrate import Migrate, MigrateCommand
 
 app = create_app(os.getenv('METADATA_CONFIG') or 'default')
@@ -22,6 +24,157 @@ def test():
     unittest.TextTestRunner(verbosity=2).run(tests)
 
 
+@manager.command
+def index_worker():
+    """持续把队列中的变动写入全文索引"""
+    jieba_dictionary.load()
+    search_indexer.run()
+
+
+@manager.command
+def mail_worker(workers=1):
+    """持续发送邮件队列中的邮件，workers为发送线程数"""
+    mail_queue.workers = int(workers) - 1
+    mail_queue.ensure_worker()
+    mail_queue.run()
+
+
+@manager.command
+def derivative_worker(procs=0):
+    """持续生成缩略图等派生图，procs为并行的进程数"""
+    derivative_generator.run(int(procs))
+
+
+@manager.command
+def backfill_derivatives():
+    """为已有资源补充派生图生成任务"""
+    print('已加入 %d 个任务' % derivative_generator.backfill())
+
+
+@manager.command
+def content_worker(procs=0):
+    """持续抽取上传文件的正文写入全文索引，procs为并行的进程数"""
+    if int(procs):
+        content_indexer.procs = int(procs)
+    # 在创建进程池之前加载，子进程继承同一份词典
+    jieba_dictionary.load()
+    content_indexer.run()
+
+
+@manager.command
+def backfill_content():
+    """把已有的上传文件加入正文抽取队列"""
+    print('已加入 %d 个任务' % content_indexer.backfill())
+
+
+@manager.command
+def warm_dictionary():
+    """加载jieba词典并写入缓存，输出各步耗时"""
+    jieba_dictionary.load()
+    for step, seconds in sorted(jieba_dictionary.timings.items()):
+        print('%s: %.2f 秒' % (step, seconds))
+
+
+@manager.command
+def warm_suggestions():
+    """构建著录输入提示索引，输出各字段的取值数与耗时"""
+    start = time.time()
+    for field, count in sorted(suggestions.build().items()):
+        print('%s: %d' % (field, count))
+    print('耗时 %.2f 秒' % (time.time() - start))
+
+
+@manager.command
+def reindex(procs=0, limitmb=256, batch=1000):
+    """在新目录中重建资源全文索引并替换旧索引"""
+    from app.search import rebuild_index
+
+    def report(count, seconds):
+        print('已索引 %d 条，%.1f 条/秒' % (count, count / max(seconds, 1e-6)))
+
+    jieba_dictionary.load()
+    rebuild_index(app, File, procs=int(procs) or None, limitmb=int(limitmb),
+                  batch_size=int(batch), report=report)
+    print('索引重建完成')
+
+
+@manager.command
+def rebuild_facets():
+    """重新统计各分面的资源数"""
+    from app.models import FacetCount
+    FacetCount.rebuild()
+
+
+class ImportManifest(Command):
+    """从CSV/XLSX清单批量导入档案著录信息"""
+
+    # 由参数名生成的短选项中creator和chunk都是-c，这里逐个声明
+    option_list = (
+        Option('path', help='清单文件'),
+        Option('-u', '--creator', dest='creator', default=None,
+               help='著录人的用户名或邮箱'),
+        Option('-p', '--procs', dest='procs', type=int, default=0,
+               help='并行校验的进程数'),
+        Option('-n', '--chunk', dest='chunk', type=int, default=500,
+               help='每块写入的行数'),
+    )
+
+    def run(self, path, creator, procs, chunk):
+        from app.manifest import import_manifest as run_import, ManifestError
+
+        creator_id = None
+        if creator is not None:
+            user = User.query.filter((User.username == creator) |
+                                     (User.email == creator)).first()
+            if user is None:
+                print('用户 %s 不存在' % creator)
+                return
+            creator_id = user.id
+
+        def report(result):
+            print('已处理 %d 行，导入 %d 行' % (result.total, result.imported))
+
+        try:
+            with open(path, 'rb') as f:
+                result = run_import(f, path, creator_id=creator_id,
+                                    procs=procs, chunk_size=chunk,
+                                    report=report)
+        except ManifestError as e:
+            print(e)
+            return
+        if result.ignored:
+            print('忽略的列：%s' % '、'.join(result.ignored))
+        for line, error in result.errors:
+            print('第%d行：%s' % (line, error))
+        print('共 %d 行，导入 %d 行，%d 处错误' % (
+            result.total, result.imported, len(result.errors)))
+
+
+manager.add_command('import-manifest', ImportManifest())
+
+
+@manager.command
+def export(format='csv', output=None, dossier=None, carrier_type=None,
+           since=None, until=None):
+    """导出著录信息（csv、jsonl或xml），未指定output时写到标准输出"""
+    import io
+    import sys
+    from app.export import export_files, parse_date
+
+    content = export_files(format,
+                           batch_size=app.config['METADATA_EXPORT_BATCH_SIZE'],
+                           dossier=dossier, carrier_type=carrier_type,
+                           since=parse_date(since), until=parse_date(until))
+    if output is None:
+        out = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8',
+                               newline='')
+    else:
+        out = open(output, 'w', encoding='utf-8', newline='')
+    with out:
+        for chunk in content:
+            out.write(chunk)
+
+
 manager.add_command('shell', Shell(make_context=make_shell_context))
 manager.add_command('db', MigrateCommand)
 
@@ -0,0 +1,26 @@
+"""file row version
+
+Revision ID: 3c1e5b7a9d20
+Revises: 958d9dc765b6
+Create Date: 2026-10-18 14:05:31.482910
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3c1e5b7a9d20'
+down_revision = '958d9dc765b6'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('files', sa.Column('row_version', sa.Integer(),
+                                     server_default='1', nullable=False))
+
+
+def downgrade():
+    with op.batch_alter_table('files') as batch_op:
+        batch_op.drop_column('row_version')
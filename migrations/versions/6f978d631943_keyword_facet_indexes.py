@@ -0,0 +1,31 @@
+"""keyword facet indexes
+
+Revision ID: 6f978d631943
+Revises: f4b214d92f1c
+Create Date: 2026-10-18 10:31:52.906117
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '6f978d631943'
+down_revision = 'f4b214d92f1c'
+branch_labels = None
+depends_on = None
+
+KEYWORD_COLUMNS = ('key_who', 'key_why', 'key_when', 'key_where',
+                   'key_how', 'key_what')
+
+
+def upgrade():
+    for column in KEYWORD_COLUMNS:
+        op.create_index('ix_files_%s_verified_timestamp' % column, 'files',
+                        [column, 'verified', 'timestamp'], unique=False)
+
+
+def downgrade():
+    for column in KEYWORD_COLUMNS:
+        op.drop_index('ix_files_%s_verified_timestamp' % column,
+                      table_name='files')
@@ -0,0 +1,50 @@
+"""facet counts
+
+Revision ID: 78176d5d4765
+Revises: 6f978d631943
+Create Date: 2026-10-18 11:14:40.370852
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '78176d5d4765'
+down_revision = '6f978d631943'
+branch_labels = None
+depends_on = None
+
+FACETS = ('carrier_type', 'language', 'classification_level',
+          'dossier_id', 'creator_id')
+
+
+def upgrade():
+    facet_counts = op.create_table('facet_counts',
+    sa.Column('facet', sa.String(length=32), nullable=False),
+    sa.Column('value', sa.String(length=128), nullable=False),
+    sa.Column('count', sa.Integer(), nullable=False),
+    sa.PrimaryKeyConstraint('facet', 'value')
+    )
+
+    # 从现有数据统计初始值
+    files = sa.table('files', sa.column('id'),
+                     sa.column('verified', sa.Boolean),
+                     *[sa.column(facet) for facet in FACETS])
+    live = files.c.verified == sa.false()
+    op.execute(facet_counts.insert().from_select(
+        ['facet', 'value', 'count'],
+        sa.select([sa.literal('*'), sa.literal(''),
+                   sa.func.count(files.c.id)]).where(live)
+    ))
+    for facet in FACETS:
+        value = sa.func.coalesce(sa.cast(files.c[facet], sa.String(128)), '')
+        op.execute(facet_counts.insert().from_select(
+            ['facet', 'value', 'count'],
+            sa.select([sa.literal(facet), value, sa.func.count(files.c.id)])
+            .where(live).group_by(value)
+        ))
+
+
+def downgrade():
+    op.drop_table('facet_counts')
@@ -0,0 +1,31 @@
+"""keyset pagination indexes
+
+Revision ID: 958d9dc765b6
+Revises: 78176d5d4765
+Create Date: 2026-10-18 11:52:06.117384
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '958d9dc765b6'
+down_revision = '78176d5d4765'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_files_verified_timestamp_id', 'files',
+                    ['verified', 'timestamp', 'id'], unique=False)
+    op.create_index('ix_files_carrier_type_verified_timestamp_id', 'files',
+                    ['carrier_type', 'verified', 'timestamp', 'id'], unique=False)
+    op.create_index('ix_files_creator_id_verified_timestamp_id', 'files',
+                    ['creator_id', 'verified', 'timestamp', 'id'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_files_creator_id_verified_timestamp_id', table_name='files')
+    op.drop_index('ix_files_carrier_type_verified_timestamp_id', table_name='files')
+    op.drop_index('ix_files_verified_timestamp_id', table_name='files')
@@ -0,0 +1,31 @@
+"""file updated_at
+
+Revision ID: a2d4f6b8c0e1
+Revises: 3c1e5b7a9d20
+Create Date: 2026-10-18 15:22:47.903114
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a2d4f6b8c0e1'
+down_revision = '3c1e5b7a9d20'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('files', sa.Column('updated_at', sa.DateTime(),
+                                     nullable=True))
+    # 已有资源的修改时间取上传时间
+    op.execute('UPDATE files SET updated_at = timestamp')
+    op.create_index('ix_files_updated_at_id', 'files',
+                    ['updated_at', 'id'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_files_updated_at_id', table_name='files')
+    with op.batch_alter_table('files') as batch_op:
+        batch_op.drop_column('updated_at')
@@ -0,0 +1,42 @@
+"""keyword facet counts
+
+Revision ID: a3c5e7f9b1d4
+Revises: f7b9d1e3a5c8
+Create Date: 2026-10-19 09:12:26.503117
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a3c5e7f9b1d4'
+down_revision = 'f7b9d1e3a5c8'
+branch_labels = None
+depends_on = None
+
+FACETS = ('key_who', 'key_why', 'key_when', 'key_where', 'key_how',
+          'key_what')
+
+facet_counts = sa.table('facet_counts', sa.column('facet', sa.String),
+                        sa.column('value', sa.String),
+                        sa.column('count', sa.Integer))
+
+
+def upgrade():
+    # 从现有数据统计知识导航各主题词的资源数
+    files = sa.table('files', sa.column('id'),
+                     sa.column('verified', sa.Boolean),
+                     *[sa.column(facet) for facet in FACETS])
+    live = files.c.verified == sa.false()
+    for facet in FACETS:
+        value = sa.func.coalesce(files.c[facet], '')
+        op.execute(facet_counts.insert().from_select(
+            ['facet', 'value', 'count'],
+            sa.select([sa.literal(facet), value, sa.func.count(files.c.id)])
+            .where(live).group_by(value)
+        ))
+
+
+def downgrade():
+    op.execute(facet_counts.delete().where(facet_counts.c.facet.in_(FACETS)))
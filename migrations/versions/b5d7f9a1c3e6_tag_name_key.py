@@ -0,0 +1,64 @@
+"""tag name_key
+
+Revision ID: b5d7f9a1c3e6
+Revises: a3c5e7f9b1d4
+Create Date: 2026-10-19 14:06:51.372940
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b5d7f9a1c3e6'
+down_revision = 'a3c5e7f9b1d4'
+branch_labels = None
+depends_on = None
+
+tags = sa.table('tags', sa.column('id', sa.Integer),
+                sa.column('name', sa.String),
+                sa.column('name_key', sa.String))
+refs = sa.table('file_tag_ref', sa.column('file_id', sa.Integer),
+                sa.column('tag_id', sa.Integer))
+
+
+def merge_tag(conn, source, target):
+    """把source标签的资源移到target标签下，然后删除source"""
+    tagged = [row.file_id for row in conn.execute(
+        sa.select([refs.c.file_id]).where(refs.c.tag_id == target))]
+    if tagged:
+        conn.execute(refs.delete().where(refs.c.tag_id == source)
+                     .where(refs.c.file_id.in_(tagged)))
+    conn.execute(refs.update().where(refs.c.tag_id == source)
+                 .values(tag_id=target))
+    conn.execute(tags.delete().where(tags.c.id == source))
+
+
+def upgrade():
+    op.add_column('tags', sa.Column('name_key', sa.String(length=128),
+                                    nullable=True))
+
+    conn = op.get_bind()
+    keys = {}
+    for row in conn.execute(sa.select([tags.c.id, tags.c.name])
+                            .where(tags.c.name != None)
+                            .order_by(tags.c.id)).fetchall():
+        key = row.name.casefold()
+        if key in keys:
+            # 只有大小写不同的标签合并到最早创建的那个
+            merge_tag(conn, row.id, keys[key])
+        else:
+            keys[key] = row.id
+    if keys:
+        conn.execute(tags.update().where(tags.c.id == sa.bindparam('_id'))
+                     .values(name_key=sa.bindparam('_key')),
+                     [dict(_id=id, _key=key) for key, id in keys.items()])
+
+    op.create_index(op.f('ix_tags_name_key'), 'tags', ['name_key'],
+                    unique=True)
+
+
+def downgrade():
+    op.drop_index(op.f('ix_tags_name_key'), table_name='tags')
+    with op.batch_alter_table('tags') as batch_op:
+        batch_op.drop_column('name_key')
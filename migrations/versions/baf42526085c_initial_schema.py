@@ -0,0 +1,127 @@
+"""initial schema
+
+Revision ID: baf42526085c
+Revises: 
+Create Date: 2026-10-18 10:02:11.514032
+
+数据库此前由 db.create_all() 建立。已有数据库请先执行
+``python manage.py db stamp baf42526085c``，再 ``db upgrade``。
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'baf42526085c'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('roles',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('name', sa.String(length=64), nullable=True),
+    sa.Column('default', sa.Boolean(), nullable=True),
+    sa.Column('permissions', sa.Integer(), nullable=True),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('name')
+    )
+    op.create_index(op.f('ix_roles_default'), 'roles', ['default'], unique=False)
+    op.create_table('dossiers',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('name', sa.String(length=64), nullable=True),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_dossiers_name'), 'dossiers', ['name'], unique=True)
+    op.create_table('tags',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('name', sa.String(length=128), nullable=True),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('name')
+    )
+    op.create_table('users',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('username', sa.String(length=64), nullable=True),
+    sa.Column('role_id', sa.Integer(), nullable=True),
+    sa.Column('password_hash', sa.String(length=128), nullable=True),
+    sa.Column('email', sa.String(length=64), nullable=True),
+    sa.Column('confirmed', sa.Boolean(), nullable=True),
+    sa.Column('name', sa.String(length=64), nullable=True),
+    sa.Column('location', sa.String(length=64), nullable=True),
+    sa.Column('about_me', sa.Text(), nullable=True),
+    sa.Column('member_since', sa.DateTime(), nullable=True),
+    sa.Column('last_seen', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['role_id'], ['roles.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_users_email'), 'users', ['email'], unique=True)
+    op.create_index(op.f('ix_users_username'), 'users', ['username'], unique=True)
+    op.create_table('files',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('timestamp', sa.DateTime(), nullable=True),
+    sa.Column('file_path', sa.String(length=128), nullable=True),
+    sa.Column('file_name', sa.String(length=128), nullable=True),
+    sa.Column('verified', sa.Boolean(), nullable=True),
+    sa.Column('creator_id', sa.Integer(), nullable=True),
+    sa.Column('title_proper', sa.String(length=128), nullable=False),
+    sa.Column('title_parallel', sa.String(length=128), nullable=True),
+    sa.Column('title_sub', sa.String(length=128), nullable=True),
+    sa.Column('key_who', sa.String(length=128), nullable=True),
+    sa.Column('key_why', sa.String(length=128), nullable=True),
+    sa.Column('key_when', sa.String(length=128), nullable=True),
+    sa.Column('key_where', sa.String(length=128), nullable=True),
+    sa.Column('key_how', sa.String(length=128), nullable=True),
+    sa.Column('key_what', sa.String(length=128), nullable=True),
+    sa.Column('archive_num', sa.String(length=128), nullable=True),
+    sa.Column('annotation', sa.String(length=1024), nullable=True),
+    sa.Column('summary', sa.String(length=1024), nullable=True),
+    sa.Column('dossier_id', sa.Integer(), nullable=True),
+    sa.Column('language', sa.String(length=128), nullable=True),
+    sa.Column('relation_path', sa.String(length=128), nullable=True),
+    sa.Column('relation_name', sa.String(length=128), nullable=True),
+    sa.Column('archive_guide', sa.String(length=128), nullable=True),
+    sa.Column('dossier_guide', sa.String(length=128), nullable=True),
+    sa.Column('coverage_note', sa.String(length=1024), nullable=True),
+    sa.Column('classification_level', sa.String(length=128), nullable=True),
+    sa.Column('retention_period', sa.String(length=128), nullable=True),
+    sa.Column('creator_', sa.String(length=128), nullable=True),
+    sa.Column('publisher', sa.String(length=128), nullable=True),
+    sa.Column('contributor', sa.String(length=128), nullable=True),
+    sa.Column('rights', sa.String(length=128), nullable=True),
+    sa.Column('date', sa.String(length=128), nullable=True),
+    sa.Column('version', sa.String(length=128), nullable=True),
+    sa.Column('record_type', sa.String(length=128), nullable=True),
+    sa.Column('carrier_type', sa.String(length=128), nullable=True),
+    sa.Column('number', sa.String(length=128), nullable=True),
+    sa.Column('specification', sa.String(length=128), nullable=True),
+    sa.Column('record_num', sa.String(length=128), nullable=True),
+    sa.Column('identifier', sa.String(length=128), nullable=True),
+    sa.ForeignKeyConstraint(['creator_id'], ['users.id'], ),
+    sa.ForeignKeyConstraint(['dossier_id'], ['dossiers.id'], ),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('file_path', name='file_path'),
+    sa.UniqueConstraint('relation_path', name='relation_path')
+    )
+    op.create_index(op.f('ix_files_timestamp'), 'files', ['timestamp'], unique=False)
+    op.create_table('file_tag_ref',
+    sa.Column('file_id', sa.Integer(), nullable=True),
+    sa.Column('tag_id', sa.Integer(), nullable=True),
+    sa.ForeignKeyConstraint(['file_id'], ['files.id'], ),
+    sa.ForeignKeyConstraint(['tag_id'], ['tags.id'], )
+    )
+
+
+def downgrade():
+    op.drop_table('file_tag_ref')
+    op.drop_index(op.f('ix_files_timestamp'), table_name='files')
+    op.drop_table('files')
+    op.drop_index(op.f('ix_users_username'), table_name='users')
+    op.drop_index(op.f('ix_users_email'), table_name='users')
+    op.drop_table('users')
+    op.drop_table('tags')
+    op.drop_index(op.f('ix_dossiers_name'), table_name='dossiers')
+    op.drop_table('dossiers')
+    op.drop_index(op.f('ix_roles_default'), table_name='roles')
+    op.drop_table('roles')
@@ -0,0 +1,44 @@
+"""file change log
+
+Revision ID: c7e9a1b3d5f2
+Revises: a2d4f6b8c0e1
+Create Date: 2026-10-18 16:10:08.514376
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c7e9a1b3d5f2'
+down_revision = 'a2d4f6b8c0e1'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('files', sa.Column('deleted_at', sa.DateTime(),
+                                     nullable=True))
+    op.create_table(
+        'file_changes',
+        sa.Column('seq', sa.Integer(), nullable=False),
+        sa.Column('file_id', sa.Integer(), nullable=False),
+        sa.Column('action', sa.String(length=16), nullable=False),
+        sa.Column('changed_at', sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint('seq')
+    )
+    op.create_index(op.f('ix_file_changes_file_id'), 'file_changes',
+                    ['file_id'], unique=False)
+    # 已有资源各记一条，消费者从seq 0开始即可得到全量
+    op.execute(
+        "INSERT INTO file_changes (file_id, action, changed_at) "
+        "SELECT id, CASE WHEN verified = 1 THEN 'delete' ELSE 'create' END, "
+        "COALESCE(updated_at, timestamp) FROM files ORDER BY id"
+    )
+
+
+def downgrade():
+    op.drop_index(op.f('ix_file_changes_file_id'), table_name='file_changes')
+    op.drop_table('file_changes')
+    with op.batch_alter_table('files') as batch_op:
+        batch_op.drop_column('deleted_at')
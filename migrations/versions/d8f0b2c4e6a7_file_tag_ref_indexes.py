@@ -0,0 +1,28 @@
+"""file_tag_ref indexes
+
+Revision ID: d8f0b2c4e6a7
+Revises: c7e9a1b3d5f2
+Create Date: 2026-10-18 17:42:19.260813
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd8f0b2c4e6a7'
+down_revision = 'c7e9a1b3d5f2'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_file_tag_ref_file_id_tag_id', 'file_tag_ref',
+                    ['file_id', 'tag_id'], unique=True)
+    op.create_index(op.f('ix_file_tag_ref_tag_id'), 'file_tag_ref',
+                    ['tag_id'], unique=False)
+
+
+def downgrade():
+    op.drop_index(op.f('ix_file_tag_ref_tag_id'), table_name='file_tag_ref')
+    op.drop_index('ix_file_tag_ref_file_id_tag_id', table_name='file_tag_ref')
@@ -0,0 +1,59 @@
+"""file title_key
+
+Revision ID: e1a3c5e7b9d2
+Revises: d8f0b2c4e6a7
+Create Date: 2026-10-18 18:25:03.417592
+
+"""
+import unicodedata
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e1a3c5e7b9d2'
+down_revision = 'd8f0b2c4e6a7'
+branch_labels = None
+depends_on = None
+
+BATCH_SIZE = 1000
+
+
+def normalize_title(title):
+    # 与迁移时的 app.models.normalize_title 一致
+    title = unicodedata.normalize('NFKC', title or '').casefold()
+    return ''.join(c for c in title
+                   if unicodedata.category(c)[0] not in 'PZC')[:128]
+
+
+def upgrade():
+    op.add_column('files', sa.Column('title_key', sa.String(length=128),
+                                     nullable=True))
+
+    # 按主键分批回填，避免一次更新整张表
+    files = sa.table('files', sa.column('id', sa.Integer),
+                     sa.column('title_proper', sa.String),
+                     sa.column('title_key', sa.String))
+    conn = op.get_bind()
+    last_id = 0
+    while True:
+        rows = conn.execute(
+            sa.select([files.c.id, files.c.title_proper])
+            .where(files.c.id > last_id)
+            .order_by(files.c.id).limit(BATCH_SIZE)).fetchall()
+        if not rows:
+            break
+        conn.execute(
+            files.update().where(files.c.id == sa.bindparam('_id'))
+            .values(title_key=sa.bindparam('_key')),
+            [dict(_id=id, _key=normalize_title(title)) for id, title in rows])
+        last_id = rows[-1][0]
+
+    op.create_index('ix_files_title_key_verified', 'files',
+                    ['title_key', 'verified'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_files_title_key_verified', table_name='files')
+    op.drop_column('files', 'title_key')
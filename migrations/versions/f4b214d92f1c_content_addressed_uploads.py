@@ -0,0 +1,61 @@
+"""content addressed uploads
+
+Revision ID: f4b214d92f1c
+Revises: baf42526085c
+Create Date: 2026-10-18 10:05:37.228410
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f4b214d92f1c'
+down_revision = 'baf42526085c'
+branch_labels = None
+depends_on = None
+
+# 由迁移建立的表中唯一约束以列名命名（MySQL也是如此），而create_all在
+# SQLite中建立的唯一约束没有名字，批量模式按这个约定为其命名后才能删除
+NAMING_CONVENTION = {'uq': 'uq_%(table_name)s_%(column_0_name)s'}
+
+
+def unique_constraints(table, columns):
+    """table中只含columns之一的唯一约束的名字"""
+    names = []
+    for constraint in sa.inspect(op.get_bind()).get_unique_constraints(table):
+        if len(constraint['column_names']) == 1 and \
+                constraint['column_names'][0] in columns:
+            names.append(constraint['name'] or NAMING_CONVENTION['uq'] % dict(
+                table_name=table, column_0_name=constraint['column_names'][0]))
+    return names
+
+
+def upgrade():
+    names = unique_constraints('files', ('file_path', 'relation_path'))
+    with op.batch_alter_table('files',
+                              naming_convention=NAMING_CONVENTION) as batch_op:
+        batch_op.add_column(sa.Column('sha256', sa.String(length=64), nullable=True))
+        batch_op.add_column(sa.Column('file_size', sa.BigInteger(), nullable=True))
+        for name in names:
+            batch_op.drop_constraint(name, type_='unique')
+        batch_op.alter_column('file_path', type_=sa.String(length=256),
+                              existing_type=sa.String(length=128))
+        batch_op.alter_column('relation_path', type_=sa.String(length=256),
+                              existing_type=sa.String(length=128))
+        batch_op.create_index(batch_op.f('ix_files_file_path'), ['file_path'], unique=False)
+        batch_op.create_index(batch_op.f('ix_files_sha256'), ['sha256'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('files') as batch_op:
+        batch_op.drop_index(batch_op.f('ix_files_sha256'))
+        batch_op.drop_index(batch_op.f('ix_files_file_path'))
+        batch_op.alter_column('relation_path', type_=sa.String(length=128),
+                              existing_type=sa.String(length=256))
+        batch_op.alter_column('file_path', type_=sa.String(length=128),
+                              existing_type=sa.String(length=256))
+        batch_op.create_unique_constraint('relation_path', ['relation_path'])
+        batch_op.create_unique_constraint('file_path', ['file_path'])
+        batch_op.drop_column('file_size')
+        batch_op.drop_column('sha256')
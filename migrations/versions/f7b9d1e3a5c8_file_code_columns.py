@@ -0,0 +1,160 @@
+"""file code columns
+
+Revision ID: f7b9d1e3a5c8
+Revises: e1a3c5e7b9d2
+Create Date: 2026-10-18 19:52:41.208736
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f7b9d1e3a5c8'
+down_revision = 'e1a3c5e7b9d2'
+branch_labels = None
+depends_on = None
+
+BATCH_SIZE = 1000
+
+# (字段, 代码表, 迁移时配置中的取值)，代码为取值在配置中的序号
+FIELDS = (
+    ('language', 'languages',
+     ['中文', '英语', '日语', '法语', '西班牙语', '德语', '俄语', '其他']),
+    ('carrier_type', 'carrier_types',
+     ['文档', '图片', '视频', '音频', '其他']),
+    ('classification_level', 'classification_levels',
+     ['无密级', '秘密', '机密', '绝密']),
+)
+
+files = sa.table('files', sa.column('id', sa.Integer),
+                 *[c for field, _, _ in FIELDS
+                   for c in (sa.column(field, sa.String),
+                             sa.column(field + '_id', sa.SmallInteger))])
+facet_counts = sa.table('facet_counts', sa.column('facet', sa.String),
+                        sa.column('value', sa.String),
+                        sa.column('count', sa.Integer))
+
+
+def code_table(name):
+    return sa.table(name, sa.column('id', sa.SmallInteger),
+                    sa.column('name', sa.String))
+
+
+def backfill(conn, source, target, mapping):
+    """按主键分批把source列的取值经mapping转换后写入target列"""
+    last_id = 0
+    while True:
+        rows = conn.execute(
+            sa.select([files.c.id, files.c[source]])
+            .where(files.c.id > last_id)
+            .order_by(files.c.id).limit(BATCH_SIZE)).fetchall()
+        if not rows:
+            break
+        conn.execute(
+            files.update().where(files.c.id == sa.bindparam('_id'))
+            .values(**{target: sa.bindparam('_value')}),
+            [dict(_id=id, _value=mapping.get(value)) for id, value in rows])
+        last_id = rows[-1][0]
+
+
+def convert_facets(conn, old, new, mapping):
+    """把分面计数的取值从old分面转换到new分面，转换后相同的取值合并"""
+    rows = conn.execute(sa.select([facet_counts.c.value, facet_counts.c.count])
+                        .where(facet_counts.c.facet == old)).fetchall()
+    merged = {}
+    for value, count in rows:
+        converted = mapping.get(value)
+        converted = '' if converted is None else str(converted)
+        merged[converted] = merged.get(converted, 0) + count
+    conn.execute(facet_counts.delete().where(facet_counts.c.facet == old))
+    if merged:
+        op.bulk_insert(facet_counts, [dict(facet=new, value=value, count=count)
+                                      for value, count in merged.items()])
+
+
+def upgrade():
+    conn = op.get_bind()
+    codes = {}
+    for field, name, labels in FIELDS:
+        op.create_table(name,
+        sa.Column('id', sa.SmallInteger(), autoincrement=False,
+                  nullable=False),
+        sa.Column('name', sa.String(length=64), nullable=False),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('name')
+        )
+        existing = [value for value, in conn.execute(
+            sa.select([files.c[field]]).where(files.c[field] != None)
+            .where(files.c[field] != '').distinct()
+            .order_by(files.c[field]))]
+        # 旧的edit_file把下拉框的序号（从1开始）当作取值保存，按序号还原
+        numbered = dict((value, labels[int(value) - 1]) for value in existing
+                        if value.isdigit() and 1 <= int(value) <= len(labels))
+        # 其余不在配置里的取值追加在后面
+        labels = labels + [value for value in existing
+                           if value not in labels and value not in numbered]
+        codes[field] = dict((label, code)
+                            for code, label in enumerate(labels, 1))
+        op.bulk_insert(code_table(name),
+                       [dict(id=code, name=label)
+                        for label, code in codes[field].items()])
+        for value, label in numbered.items():
+            codes[field][value] = codes[field][label]
+
+    with op.batch_alter_table('files') as batch_op:
+        for field, name, _ in FIELDS:
+            batch_op.add_column(sa.Column(field + '_id', sa.SmallInteger(),
+                                          nullable=True))
+            batch_op.create_foreign_key('fk_files_%s_id_%s' % (field, name),
+                                        name, [field + '_id'], ['id'])
+
+    for field, _, _ in FIELDS:
+        backfill(conn, field, field + '_id', codes[field])
+        convert_facets(conn, field, field + '_id', codes[field])
+
+    op.drop_index('ix_files_carrier_type_verified_timestamp_id',
+                  table_name='files')
+    with op.batch_alter_table('files') as batch_op:
+        for field, _, _ in FIELDS:
+            batch_op.drop_column(field)
+    op.create_index('ix_files_carrier_type_id_verified_timestamp_id', 'files',
+                    ['carrier_type_id', 'verified', 'timestamp', 'id'],
+                    unique=False)
+    op.create_index('ix_files_language_id_verified', 'files',
+                    ['language_id', 'verified'], unique=False)
+    op.create_index('ix_files_classification_level_id_verified', 'files',
+                    ['classification_level_id', 'verified'], unique=False)
+
+
+def downgrade():
+    conn = op.get_bind()
+    op.drop_index('ix_files_classification_level_id_verified',
+                  table_name='files')
+    op.drop_index('ix_files_language_id_verified', table_name='files')
+    op.drop_index('ix_files_carrier_type_id_verified_timestamp_id',
+                  table_name='files')
+    with op.batch_alter_table('files') as batch_op:
+        for field, _, _ in FIELDS:
+            batch_op.add_column(sa.Column(field, sa.String(length=128),
+                                          nullable=True))
+
+    for field, name, _ in FIELDS:
+        table = code_table(name)
+        labels = dict((row.id, row.name) for row in
+                      conn.execute(sa.select([table.c.id, table.c.name])))
+        backfill(conn, field + '_id', field, labels)
+        convert_facets(conn, field + '_id', field,
+                       dict((str(code), label)
+                            for code, label in labels.items()))
+
+    with op.batch_alter_table('files') as batch_op:
+        for field, name, _ in FIELDS:
+            batch_op.drop_constraint('fk_files_%s_id_%s' % (field, name),
+                                     type_='foreignkey')
+            batch_op.drop_column(field + '_id')
+    op.create_index('ix_files_carrier_type_verified_timestamp_id', 'files',
+                    ['carrier_type', 'verified', 'timestamp', 'id'],
+                    unique=False)
+    for _, name, _ in FIELDS:
+        op.drop_table(name)
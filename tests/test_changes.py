@@ -0,0 +1,75 @@
+# -*- coding:utf-8 -*-
+import json
+import unittest
+from app import create_app, db
+from app.models import User, Role, File, FileChange, Permission
+
+
+class ChangeFeedTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app('test')
+        self.app.config.update(SECRET_KEY='test', WTF_CSRF_ENABLED=False,
+                               CHANGE_LOG_SETTLE=0)
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        self.client = self.app.test_client(use_cookies=True)
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def login(self):
+        role = Role(name='Test', permissions=Permission.DOWNLOAD_FILE)
+        db.session.add(User(email='a@example.com', username='a',
+                            password='cat', confirmed=True, role=role))
+        db.session.commit()
+        self.client.post('/auth/login/', data=dict(
+            email='a@example.com', password='cat'))
+
+    def get(self, since, limit):
+        response = self.client.get('/changes?since=%d&limit=%d'
+                                   % (since, limit))
+        self.assertEqual(response.status_code, 200)
+        return json.loads(response.get_data(as_text=True))
+
+    def test_flush_records_changes(self):
+        file = File(title_proper='会议纪要')
+        db.session.add(file)
+        db.session.commit()
+        file.key_who = '张三'
+        db.session.commit()
+        file.verified = True
+        db.session.commit()
+        self.assertIsNotNone(file.deleted_at)
+        changes = FileChange.query.order_by(FileChange.seq).all()
+        self.assertEqual([(c.file_id, c.action) for c in changes],
+                         [(file.id, FileChange.CREATE),
+                          (file.id, FileChange.UPDATE),
+                          (file.id, FileChange.DELETE)])
+
+    def test_paging(self):
+        self.login()
+        db.session.add_all([File(title_proper='题名%d' % i)
+                            for i in range(4)])
+        db.session.commit()
+        page = self.get(0, 2)
+        self.assertEqual(len(page['changes']), 2)
+        self.assertTrue(page['more'])
+        # 恰好取完最后一页时more为False
+        page = self.get(page['next'], 2)
+        self.assertEqual(len(page['changes']), 2)
+        self.assertFalse(page['more'])
+        self.assertEqual(self.get(page['next'], 2),
+                         dict(changes=[], next=page['next'], more=False))
+
+    def test_limit_at_least_one(self):
+        self.login()
+        db.session.add_all([File(title_proper='题名%d' % i)
+                            for i in range(2)])
+        db.session.commit()
+        for limit in (0, -5):
+            page = self.get(0, limit)
+            self.assertEqual(len(page['changes']), 1)
+            self.assertTrue(page['more'])
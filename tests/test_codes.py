@@ -0,0 +1,86 @@
+import unittest
+from app import create_app, db, code_registry
+from app.models import File, Language, User, Role, Permission
+
+
+class CodeRegistryTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app('test')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        code_registry.invalidate()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        code_registry.invalidate()
+        self.app_context.pop()
+
+    def test_seeded_from_config(self):
+        languages = self.app.config['LANGUAGES']
+        self.assertEqual(code_registry.choices('language'),
+                         list(enumerate(languages, 1)))
+        self.assertEqual(Language.query.count(), len(languages))
+
+    def test_new_label_gets_next_code(self):
+        db.session.add(Language(id=1, name='满文'))
+        db.session.commit()
+        codes = code_registry.codes('language')
+        self.assertEqual(codes['满文'], 1)
+        self.assertIn('中文', codes)
+        self.assertEqual(len(set(codes.values())), len(codes))
+
+    def test_label_property(self):
+        file = File(title_proper='题名', carrier_type='图片')
+        self.assertEqual(file.carrier_type_id, 2)
+        self.assertEqual(file.carrier_type, '图片')
+        file.carrier_type = None
+        self.assertIsNone(file.carrier_type_id)
+        with self.assertRaises(ValueError):
+            file.language = '火星文'
+
+
+class FileViewTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app('test')
+        self.app.config.update(SECRET_KEY='test', WTF_CSRF_ENABLED=False)
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        code_registry.invalidate()
+        role = Role(name='Administrator', permissions=0xff)
+        db.session.add(User(email='a@example.com', username='a',
+                            password='cat', confirmed=True, role=role))
+        self.file = File(title_proper='题名')
+        db.session.add(self.file)
+        db.session.commit()
+        self.client = self.app.test_client(use_cookies=True)
+        self.client.post('/auth/login/', data=dict(
+            email='a@example.com', password='cat'))
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        code_registry.invalidate()
+        self.app_context.pop()
+
+    def edit(self, **codes):
+        data = dict(title_proper='题名', language_id='',
+                    classification_level_id='', carrier_type_id='')
+        data.update(codes)
+        response = self.client.post('/admin/file/edit/?id=%d' % self.file.id,
+                                    data=data)
+        self.assertEqual(response.status_code, 302)
+        db.session.expire_all()
+
+    def test_blank_code(self):
+        response = self.client.get('/admin/file/edit/?id=%d' % self.file.id)
+        self.assertEqual(response.status_code, 200)
+        self.edit()
+        self.assertIsNone(self.file.language_id)
+        self.edit(language_id='1')
+        self.assertEqual(self.file.language_id, 1)
+        self.edit()
+        self.assertIsNone(self.file.language_id)
+        self.assertEqual(self.file.title_proper, '题名')
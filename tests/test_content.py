@@ -0,0 +1,50 @@
+import os
+import shutil
+import tempfile
+import unittest
+import zipfile
+from app.content import extract_text
+
+
+class ExtractTextTestCase(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def write(self, name, data):
+        path = os.path.join(self.dir, name)
+        with open(path, 'wb') as f:
+            f.write(data)
+        return path
+
+    def test_gb18030_text(self):
+        path = self.write('a.txt', '档案正文'.encode('gb18030'))
+        self.assertEqual(extract_text(path, 'a.txt', 100, 10), '档案正文')
+
+    def test_max_chars(self):
+        path = self.write('a.txt', '档案正文'.encode('utf-8'))
+        self.assertEqual(extract_text(path, 'a.txt', 2, 10), '档案')
+
+    def test_utf8_cut_mid_character(self):
+        # 只读取max_chars * 4字节，截断处落在一个汉字中间
+        text = '档案正文' * 1000
+        path = self.write('a.txt', text.encode('utf-8'))
+        self.assertEqual(extract_text(path, 'a.txt', 1000, 10), text[:1000])
+
+    def test_docx(self):
+        path = os.path.join(self.dir, 'a.docx')
+        with zipfile.ZipFile(path, 'w') as docx:
+            docx.writestr('word/document.xml', (
+                '<w:document xmlns:w="http://schemas.openxmlformats.org/'
+                'wordprocessingml/2006/main"><w:body>'
+                '<w:p><w:r><w:t>第一</w:t></w:r><w:r><w:t>段</w:t></w:r></w:p>'
+                '<w:p><w:r><w:t>第二段</w:t></w:r></w:p>'
+                '</w:body></w:document>').encode('utf-8'))
+        self.assertEqual(extract_text(path, 'a.docx', 100, 10),
+                         '第一段\n第二段')
+
+    def test_unsupported(self):
+        path = self.write('a.bin', b'\x00\x01\x02')
+        self.assertIsNone(extract_text(path, 'a.bin', 100, 10))
@@ -0,0 +1,68 @@
+# -*- coding:utf-8 -*-
+import os
+import unittest
+from app import create_app, db, derivative_generator
+from app.models import User, Role, File, Permission
+
+DIGEST = 'ab' * 32
+
+
+class ThumbnailTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app('test')
+        self.app.config.update(SECRET_KEY='test', WTF_CSRF_ENABLED=False)
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        Role.insert_roles()
+        self.client = self.app.test_client(use_cookies=True)
+        self.path = derivative_generator.path_for(DIGEST)
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with open(self.path, 'wb') as f:
+            f.write(b'\xff\xd8jpeg')
+        self.file = File(title_proper='照片', sha256=DIGEST)
+        db.session.add(self.file)
+        db.session.commit()
+
+    def tearDown(self):
+        os.remove(self.path)
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def login(self, permissions):
+        role = Role(name='Test', permissions=permissions)
+        user = User(email='a@example.com', username='a', password='cat',
+                    confirmed=True, role=role)
+        db.session.add(user)
+        db.session.commit()
+        self.client.post('/auth/login/', data=dict(
+            email='a@example.com', password='cat'))
+
+    def get(self):
+        return self.client.get('/thumbnail/%s.jpg' % DIGEST)
+
+    def test_requires_login(self):
+        response = self.get()
+        self.assertEqual(response.status_code, 302)
+        self.assertIn('/auth/login', response.headers['Location'])
+
+    def test_requires_download_permission(self):
+        self.login(Permission.UPLOAD_FILE)
+        self.assertEqual(self.get().status_code, 403)
+        with self.app.test_request_context():
+            self.assertIsNone(derivative_generator.thumbnail_url(self.file))
+
+    def test_served_privately(self):
+        self.login(Permission.DOWNLOAD_FILE)
+        response = self.get()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data, b'\xff\xd8jpeg')
+        self.assertTrue(response.cache_control.private)
+        self.assertFalse(response.cache_control.public)
+
+    def test_deleted_file(self):
+        self.login(Permission.DOWNLOAD_FILE)
+        self.file.verified = True
+        db.session.commit()
+        self.assertEqual(self.get().status_code, 404)
@@ -0,0 +1,13 @@
+import unittest
+from app.download import content_disposition
+
+
+class ContentDispositionTestCase(unittest.TestCase):
+    def test_chinese_filename(self):
+        header = content_disposition('档案 1.pdf')
+        self.assertTrue(header.startswith('attachment; filename="1.pdf"'))
+        self.assertIn("filename*=UTF-8''%E6%A1%A3%E6%A1%88%201.pdf", header)
+
+    def test_inline(self):
+        self.assertTrue(content_disposition('a.mp4', inline=True)
+                        .startswith('inline; filename="a.mp4"'))
@@ -0,0 +1,108 @@
+import os
+import shutil
+import socketserver
+import tempfile
+import threading
+import unittest
+from flask import Flask
+from flask_mail import Message
+from app import mail
+from app.email import MailQueue
+
+
+class SMTPSink(socketserver.ThreadingTCPServer):
+    """只接收邮件的本地SMTP服务器，记录连接数和收到的邮件"""
+    allow_reuse_address = True
+    daemon_threads = True
+
+    def __init__(self):
+        socketserver.ThreadingTCPServer.__init__(self, ('127.0.0.1', 0),
+                                                 SMTPHandler)
+        self.connections = 0
+        self.messages = []
+        # 主题中含有reject的邮件在DATA结束后得到的应答
+        self.reject_reply = '554 rejected'
+
+
+class SMTPHandler(socketserver.StreamRequestHandler):
+    def reply(self, line):
+        self.wfile.write(line.encode('ascii') + b'\r\n')
+
+    def handle(self):
+        self.server.connections += 1
+        self.reply('220 localhost')
+        while True:
+            line = self.rfile.readline().decode('ascii').strip()
+            command = line[:4].upper()
+            if not line or command == 'QUIT':
+                self.reply('221 bye')
+                return
+            if command == 'DATA':
+                self.reply('354 go ahead')
+                data = []
+                for raw in self.rfile:
+                    if raw.rstrip(b'\r\n') == b'.':
+                        break
+                    data.append(raw)
+                if b'Subject: reject' in b''.join(data):
+                    self.reply(self.server.reject_reply)
+                    continue
+                self.server.messages.append(b''.join(data))
+            self.reply('250 ok')
+
+
+class MailQueueTestCase(unittest.TestCase):
+    def setUp(self):
+        self.sink = SMTPSink()
+        threading.Thread(target=self.sink.serve_forever, daemon=True).start()
+        self.dir = tempfile.mkdtemp()
+        self.app = Flask(__name__)
+        self.app.config.update(
+            MAIL_SERVER='127.0.0.1', MAIL_PORT=self.sink.server_address[1],
+            MAIL_SUPPRESS_SEND=False, MAIL_THREAD=False,
+            MAIL_QUEUE=os.path.join(self.dir, 'mail.sqlite'))
+        mail.init_app(self.app)
+        self.queue = MailQueue(self.app)
+
+    def tearDown(self):
+        self.sink.shutdown()
+        self.sink.server_close()
+        shutil.rmtree(self.dir)
+
+    def test_batch_shares_connection(self):
+        for i in range(3):
+            self.queue.put(Message('subject %d' % i, sender='a@example.com',
+                                   recipients=['b@example.com'], body='body'))
+        self.assertEqual(self.queue.depth(), 3)
+        self.assertEqual(self.queue.drain(), 3)
+        self.assertEqual(self.queue.depth(), 0)
+        self.assertEqual(len(self.sink.messages), 3)
+        self.assertEqual(self.sink.connections, 1)
+
+    def put(self, subject):
+        self.queue.put(Message(subject, sender='a@example.com',
+                               recipients=['b@example.com'], body='body'))
+
+    def test_rejected_message_does_not_abort_batch(self):
+        for subject in ('first', 'reject', 'last'):
+            self.put(subject)
+        self.assertEqual(self.queue.drain(), 3)
+        self.assertEqual(self.queue.depth(), 0)
+        self.assertEqual(len(self.sink.messages), 2)
+        self.assertEqual(self.sink.connections, 1)
+
+    def test_temporary_rejection_is_retried(self):
+        self.sink.reject_reply = '451 try later'
+        for subject in ('first', 'reject', 'last'):
+            self.put(subject)
+        self.assertEqual(self.queue.drain(), 2)
+        self.assertEqual(self.queue.depth(), 1)
+        self.assertEqual(len(self.sink.messages), 2)
+
+    def test_failed_delivery_is_retried(self):
+        self.app.config['MAIL_PORT'] = 1
+        mail.init_app(self.app)
+        self.queue.put(Message('subject', sender='a@example.com',
+                               recipients=['b@example.com'], body='body'))
+        self.assertEqual(self.queue.drain(), 0)
+        self.assertEqual(self.queue.depth(), 1)
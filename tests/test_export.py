@@ -0,0 +1,29 @@
+import json
+import unittest
+from xml.etree import ElementTree
+from app import export
+
+
+class ExportTestCase(unittest.TestCase):
+    def setUp(self):
+        self.record = dict((field, '') for field in export.EXPORT_FIELDS)
+        self.record.update(id='1', title_proper='题名<一>', key_who='张三',
+                           retention_period='永久')
+
+    def test_xml_is_well_formed(self):
+        xml = ''.join(export._xml(iter([self.record])))
+        root = ElementTree.fromstring(xml.encode('utf-8'))
+        record = root.find('record')
+        dc = '{http://purl.org/dc/elements/1.1/}'
+        self.assertEqual(record.find(dc + 'title').text, '题名<一>')
+        self.assertEqual(record.find(dc + 'subject').text, '张三')
+        field = record.find('{urn:metadata:archive}field')
+        self.assertEqual(field.get('name'), 'retention_period')
+
+    def test_csv_header_without_rows(self):
+        csv = ''.join(export._csv(iter([])))
+        self.assertTrue(csv.startswith('\ufeff索引编号,'))
+
+    def test_jsonl(self):
+        lines = ''.join(export._jsonl(iter([self.record]))).splitlines()
+        self.assertEqual(json.loads(lines[0])['title_proper'], '题名<一>')
@@ -0,0 +1,124 @@
+# -*- coding:utf-8 -*-
+import unittest
+from app import create_app, db
+from app.facets import keyword_facets, facet_count, code_facet_counts
+from app.models import File, Dossier, FacetCount
+
+KEYS = dict(key_who='张三', key_why='汇报', key_when='2017',
+            key_where='北京', key_how='书面', key_what='会议')
+
+
+class FacetCountTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app('test')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def counts(self):
+        return dict(((row.facet, row.value), row.count)
+                    for row in FacetCount.query if row.count)
+
+    def assertCountsMatchRebuild(self):
+        maintained = self.counts()
+        FacetCount.rebuild()
+        self.assertEqual(maintained, self.counts())
+
+    def test_counters_follow_flush(self):
+        dossier = Dossier(name='一号全宗')
+        file = File(title_proper='会议纪要', carrier_type='图片',
+                    dossier=dossier, **KEYS)
+        db.session.add_all([file, File(title_proper='会议记录', **KEYS)])
+        db.session.commit()
+        self.assertEqual(facet_count('*'), 2)
+        self.assertEqual(facet_count('key_who', '张三'), 2)
+        self.assertEqual(facet_count('dossier_id', dossier.id), 1)
+        self.assertEqual(code_facet_counts('carrier_type'), {'图片': 1})
+        self.assertCountsMatchRebuild()
+
+        file.key_who = '李四'
+        file.carrier_type = '视频'
+        db.session.commit()
+        self.assertEqual(facet_count('key_who', '张三'), 1)
+        self.assertEqual(code_facet_counts('carrier_type'),
+                         {'图片': 0, '视频': 1})
+        self.assertCountsMatchRebuild()
+
+        # 软删除和恢复
+        file.verified = True
+        db.session.commit()
+        self.assertEqual(facet_count('*'), 1)
+        self.assertEqual(facet_count('key_who', '李四'), 0)
+        self.assertCountsMatchRebuild()
+        file.verified = False
+        db.session.commit()
+        self.assertEqual(facet_count('*'), 2)
+        self.assertCountsMatchRebuild()
+
+        db.session.delete(file)
+        db.session.commit()
+        self.assertEqual(facet_count('*'), 1)
+        self.assertCountsMatchRebuild()
+
+    def test_existing_counter_row(self):
+        # 另一个事务已插入同一取值的计数行
+        db.session.add(FacetCount(facet='key_who', value='张三', count=0))
+        db.session.commit()
+        db.session.add(File(title_proper='会议纪要', **KEYS))
+        db.session.commit()
+        self.assertEqual(facet_count('key_who', '张三'), 1)
+
+
+class KeywordFacetTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app('test')
+        self.app.config['SECRET_KEY'] = 'test'
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        self.client = self.app.test_client()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def add(self, title, verified=False, **keys):
+        file = File(title_proper=title, verified=verified,
+                    **dict(KEYS, **keys))
+        db.session.add(file)
+        db.session.commit()
+        return file
+
+    def test_keyword_counts(self):
+        file = self.add('会议纪要')
+        self.add('会议记录', key_where='上海')
+        self.add('会议议程', verified=True)
+        facets = keyword_facets(file)
+        self.assertIn(('1', '何人', '张三', 2), facets)
+        self.assertIn(('4', '何地', '北京', 1), facets)
+        self.assertEqual(len(facets), 6)
+
+        response = self.client.get('/knowledge/%d' % file.id)
+        self.assertEqual(response.status_code, 200)
+        html = response.get_data(as_text=True)
+        self.assertIn('何人：张三</a></span>\n        <span class="badge">2',
+                      html)
+
+    def test_keyword_pages(self):
+        self.app.config['METADATA_FILES_PER_PAGE'] = 2
+        for i in range(3):
+            self.add('会议纪要%d' % i)
+        self.add('会议纪要9', verified=True)
+        self.add('会议纪要8', key_who='李四')
+        pages = [self.client.get('/search-result/1-张三?page=%d' % page)
+                 .get_data(as_text=True) for page in (1, 2)]
+        for i in range(3):
+            self.assertEqual(sum('会议纪要%d' % i in page for page in pages), 1)
+        self.assertFalse(any('会议纪要9' in page or '会议纪要8' in page
+                             for page in pages))
@@ -0,0 +1,66 @@
+# -*- coding:utf-8 -*-
+import shutil
+import tempfile
+import unittest
+from app import create_app, db, fragment_cache
+from app.models import File, Dossier
+
+
+class FilePageCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.app = create_app('test')
+        self.app.config.update(SECRET_KEY='test', FRAGMENT_CACHE_TTL=600,
+                               FRAGMENT_CACHE_DIR=self.dir)
+        fragment_cache.init_app(self.app)
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        self.dossier = Dossier(name='一号全宗')
+        self.file = File(title_proper='会议纪要', dossier=self.dossier)
+        db.session.add(self.file)
+        db.session.commit()
+        self.url = '/file-profile/%d' % self.file.id
+        self.client = self.app.test_client()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+        shutil.rmtree(self.dir)
+
+    def get(self, **headers):
+        return self.client.get(self.url, headers=headers)
+
+    def test_conditional_get(self):
+        response = self.get()
+        self.assertEqual(response.status_code, 200)
+        etag = response.headers['ETag']
+        self.assertEqual(response.headers['Cache-Control'],
+                         'private, no-cache')
+        self.assertEqual(self.get(**{'If-None-Match': etag}).status_code, 304)
+
+        self.file.title_proper = '会议记录'
+        db.session.commit()
+        response = self.get(**{'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response.headers['ETag'], etag)
+        self.assertIn('会议记录', response.get_data(as_text=True))
+
+    def test_fragment_reused_until_changed(self):
+        self.get()
+        # 不经过ORM的修改不会递增row_version，页面仍取自缓存
+        db.session.execute(File.__table__.update()
+                           .values(title_proper='绕过缓存'))
+        db.session.commit()
+        self.assertIn('会议纪要', self.get().get_data(as_text=True))
+        # 其他进程写入的片段文件同样可用
+        fragment_cache._entries.clear()
+        self.assertIn('会议纪要', self.get().get_data(as_text=True))
+
+        # 案卷改名使其下档案的片段失效
+        self.dossier.name = '二号全宗'
+        db.session.commit()
+        html = self.get().get_data(as_text=True)
+        self.assertIn('绕过缓存', html)
+        self.assertIn('二号全宗', html)
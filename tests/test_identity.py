@@ -0,0 +1,82 @@
+import time
+import unittest
+from app import create_app, db, identity_cache
+from app.identity import IdentityCache
+from app.models import User, Role, Permission, load_user
+
+
+class IdentityCacheTestCase(unittest.TestCase):
+    def test_least_recently_used_is_evicted(self):
+        cache = IdentityCache()
+        cache.size = 2
+        cache.put(1, 'a')
+        cache.put(2, 'b')
+        cache.get(1)
+        cache.put(3, 'c')
+        self.assertEqual(cache.get(1), 'a')
+        self.assertIsNone(cache.get(2))
+        self.assertEqual(cache.get(3), 'c')
+
+    def test_expiry_and_invalidate(self):
+        cache = IdentityCache()
+        cache.put(1, 'a')
+        cache.put(2, 'b')
+        cache.invalidate(1)
+        self.assertIsNone(cache.get(1))
+        cache.invalidate()
+        self.assertIsNone(cache.get(2))
+        cache.ttl = 0.05
+        cache.put(3, 'c')
+        self.assertEqual(cache.get(3), 'c')
+        time.sleep(0.1)
+        self.assertIsNone(cache.get(3))
+
+
+class LoadUserTestCase(unittest.TestCase):
+    """TestConfig中不缓存，这里临时打开"""
+
+    def setUp(self):
+        self.app = create_app('test')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        identity_cache.ttl = 60
+        identity_cache.invalidate()
+
+    def tearDown(self):
+        identity_cache.ttl = 0
+        identity_cache.invalidate()
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def test_cached_until_role_changes(self):
+        role = Role(name='User', permissions=Permission.UPLOAD_FILE)
+        user = User(email='a@example.com', username='a', password='cat',
+                    role=role)
+        db.session.add(user)
+        db.session.commit()
+        user_id, role_id = user.id, role.id
+        # 每个请求开始时会话是空的
+        db.session.remove()
+        self.assertTrue(load_user(str(user_id)).can(Permission.UPLOAD_FILE))
+        self.assertIsNotNone(identity_cache.get(user_id))
+        db.session.remove()
+        Role.query.get(role_id).permissions = 0
+        db.session.commit()
+        self.assertIsNone(identity_cache.get(user_id))
+        self.assertFalse(load_user(str(user_id)).can(Permission.UPLOAD_FILE))
+
+    def test_objects_already_in_session_stay_attached(self):
+        role = Role(name='User', permissions=Permission.UPLOAD_FILE)
+        user = User(email='a@example.com', username='a', password='cat',
+                    role=role)
+        db.session.add(user)
+        db.session.commit()
+        self.assertIs(load_user(str(user.id)), user)
+        self.assertIn(role, db.session)
+        role.permissions = 0
+        db.session.commit()
+        role_id = role.id
+        db.session.remove()
+        self.assertEqual(Role.query.get(role_id).permissions, 0)
@@ -0,0 +1,80 @@
+# -*- coding:utf-8 -*-
+import os
+import tempfile
+import unittest
+from unittest import mock
+from app import db
+from app.models import File, FileChange
+from app.upload.views import REQUIRED_FIELDS
+
+
+class ManagerTestCase(unittest.TestCase):
+    def setUp(self):
+        with mock.patch.dict(os.environ, METADATA_CONFIG='test'):
+            import manage
+        self.manager = manage.manager
+
+    def test_parser_builds(self):
+        # 任一命令的选项冲突都会使所有命令无法运行
+        parser = self.manager.create_parser('manage.py')
+        args = parser.parse_args(['db', 'upgrade'])
+        self.assertEqual(args.func_stack[-1].__class__.__name__, 'Command')
+
+    def test_import_manifest_options(self):
+        parser = self.manager.create_parser('manage.py')
+        args = parser.parse_args(['import-manifest', 'a.csv', '-u', 'admin',
+                                  '-p', '2', '-n', '100'])
+        self.assertEqual((args.path, args.creator, args.procs, args.chunk),
+                         ('a.csv', 'admin', 2, 100))
+        args = parser.parse_args(['import-manifest', 'a.csv'])
+        self.assertEqual((args.creator, args.procs, args.chunk),
+                         (None, 0, 500))
+
+
+class ImportManifestTestCase(unittest.TestCase):
+    def setUp(self):
+        with mock.patch.dict(os.environ, METADATA_CONFIG='test'):
+            import manage
+        self.manager = manage.manager
+        self.app_context = manage.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        fd, self.path = tempfile.mkstemp(suffix='.csv')
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            f.write(','.join(REQUIRED_FIELDS) + '\n')
+            for i in range(25):
+                f.write('题名%d,张三,2017,北京,会议,A1,李四,2017-01-01,'
+                        'ID%d\n' % (i, i))
+
+    def tearDown(self):
+        os.remove(self.path)
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def import_manifest(self):
+        with mock.patch('builtins.print') as out:
+            self.manager.handle('manage.py', ['import-manifest', self.path,
+                                              '-n', '10'])
+        return [call[0][0] for call in out.call_args_list]
+
+    def test_import(self):
+        self.import_manifest()
+        files = File.query.order_by(File.id).all()
+        self.assertEqual(len(files), 25)
+        changes = FileChange.query.filter_by(action=FileChange.CREATE)
+        self.assertEqual(sorted(change.file_id for change in changes),
+                         [file.id for file in files])
+
+    def test_failed_row_does_not_fail_chunk(self):
+        db.session.execute(
+            "CREATE TRIGGER reject BEFORE INSERT ON files "
+            "WHEN NEW.title_proper = '题名13' "
+            "BEGIN SELECT RAISE(ABORT, 'rejected'); END")
+        db.session.commit()
+        output = self.import_manifest()
+        self.assertEqual(File.query.count(), 24)
+        self.assertIsNone(File.query.filter_by(title_proper='题名13').first())
+        self.assertEqual(FileChange.query.count(), 24)
+        self.assertEqual([line for line in output if line.startswith('第')],
+                         ['第15行：写入数据库失败：rejected'])
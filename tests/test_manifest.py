@@ -0,0 +1,49 @@
+# -*- coding:utf-8 -*-
+import io
+import unittest
+from app import manifest
+
+
+class ManifestTestCase(unittest.TestCase):
+    def setUp(self):
+        manifest._init_worker(dict(
+            required=('title_proper',),
+            choices={'language': {'中文': 1, '英语': 2}},
+            lengths=dict((field, 128) for field in manifest.IMPORT_FIELDS),
+            dossiers={'一号全宗': 1},
+            title_keys={'已有题名'},
+            users={'admin': 7},
+            creator_id=None
+        ))
+
+    def test_headers_by_label_or_field(self):
+        data = '正题名,language,全宗或类,备注\r\n题名,中文,一号全宗,x\r\n'
+        rows = list(manifest.read_rows(io.BytesIO(data.encode('utf-8')),
+                                       'a.csv'))
+        columns, ignored = manifest.map_columns(rows[0][1])
+        self.assertEqual(columns, {0: 'title_proper', 1: 'language',
+                                   2: 'dossier'})
+        self.assertEqual(ignored, ['备注'])
+        values = dict((field, rows[1][1][i]) for i, field in columns.items())
+        line, mapping, errors = manifest.validate_row(2, values)
+        self.assertEqual(errors, [])
+        self.assertEqual(mapping['dossier_id'], 1)
+        self.assertEqual(mapping['language_id'], 1)
+        self.assertNotIn('language', mapping)
+        self.assertEqual(mapping['title_key'], '题名')
+
+    def test_row_errors(self):
+        line, mapping, errors = manifest.validate_row(
+            3, dict(language='火星文', dossier='不存在', creator='admin'))
+        self.assertIsNone(mapping)
+        self.assertEqual(len(errors), 3)
+
+    def test_existing_title(self):
+        line, mapping, errors = manifest.validate_row(
+            4, dict(title_proper='已有 题名！'))
+        self.assertIsNone(mapping)
+        self.assertEqual(len(errors), 1)
+
+    def test_unsupported_format(self):
+        with self.assertRaises(manifest.ManifestError):
+            next(manifest.read_rows(io.BytesIO(b''), 'a.txt'))
@@ -0,0 +1,27 @@
+import unittest
+from datetime import datetime, timedelta
+from app.oai.views import encode_token, decode_token, parse_datestamp, \
+    OAIError
+from app.pagination import encode_cursor
+
+
+class ResumptionTokenTestCase(unittest.TestCase):
+    def test_round_trip(self):
+        ts = datetime(2017, 5, 1, 8, 30, 0, 123456)
+        token = encode_token(encode_cursor(ts, 42), 'oai_dc',
+                             '2017-05-01', None)
+        self.assertEqual(decode_token(token),
+                         ((ts, 42), 'oai_dc', '2017-05-01', None))
+
+    def test_bad_token(self):
+        with self.assertRaises(OAIError) as cm:
+            decode_token('garbage')
+        self.assertEqual(cm.exception.code, 'badResumptionToken')
+
+    def test_datestamp_granularity(self):
+        self.assertEqual(parse_datestamp('2017-05-01'),
+                         (datetime(2017, 5, 1), timedelta(days=1)))
+        self.assertEqual(parse_datestamp('2017-05-01T08:00:00Z')[1],
+                         timedelta(seconds=1))
+        with self.assertRaises(OAIError):
+            parse_datestamp('2017/05/01')
@@ -0,0 +1,15 @@
+import unittest
+from datetime import datetime
+from app.pagination import encode_cursor, decode_cursor
+
+
+class CursorTestCase(unittest.TestCase):
+    def test_round_trip(self):
+        for ts in (datetime(2017, 5, 1, 8, 30, 0),
+                   datetime(2017, 5, 1, 8, 30, 0, 123456)):
+            self.assertEqual(decode_cursor(encode_cursor(ts, 42)), (ts, 42))
+
+    def test_invalid_cursor(self):
+        self.assertIsNone(decode_cursor(''))
+        self.assertIsNone(decode_cursor('not-a-cursor'))
+        self.assertIsNone(decode_cursor(encode_cursor(datetime.now(), 1)[:-4]))
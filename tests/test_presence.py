@@ -0,0 +1,48 @@
+# -*- coding:utf-8 -*-
+import unittest
+from app import create_app, db, presence_tracker
+from app.models import User, Role
+
+
+class PresenceTrackerTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app('test')
+        self.app.config.update(SECRET_KEY='test', WTF_CSRF_ENABLED=False)
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        role = Role(name='User', permissions=0)
+        self.user = User(email='a@example.com', username='a',
+                         password='cat', confirmed=True, role=role)
+        db.session.add(self.user)
+        db.session.commit()
+        self.user_id = self.user.id
+        self.client = self.app.test_client(use_cookies=True)
+        self.client.post('/auth/login/', data=dict(
+            email='a@example.com', password='cat'))
+
+    def tearDown(self):
+        presence_tracker.flush()
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def last_seen(self):
+        return db.session.query(User.last_seen) \
+            .filter_by(id=self.user_id).scalar()
+
+    def test_buffered_until_flush(self):
+        before = self.last_seen()
+        self.client.get('/scan')
+        # 请求中不写users表
+        self.assertEqual(self.last_seen(), before)
+        self.assertEqual(presence_tracker.flush(), 1)
+        self.assertGreater(self.last_seen(), before)
+        self.assertEqual(presence_tracker.flush(), 0)
+
+    def test_one_write_per_granularity(self):
+        self.client.get('/scan')
+        self.client.get('/scan')
+        self.assertEqual(presence_tracker.flush(), 1)
+        self.client.get('/scan')
+        self.assertEqual(presence_tracker.flush(), 0)
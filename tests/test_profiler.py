@@ -0,0 +1,53 @@
+# -*- coding:utf-8 -*-
+import json
+import unittest
+from app import create_app, db, query_profiler
+from app.models import User, Role, File
+
+
+class QueryProfilerTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app('test')
+        self.app.config.update(SECRET_KEY='test', WTF_CSRF_ENABLED=False)
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        self.client = self.app.test_client(use_cookies=True)
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def test_off_by_default(self):
+        response = self.client.get('/scan')
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('X-DB-Query-Count', response.headers)
+
+    def test_request_stats(self):
+        self.app.config.update(METADATA_QUERY_PROFILING=True,
+                               METADATA_SLOW_DB_QUERY_TIME=0)
+        query_profiler.init_app(self.app)
+        role = Role(name='Administrator', permissions=0xff)
+        db.session.add(User(email='a@example.com', username='a',
+                            password='cat', confirmed=True, role=role))
+        db.session.add(File(title_proper='会议纪要', key_who='张三',
+                            key_why='汇报', key_when='2017', key_where='北京',
+                            key_how='书面', key_what='会议'))
+        db.session.commit()
+        self.client.post('/auth/login/', data=dict(
+            email='a@example.com', password='cat'))
+
+        response = self.client.get('/scan')
+        self.assertEqual(response.status_code, 200)
+        self.assertGreater(int(response.headers['X-DB-Query-Count']), 0)
+        self.assertTrue(response.headers['X-DB-Query-Time'].endswith('ms'))
+        self.assertIn('X-DB-Duplicate-Queries', response.headers)
+
+        report = json.loads(self.client.get('/admin/query-stats')
+                            .get_data(as_text=True))
+        self.assertTrue(report['enabled'])
+        self.assertIn('/scan', [entry['path'] for entry in report['requests']])
+        # 阈值为0时每条语句都记入慢查询日志
+        self.assertIn('main.scan', [entry['endpoint']
+                                    for entry in report['slow_queries']])
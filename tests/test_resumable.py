@@ -0,0 +1,69 @@
+import io
+import os
+import shutil
+import tempfile
+import time
+import unittest
+from unittest import mock
+from app.resumable import ResumableUploads, UploadError
+from app.storage import BlobStorage
+
+
+class ResumableUploadsTestCase(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.storage = BlobStorage()
+        self.storage.root = self.root
+        self.uploads = ResumableUploads()
+        self.uploads.staging_dir = os.path.join(self.root, '.staging')
+        os.makedirs(self.uploads.staging_dir)
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def test_resume_after_partial_upload(self):
+        manifest = self.uploads.create(1, 'a.mp4', 10, {})
+        self.uploads.write_chunk(manifest['id'], 0, io.BytesIO(b'01234'))
+        # 新实例模拟进程重启后从清单继续
+        restarted = ResumableUploads()
+        restarted.staging_dir = self.uploads.staging_dir
+        self.assertEqual(restarted.load(manifest['id'])['offset'], 5)
+        restarted.write_chunk(manifest['id'], 5, io.BytesIO(b'56789'))
+        manifest, blob = restarted.finalize(manifest['id'], self.storage)
+        with open(blob.path, 'rb') as f:
+            self.assertEqual(f.read(), b'0123456789')
+        self.assertEqual(os.listdir(self.uploads.staging_dir), [])
+
+    def test_gap_is_rejected(self):
+        manifest = self.uploads.create(1, 'a.mp4', 10, {})
+        with self.assertRaises(UploadError) as cm:
+            self.uploads.write_chunk(manifest['id'], 3, io.BytesIO(b'x'))
+        self.assertEqual(cm.exception.status, 409)
+
+    def test_sweep_skips_foreign_files(self):
+        path = os.path.join(self.uploads.staging_dir, 'notes.json')
+        with open(path, 'w') as f:
+            f.write('{}')
+        self.assertEqual(self.uploads.sweep(time.time() + 2 * 24 * 3600), 0)
+        self.assertTrue(os.path.exists(path))
+
+    def test_sweep_removes_expired(self):
+        manifest = self.uploads.create(1, 'a.mp4', 10, {})
+        self.uploads.write_chunk(manifest['id'], 0, io.BytesIO(b'01234'))
+        # 清单排在数据文件之前：清单过期时数据文件已一并删除
+        names = sorted(os.listdir(self.uploads.staging_dir))
+        with mock.patch('app.resumable.os.listdir', return_value=names):
+            self.assertEqual(
+                self.uploads.sweep(time.time() + 2 * 24 * 3600), 1)
+        with self.assertRaises(UploadError):
+            self.uploads.load(manifest['id'])
+        self.assertEqual(os.listdir(self.uploads.staging_dir), [])
+
+    def test_sweep_removes_stale_manifest_tmp(self):
+        manifest = self.uploads.create(1, 'a.mp4', 10, {})
+        path = os.path.join(self.uploads.staging_dir,
+                            manifest['id'] + '.json.tmp')
+        with open(path, 'w') as f:
+            f.write('{')
+        self.uploads.sweep(time.time() + 2 * 24 * 3600)
+        self.assertFalse(os.path.exists(path))
@@ -0,0 +1,109 @@
+# -*- coding:utf-8 -*-
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+from config import TestConfig
+from app import create_app, db, search_indexer
+from app.models import File
+from app.outbox import Outbox
+from app.search import paginate_search, rebuild_index
+
+
+class SearchIndexerTestCase(unittest.TestCase):
+    def setUp(self):
+        # create_app时即打开索引，先清空上次测试留下的索引
+        shutil.rmtree(TestConfig.WHOOSH_BASE, ignore_errors=True)
+        self.dir = tempfile.mkdtemp()
+        self.app = create_app('test')
+        self.app.config['SECRET_KEY'] = 'test'
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        search_indexer.outbox = Outbox(os.path.join(self.dir, 'queue.sqlite'),
+                                       'search_index')
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+        shutil.rmtree(self.dir)
+
+    def search(self, text, per_page=10):
+        with self.app.test_request_context():
+            return paginate_search(File.query, text, 1, per_page)
+
+    def test_commit_queues_changes(self):
+        file = File(title_proper='会议纪要')
+        db.session.add(file)
+        db.session.flush()
+        self.assertEqual(search_indexer.outbox.depth(), 0)
+        db.session.commit()
+        self.assertEqual(search_indexer.outbox.depth(), 1)
+        # 提交的请求不写索引，由队列的消费者写入
+        self.assertEqual(self.search('会议').total, 0)
+        self.assertEqual(search_indexer.drain(), 1)
+        self.assertEqual(search_indexer.outbox.depth(), 0)
+        id = file.id
+        self.assertEqual([f.id for f in self.search('会议').items], [id])
+
+        File.query.get(id).verified = True
+        db.session.commit()
+        search_indexer.drain()
+        self.assertEqual(self.search('会议').total, 0)
+
+    def test_rebuild_swaps_index(self):
+        db.session.add_all([File(title_proper='会议纪要'),
+                            File(title_proper='会议记录', verified=True)])
+        db.session.commit()
+        base = os.path.join(self.app.config['WHOOSH_BASE'], 'File')
+        # 第一次重建时原有的索引目录被替换为链接
+        with mock.patch('time.time', return_value=1500000000.0):
+            self.assertEqual(rebuild_index(self.app, File, procs=1), 1)
+        self.assertTrue(os.path.islink(base))
+        first = os.path.realpath(base)
+        self.assertEqual(self.search('会议').total, 1)
+
+        db.session.add(File(title_proper='会议议程'))
+        db.session.commit()
+        # 同一秒内再次重建
+        with mock.patch('time.time', return_value=1500000000.0):
+            self.assertEqual(rebuild_index(self.app, File, procs=1), 2)
+        self.assertNotEqual(os.path.realpath(base), first)
+        self.assertFalse(os.path.exists(first))
+        self.assertEqual(self.search('会议').total, 2)
+        self.assertEqual([name for name in os.listdir(os.path.dirname(base))
+                          if name.startswith('File.')],
+                         [os.path.basename(os.path.realpath(base))])
+
+    def test_search_pages(self):
+        self.app.config['METADATA_FILES_PER_PAGE'] = 2
+        # 搜索结果页为每个关键词生成链接
+        keys = dict(key_who='张三', key_why='汇报', key_when='2017',
+                    key_where='北京', key_how='书面', key_what='事务')
+        db.session.add_all([File(title_proper='会议纪要', **keys),
+                            File(title_proper='会议记录', **keys),
+                            File(title_proper='会议议程',
+                                 **dict(keys, key_what='会议')),
+                            File(title_proper='工作总结', **keys)])
+        db.session.commit()
+        search_indexer.drain()
+        pagination = self.search('会议', per_page=2)
+        self.assertEqual((pagination.total, pagination.pages), (3, 2))
+        # 两个字段都命中的排在最前
+        self.assertEqual(pagination.items[0].title_proper, '会议议程')
+
+        client = self.app.test_client()
+        pages = [client.get('/search-result/?search=会议&page=%d' % page)
+                 .get_data(as_text=True) for page in (1, 2)]
+        for title in ('会议纪要', '会议记录', '会议议程'):
+            self.assertEqual(sum(title in page for page in pages), 1)
+        self.assertFalse(any('工作总结' in page for page in pages))
+
+    def test_rollback_discards_changes(self):
+        db.session.add(File(title_proper='会议纪要'))
+        db.session.flush()
+        db.session.rollback()
+        db.session.commit()
+        self.assertEqual(search_indexer.outbox.depth(), 0)
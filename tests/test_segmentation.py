@@ -0,0 +1,44 @@
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+import jieba
+from flask import Flask
+from app import create_app, jieba_dictionary
+from app.segmentation import JiebaDictionary
+
+
+class JiebaDictionaryTestCase(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.user_dict = os.path.join(self.dir, 'user.dict')
+        with open(self.user_dict, 'w', encoding='utf-8') as f:
+            f.write('档案著录细则 100000 n\n')
+        self.app = create_app('test')
+        self.app.config['JIEBA_USER_DICT'] = self.user_dict
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+
+    def tearDown(self):
+        self.app_context.pop()
+        jieba_dictionary.user_dict = None
+        shutil.rmtree(self.dir)
+
+    def test_user_dict_after_initialize(self):
+        # jieba已被其他代码初始化，自定义词典仍要载入
+        jieba.initialize()
+        timings = jieba_dictionary.load()
+        self.assertIn('user_dict', timings)
+        self.assertIn('analyzer', timings)
+        self.assertIn('档案著录细则', jieba.lcut('档案著录细则修订'))
+        self.assertEqual(jieba_dictionary.load(), {})
+
+    def test_preload_only_when_enabled(self):
+        app = Flask(__name__)
+        with mock.patch.object(JiebaDictionary, 'load') as load:
+            JiebaDictionary(app)
+            self.assertFalse(load.called)
+            app.config['JIEBA_PRELOAD'] = True
+            JiebaDictionary(app)
+            self.assertTrue(load.called)
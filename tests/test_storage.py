@@ -0,0 +1,37 @@
+import hashlib
+import io
+import os
+import shutil
+import tempfile
+import unittest
+from app.storage import BlobStorage
+
+
+class BlobStorageTestCase(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.storage = BlobStorage()
+        self.storage.root = self.root
+        self.storage.chunk_size = 7
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def test_content_address(self):
+        data = b'archive content' * 10
+        blob = self.storage.save_stream(io.BytesIO(data))
+        digest = hashlib.sha256(data).hexdigest()
+        self.assertEqual(blob.digest, digest)
+        self.assertEqual(blob.size, len(data))
+        self.assertTrue(blob.created)
+        self.assertEqual(blob.path, self.storage.path_for(digest))
+        with open(blob.path, 'rb') as f:
+            self.assertEqual(f.read(), data)
+
+    def test_duplicate_is_skipped(self):
+        first = self.storage.save_stream(io.BytesIO(b'same'))
+        second = self.storage.save_stream(io.BytesIO(b'same'))
+        self.assertTrue(first.created)
+        self.assertFalse(second.created)
+        self.assertEqual(first.path, second.path)
+        self.assertEqual(os.listdir(self.storage.tmp_dir), [])
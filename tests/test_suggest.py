@@ -0,0 +1,67 @@
+import unittest
+from app import create_app, db, suggestions
+from app.models import File, Dossier
+from app.suggest import PrefixIndex, lazy_pinyin
+
+
+class PrefixIndexTestCase(unittest.TestCase):
+    def test_search_orders_by_count(self):
+        index = PrefixIndex()
+        index.add('北京', 1)
+        index.add('北京市', 5)
+        index.add('上海', 3)
+        self.assertEqual(index.search('北'), ['北京市', '北京'])
+        self.assertEqual(index.search('北', limit=1), ['北京市'])
+        self.assertEqual(index.search('南'), [])
+
+    def test_remove(self):
+        index = PrefixIndex()
+        index.add('Archive', 2)
+        self.assertEqual(index.search('arc'), ['Archive'])
+        index.remove('Archive')
+        self.assertEqual(index.search('arc'), ['Archive'])
+        index.remove('Archive')
+        self.assertEqual(index.search('arc'), [])
+
+    @unittest.skipIf(lazy_pinyin is None, 'pypinyin未安装')
+    def test_pinyin(self):
+        index = PrefixIndex()
+        index.add('档案馆')
+        self.assertEqual(index.search('danga'), ['档案馆'])
+        self.assertEqual(index.search('dag'), ['档案馆'])
+
+
+class SuggestionIndexTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app('test')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        suggestions.build()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        suggestions.indexes = None
+        self.app_context.pop()
+
+    def test_flushed_changes_update_index(self):
+        dossier = Dossier(name='一号全宗')
+        file = File(title_proper='会议纪要', key_who='张三', dossier=dossier)
+        db.session.add(file)
+        db.session.commit()
+        self.assertEqual(suggestions.suggest('key_who', '张'), ['张三'])
+        self.assertEqual(suggestions.suggest('dossier', '一号'), ['一号全宗'])
+        file.key_who = '李四'
+        db.session.commit()
+        self.assertEqual(suggestions.suggest('key_who', '张'), [])
+        self.assertEqual(suggestions.suggest('key_who', '李'), ['李四'])
+        db.session.delete(file)
+        db.session.commit()
+        self.assertEqual(suggestions.suggest('key_who', '李'), [])
+
+    def test_rollback_discards_changes(self):
+        db.session.add(File(title_proper='会议纪要', key_who='张三'))
+        db.session.flush()
+        db.session.rollback()
+        self.assertEqual(suggestions.suggest('key_who', '张'), [])
@@ -0,0 +1,48 @@
+import unittest
+from werkzeug.datastructures import MultiDict
+from wtforms import Form
+from app import create_app, db, tag_service
+from app.models import Tag, TagListField
+from app.tags import TagService
+
+
+class TagServiceTestCase(unittest.TestCase):
+    def test_normalize(self):
+        names = TagService.normalize([' 档案 ', 'Python', 'python', '', '档案'])
+        self.assertEqual(list(names.items()),
+                         [('档案', '档案'), ('python', 'Python')])
+
+    def test_form_keeps_names_until_populate(self):
+        # 校验之前不解析标签，不访问数据库
+        class TagForm(Form):
+            tags = TagListField()
+
+        form = TagForm(MultiDict([('tags', '档案，Python, ')]))
+        self.assertEqual(form.tags.data, ['档案', 'Python'])
+        self.assertEqual(form.tags._value(), '档案, Python')
+
+
+class ResolveTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app('test')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        tag_service.forget()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        tag_service.forget()
+        self.app_context.pop()
+
+    def test_case_insensitive_beyond_ascii(self):
+        first = tag_service.resolve(['ÄRCHIV', 'Python'])
+        db.session.commit()
+        # 其他进程的词典中没有这些标签
+        tag_service.forget()
+        second = tag_service.resolve(['ärchiv', 'python', '档案'])
+        self.assertEqual([tag.id for tag in second[:2]],
+                         [tag.id for tag in first])
+        self.assertEqual(Tag.query.count(), 3)
+        self.assertEqual(Tag.query.get(first[0].id).name_key, 'ärchiv')
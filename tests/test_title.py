@@ -0,0 +1,12 @@
+import unittest
+from app.models import normalize_title
+
+
+class NormalizeTitleTestCase(unittest.TestCase):
+    def test_width_case_space_and_punctuation(self):
+        self.assertEqual(normalize_title('《档案 学》（ＡＢＣ１）'),
+                         normalize_title('档案学(abc1)'))
+        self.assertEqual(normalize_title('档案　学，概论。'), '档案学概论')
+
+    def test_empty(self):
+        self.assertEqual(normalize_title(None), '')